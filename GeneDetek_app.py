@@ -1,38 +1,67 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import streamlit as st
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from scipy.interpolate import interp1d
-from scipy.stats import linregress, t
-import requests
 import datetime
+from analysis import measure_current, determine_result, classify_currents, calibration_intervals
+from calibration_store import (init_schema, sync_from_csv, latest_version, calibration_model, add_points,
+                               list_versions)
+from downsample import MinMaxPyramid
+from instrument_reader import read_metadata, current_columns
+from parse_cache import ParsedFileCache
+from instrumentation import timed, snapshot, write_metrics, profiled, profile_text, profile_bytes
+from report import render_report, DOCX_MIME
+from results_store import (thread_connection, file_hash, save_run, update_patient, query_runs, count_runs,
+                           calibration_versions)
 
-def read_calibration_curve_csv(filename):
-    # Read calibration curve data from CSV
+# Startup: matplotlib, scipy and python-docx are imported by the functions that
+# use them, and nothing here reads files at import time, so a new container
+# renders the page without waiting for them.
+
+# Calibration versions never change once written, so the model of a version
+# is built once and only the latest version id is looked up on each rerun
+@st.cache_data(show_spinner=False, max_entries=16)
+def _cached_calibration_model(version, _store):
+    return calibration_model(_store, version)
+
+# The latest calibration version, as the command-line tools use it. The
+# calibration CSV is added as a new version whenever it changes.
+def load_calibration_model(store, filename):
     try:
-        calibration_data = pd.read_csv(filename)
-        concentration = calibration_data['Concentration']
-        current_response = calibration_data['Current']
-        return concentration, current_response
+        sync_from_csv(store, filename)
+        return _cached_calibration_model(latest_version(store), store)
     except Exception as e:
         st.error(f"Error reading {filename}: {e}")
         return None
 
-def create_calibration_function(concentration, current_response):
-    # Interpolate the calibration curve data to obtain a function
-    # Use the 'fill_value' parameter to allow extrapolation
-    current_response = current_response[1:]# To get only one zero value
-    concentration = concentration[1:]# To get only one zero value
-    # Fit a linear regression model
-    slope, intercept, r_value, p_value, std_err = linregress(concentration, current_response)
-    # Create a function using the slope and intercept
-    calibration_function = lambda y: (y - intercept)/slope
-    
-    return calibration_function, slope, intercept, r_value, std_err
-
-def plot_calibration_curve(concentration, current_response):
-    # Fit the calibration curve
-    calibration_function, slope, intercept, r_value, std_err = create_calibration_function(concentration, current_response)
+# Runs before the rerun the form submits, so the page shows the new version.
+# Streamlit calls it on the thread of that rerun, which may not be the one
+# that drew the form, so it takes that thread's own connection.
+def _add_calibration_point():
+    state = st.session_state
+    version = add_points(results_store(), [(state['calibration_concentration'], state['calibration_current'])],
+                         state['calibration_note'] or None)
+    state['calibration_message'] = f"Added calibration version v{version}"
+
+def calibration_versions_view(store, calibration):
+    with st.expander(f"Calibration version {calibration.version}"):
+        if 'calibration_message' in st.session_state:
+            st.success(st.session_state.pop('calibration_message'))
+        with st.form('calibration_point', clear_on_submit=True):
+            st.number_input("Concentration (nM)", min_value=0.0, step=1.0, key='calibration_concentration')
+            st.number_input("Current (µA)", step=0.01, format="%.4f", key='calibration_current')
+            st.text_input("Lot / note", key='calibration_note')
+            st.form_submit_button("Add calibration point", on_click=_add_calibration_point)
+        st.dataframe(list_versions(store), hide_index=True, use_container_width=True)
+
+@timed('plot_calibration_curve')
+def plot_calibration_curve(model):
+    import matplotlib.pyplot as plt
+    concentration = pd.Series(model.concentration)
+    current_response = pd.Series(model.current_response)
+    slope, intercept, r_value = model.slope, model.intercept, model.r_value
 
     # Generate points for the fitted line
     x_fit = np.linspace(concentration.min(), concentration.max(), 100)
@@ -58,45 +87,256 @@ def plot_calibration_curve(concentration, current_response):
 
     return fig
 
-# Read CSV for CV data
-def read_csv_result(file_path):
+# Render the calibration plot once per calibration version
+@st.cache_data(show_spinner=False, max_entries=16)
+@timed('calibration_plot_png')
+def calibration_plot_png(version, _model):
+    import matplotlib.pyplot as plt
+    fig = plot_calibration_curve(_model)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight')
+    plt.close(fig)
+    return buffer.getvalue()
+
+UNCERTAINTY_METHODS = {'Bootstrap': 'bootstrap', 'Monte Carlo': 'monte_carlo'}
+LOD_RESAMPLES = 100_000
+
+# Resampled confidence intervals of the calibration, once per version and method
+@st.cache_data(show_spinner=False, max_entries=16)
+@timed('calibration_intervals')
+def lod_intervals(version, method, _model):
+    return calibration_intervals(_model.concentration, _model.current_response, method, LOD_RESAMPLES)
+
+# Min/max buckets of the raw trace view (two points each), whatever the file length
+TRACE_BUCKETS = 2000
+# Samples averaged by determine_steady_state_current
+STEADY_STATE_WINDOW = 10
+
+# Parsed uploads are kept as .npy files keyed by content hash, so a file that
+# is uploaded again is memory-mapped instead of parsed
+PARSE_CACHE_DIR = os.environ.get('GENEDETEK_PARSE_CACHE', os.path.join('cache', 'parsed'))
+PARSE_CACHE_MB = int(os.environ.get('GENEDETEK_PARSE_CACHE_MB', '1024'))
+
+@st.cache_resource
+def parse_cache():
+    return ParsedFileCache(PARSE_CACHE_DIR, PARSE_CACHE_MB << 20)
+
+# Parsed upload with a min/max pyramid per scan. cache_resource keeps the
+# arrays in memory without copying them on every rerun.
+@st.cache_resource(max_entries=4, show_spinner="Reading trace...")
+def load_trace(content_hash, _raw):
+    metadata, values = parse_cache().read(_raw)
+    columns = current_columns(metadata)
+    currents = values[:, columns]
+    if not currents.size or np.isnan(currents).all():
+        raise ValueError("the file has no current values")
+    peak_row, peak_scan = np.unravel_index(np.nanargmax(currents), currents.shape)
+    return {'technique': metadata.get('technique', 'CV'),
+            'x': [values[:, column - 1] for column in columns],
+            'pyramids': [MinMaxPyramid(values[:, column]) for column in columns],
+            'peak': (int(peak_scan), int(peak_row))}
+
+# Downsampled raw trace with the peak, and for chronoamperometry the
+# steady-state window, marked. Zooming re-aggregates from the pyramids, so the
+# cost of a rerun depends on TRACE_BUCKETS and not on the file length. A file
+# that cannot be read gets a warning instead, so the other uploads can still
+# be analyzed.
+@timed('raw_trace_view')
+def raw_trace_view(raw, name):
+    import altair as alt
+
     try:
-        # Read the file with the appropriate handling for bad lines.
-        # The 'on_bad_lines' parameter is set to 'skip' to ignore problematic lines.
-        data = pd.read_csv(file_path, delimiter=',', skiprows=6,usecols=[1, 3, 5, 7], on_bad_lines='skip',encoding='utf-16')
-        return data
+        trace = load_trace(file_hash(raw), raw)
     except Exception as e:
-        print(f"An error occurred: {e}")
-        return None
+        st.warning(f"Cannot show the raw trace of {name}: {e}")
+        return
+    chronoamperometry = trace['technique'] == 'CA'
+    peak_scan, peak_row = trace['peak']
+    n_samples = len(trace['pyramids'][0])
+    with st.expander("Raw trace", expanded=True):
+        if chronoamperometry:
+            scans = [0]
+            time = trace['x'][0]
+            low, high = st.slider("Time (s)", float(time[0]), float(time[-1]), (float(time[0]), float(time[-1])),
+                                  key='trace_range')
+            start, stop = np.searchsorted(time, low), np.searchsorted(time, high, side='right')
+        else:
+            labels = [f"Scan {scan + 1}" for scan in range(len(trace['pyramids']))]
+            chosen = st.multiselect("Scans", labels, default=[labels[peak_scan]], key='trace_scans')
+            scans = [labels.index(label) for label in chosen] or [peak_scan]
+            start, stop = st.slider("Points", 0, n_samples, (0, n_samples), key='trace_range')
+
+        frames = []
+        for scan in scans:
+            rows = trace['pyramids'][scan].indices(TRACE_BUCKETS // len(scans), start, stop)
+            frames.append(pd.DataFrame({'x': trace['x'][scan][rows], 'current': trace['pyramids'][scan].y[rows],
+                                        'point': rows, 'scan': f"Scan {scan + 1}"}))
+        data = pd.concat(frames, ignore_index=True)
+
+        x_title = 'Time (s)' if chronoamperometry else 'Potential (V)'
+        line = alt.Chart(data).mark_line().encode(
+            x=alt.X('x:Q', title=x_title), y=alt.Y('current:Q', title='Current (µA)'),
+            color=alt.Color('scan:N', legend=None if chronoamperometry else alt.Legend(title=None)), order='point:Q')
+        peak = pd.DataFrame({'x': [trace['x'][peak_scan][peak_row]],
+                             'current': [trace['pyramids'][peak_scan].y[peak_row]]})
+        layers = [line, alt.Chart(peak).mark_point(color='red', size=80, filled=True).encode(x='x:Q', y='current:Q')]
+        if chronoamperometry:
+            # The moving averages determine_steady_state_current averages cover
+            # the last 2 x window - 1 samples
+            time = trace['x'][0]
+            window = pd.DataFrame({'start': [time[-min(2 * STEADY_STATE_WINDOW - 1, len(time))]], 'stop': [time[-1]]})
+            layers.insert(0, alt.Chart(window).mark_rect(opacity=0.2, color='orange').encode(x='start:Q', x2='stop:Q'))
+        st.altair_chart(alt.layer(*layers), use_container_width=True)
+        st.caption(f"{len(data):,} of {(stop - start) * len(scans):,} points shown; "
+                   "the red point marks the peak" + (", the band the steady-state window" if chronoamperometry else ""))
+
+# Uploads analyzed at once. The parsing and the statistics run in numpy, which
+# releases the GIL, so threads overlap without the cost of worker processes.
+UPLOAD_WORKERS = min(4, os.cpu_count() or 1)
+UPLOAD_COLUMNS = ['file', 'technique', 'current', 'concentration', 'result', 'error']
+
+# Analyze one uploaded file as the Calculate Result button does, with the same
+# technique dispatch as the command-line tools: the steady state of a
+# chronoamperometry trace, the peak of a CV. A failure becomes the row's error
+# instead of stopping the batch.
+def analyze_upload(name, raw, calibration):
+    row = dict.fromkeys(UPLOAD_COLUMNS)
+    row['file'] = name
+    try:
+        metadata, values = parse_cache().read(raw)
+        technique, current, _ = measure_current(metadata, values)
+        row['technique'] = technique
+        concentration, half_width, codes = classify_currents(calibration, [current])
+        row.update(current=float(current), concentration=float(concentration[0]),
+                   half_width=float(half_width[0]),
+                   result=determine_result(calibration.concentration_at, current, calibration.lod))
+    except Exception as e:
+        row['error'] = f"{type(e).__name__}: {e}"
+    return row
+
+# Analyze the uploads in a bounded thread pool. Rows are stored and added to
+# the table as each file finishes, so a slow file does not hold back the rest.
+def analyze_uploads(uploads, calibration, store):
+    progress = st.progress(0.0, text=f"Analyzing {len(uploads)} files...")
+    table = st.empty()
+    rows = []
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+        futures = {pool.submit(analyze_upload, upload.name, upload.getvalue(), calibration): upload
+                   for upload in uploads}
+        for done, future in enumerate(as_completed(futures), 1):
+            row = future.result()
+            if row['error'] is None:
+                upload = futures[future]
+                row['run_id'] = store_result(store, upload.getvalue(), upload.name, calibration,
+                                             row['current'], row['concentration'], row['result'])
+            rows.append(row)
+            progress.progress(done / len(futures), text=f"Analyzed {done} of {len(futures)} files")
+            table.dataframe(pd.DataFrame(rows, columns=UPLOAD_COLUMNS), hide_index=True, use_container_width=True)
+    return rows
+
+# The script thread's own connection to the local results store. Streamlit
+# runs every session's script in its own thread, so sessions never share a
+# connection, and with it a transaction.
+def results_store():
+    return thread_connection(setup=init_schema)
 
-# Used to determine peak in CV data
-def determine_peak_current(data):
-    # Find the peak current across all 'µA' columns
-    peak_current = data.max().max()  # The highest current value across all scans
-    return peak_current
+# Store a computed result with the file's instrument timestamp and the
+# calibration it was computed with; returns the run id
+def store_result(store, raw, file_name, calibration, current, concentration, result):
+    try:
+        metadata = read_metadata(raw)
+    except ValueError:
+        metadata = {}
+    collection_date = st.session_state.get('collection_date')
+    return save_run(store, {'patient_id': st.session_state.get('patient_id', ''),
+                            'collection_date': collection_date,
+                            'instrument_timestamp': metadata.get('Date and time measurement'),
+                            'calibration_version': calibration.version,
+                            'file_name': file_name, 'file_hash': file_hash(raw),
+                            'technique': metadata.get('technique'),
+                            'current': current, 'concentration': concentration, 'result': result})
+
+HISTORY_PAGE_SIZE = 50
+# Counting stops here so the total stays cheap on a large store
+HISTORY_COUNT_LIMIT = 10_000
+
+# Stored results, filtered and paged in SQLite so only one page is read per rerun
+def history_view(store):
+    st.subheader("Results History")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        patient_id = st.text_input("Patient ID", key='history_patient_id').strip()
+    with col2:
+        dates = st.date_input("Collection Date", value=(), key='history_dates')
+    with col3:
+        version = st.selectbox("Calibration", ['All'] + calibration_versions(store), key='history_calibration')
+    with col4:
+        result = st.selectbox("Result", ['All', 'Positive', 'Negative'], key='history_result')
+
+    filters = {'patient_id': patient_id or None,
+               'collection_date': (dates[0], dates[-1]) if dates else None,
+               'calibration_version': None if version == 'All' else version,
+               'result': None if result == 'All' else result}
+    # Start again from the newest page whenever a filter changes. cursors holds
+    # the cursor of every page up to the current one.
+    if st.session_state.get('history_filters') != filters:
+        st.session_state['history_filters'] = filters
+        st.session_state['history_cursors'] = [None]
+    cursors = st.session_state['history_cursors']
+
+    page, next_cursor = query_runs(store, limit=HISTORY_PAGE_SIZE, after=cursors[-1], **filters)
+    total = count_runs(store, limit=HISTORY_COUNT_LIMIT, **filters)
+    shown = f"{HISTORY_COUNT_LIMIT:,}+" if total >= HISTORY_COUNT_LIMIT else f"{total:,}"
+    st.write(f"{shown} stored results, page {len(cursors)}")
+    st.dataframe(page.drop(columns=['id', 'file_hash']), hide_index=True, use_container_width=True)
+
+    # The buttons move through the pages in callbacks, which run before the
+    # next rerun reads its page
+    col1, col2 = st.columns(2)
+    with col1:
+        st.button("Newer", disabled=len(cursors) == 1, on_click=cursors.pop)
+    with col2:
+        st.button("Older", disabled=next_cursor is None, on_click=cursors.append, args=(next_cursor,))
 
-def calculate_lod_from_calibration(concentration, current_response):
-    # Perform a linear regression to get the slope (S) and intercept
-    calibration_function, slope, intercept, r_value, std_err = create_calibration_function(concentration, current_response)
-    # Calculate the standard deviation of the response (σ) at the lowest concentration
-    std_response =  np.std(current_response[concentration == 0])
-    # Calculate the LOD using the 3.3σ/S formula
-    lod = 3.3 * (std_response / slope)
-    return lod, slope, std_response
+# Directory the debug sidebar exports the stage metrics to
+METRICS_DIR = os.environ.get('GENEDETEK_METRICS_DIR', 'metrics')
 
+# The debug sidebar is shown with ?debug=1 in the URL or GENEDETEK_DEBUG=1
+def debug_enabled():
+    return os.environ.get('GENEDETEK_DEBUG') == '1' or st.query_params.get('debug') == '1'
 
-def determine_result(calibration_function, peak_current, lod_concentration):
-    # Determine if the steady-state current corresponds to a concentration above the LOD
-    concentration = calibration_function(peak_current)
-    result = "Positive" if concentration >= lod_concentration else "Negative"
-    return result
+def _arm_profile():
+    st.session_state['profile_next_run'] = 'armed'
+
+# Stage timings of this process, metric export and cProfile of one rerun
+def debug_sidebar():
+    with st.sidebar:
+        st.subheader("Stage timings")
+        rows = snapshot()
+        if rows:
+            table = pd.DataFrame(rows).set_index('stage')
+            milliseconds = table[['mean_seconds', 'max_seconds', 'last_seconds', 'total_seconds']] * 1e3
+            milliseconds.columns = ['mean ms', 'max ms', 'last ms', 'total ms']
+            st.table(table[['calls', 'errors']].join(milliseconds.round(2)))
+        else:
+            st.write("No stages timed yet.")
+
+        if st.button("Export metrics"):
+            json_path = write_metrics(os.path.join(METRICS_DIR, 'stages.json'))
+            prometheus_path = write_metrics(os.path.join(METRICS_DIR, 'stages.prom'))
+            st.success(f"Wrote {json_path} and {prometheus_path}")
+
+        st.button("Profile next rerun", on_click=_arm_profile)
+        if st.session_state.get('profile_next_run'):
+            st.write("The next rerun will be profiled.")
+        if 'last_profile' in st.session_state:
+            text, data = st.session_state['last_profile']
+            st.download_button("Download profile", data=data, file_name='rerun.prof')
+            st.code(text)
 
 # Process calibration file
 #new_path = r'C:\Users\karla\OneDrive\Documents\NE 4B\NE 409\FYDP-Software'
 calibration_file_path = 'data/Calibration_curve.csv'
-calibration_concentration, calibration_current = read_calibration_curve_csv(calibration_file_path)
-doc_url = 'https://github.com/kmcastro99/FYDP-Software/raw/388595c03638b3932c6110368186b42ae759769a/Report/Report_Positive.docx'
-doc_name = 'Report_Positive.docx'
 # Streamlit app
 def main():
     st.set_page_config(page_title="GeneDetek",page_icon=":dna:",layout="centered")
@@ -106,82 +346,133 @@ def main():
     st.write("")
     st.write("")
 
+    store = results_store()
+    calibration = load_calibration_model(store, calibration_file_path)
+    if calibration is None:
+        st.stop()
+
     col1, col2 = st.columns(2)
     with col1:
         st.subheader('Calibration Curve')
-        fig = plot_calibration_curve(calibration_concentration, calibration_current)
-        st.pyplot(fig)
+        # Drawn at the end of the run, so on a cold start the rest of the page
+        # does not wait for matplotlib
+        calibration_plot = st.empty()
 
     with col2:
         st.subheader('Limit of Detection (LOD)')
-        lod_concentration,slope, std_response = calculate_lod_from_calibration(calibration_concentration, calibration_current)
+        lod_concentration = calibration.lod
         st.write(f"The GeneDetek Sensor has a LOD of: {round(lod_concentration,3)} nM")
-        st.write(f"The slope of the calibration curve is: {round(slope,3)}")
-        st.write(f"The standard deviation of the response at the lowest concentrations is: {round(std_response,3)}")
+        st.write(f"The slope of the calibration curve is: {round(calibration.slope,3)}")
+        st.write(f"The standard deviation of the response at the lowest concentrations is: {round(calibration.std_response,3)}")
+        method = st.selectbox("Uncertainty (95% CI)", ['None'] + list(UNCERTAINTY_METHODS), key='lod_uncertainty')
+        if method != 'None':
+            intervals = lod_intervals(calibration.version, UNCERTAINTY_METHODS[method], calibration)
+            for name, label, unit in (('lod', 'LOD', ' nM'), ('slope', 'Slope', ''), ('intercept', 'Intercept', ' µA')):
+                estimate, low, high = intervals[name]
+                st.write(f"{label}: {estimate:.3f} [{low:.3f}, {high:.3f}]{unit}")
+            caption = f"{method} over {intervals['resamples']:,} resamples"
+            if intervals['lod_method'] != UNCERTAINTY_METHODS[method]:
+                caption += (f"; the LOD blanks are drawn by Monte Carlo, since a bootstrap of "
+                            f"{intervals['blanks']} blanks gives σ = 0 too often")
+            st.caption(caption)
+
+    calibration_versions_view(store, calibration)
 
     # File uploader allows the user to upload CSV files
     st.write("")
     st.write("")
     st.subheader('Analysis of Results')
     st.write("Please upload the CSV file with the results to analyze.")
-    cv_file = st.file_uploader("Upload CV CSV with results", type=['csv'])
+    uploads = st.file_uploader("Upload CV CSV with results", type=['csv'], accept_multiple_files=True)
 
-    if cv_file:
+    if uploads:
+        names = [upload.name for upload in uploads]
+        shown = st.selectbox("Raw trace of", names, key='trace_file') if len(uploads) > 1 else names[0]
+        raw_trace_view(uploads[names.index(shown)].getvalue(), shown)
         if st.button('Calculate Result'):
-            # Process CV file
-            result_currents = read_csv_result(cv_file)
-            # current_values = result_currents.iloc[5:]
-            calibration_func, slope, intercept, r_value, std_err = create_calibration_function(calibration_concentration, calibration_current)
-
-            # Determine steady-state current and SNR
-            # steady_state_current, snr = determine_steady_state_current(current_values)
-            peak_current = determine_peak_current(result_currents)
-            # Determine result
-            overall_result = determine_result(calibration_func, peak_current, lod_concentration)
-            st.write(f"Peak current: {peak_current:.2f} µA")
-            # st.write(f"Concentration: {calibration_func(peak_current):.2f} nM")
-            # Display result
-            if overall_result == "Positive":
-                st.success(f"{overall_result}")
-            else:
-                st.error(f"{overall_result}")
-        else:
-            st.write("Upload a CSV file with the results to enable the 'Calculate Result' button.")
+            rows = analyze_uploads(uploads, calibration, store)
+            # Keep the results for the report, by file name
+            st.session_state['analyses'] = {row['file']: {'current': row['current'],
+                                                          'concentration': row['concentration'],
+                                                          'result': row['result'], 'run_id': row['run_id']}
+                                            for row in rows if row['error'] is None}
+            if len(rows) == 1:
+                row = rows[0]
+                if row['error'] is not None:
+                    st.error(f"Could not analyze {row['file']}: {row['error']}")
+                else:
+                    label = "Steady-state current" if row['technique'] == 'CA' else "Peak current"
+                    st.write(f"{label}: {row['current']:.2f} µA")
+                    st.write(f"Concentration: {row['concentration']:.2f} ± {row['half_width']:.2f} nM "
+                             "(95% prediction interval)")
+                    # Display result
+                    if row['result'] == "Positive":
+                        st.success(f"{row['result']}")
+                    else:
+                        st.error(f"{row['result']}")
+    else:
+        st.write("Upload a CSV file with the results to enable the 'Calculate Result' button.")
 
     st.subheader("Report Generation")
     st.write("")
     st.write("")
     st.write("Please, enter the following data to generate the report:")
     st.write("")
-    collection_date = st.date_input("Collection Date", datetime.date(2024, 3, 13))
-    patient_id = st.text_input("Patient ID")
+    collection_date = st.date_input("Collection Date", datetime.date(2024, 3, 13), key='collection_date')
+    patient_id = st.text_input("Patient ID", key='patient_id')
     patient_name = st.text_input("Patient Name")
     age = st.text_input("Age")
     gender = st.text_input("Gender")
+    analyses = st.session_state.get('analyses', {})
+    if len(analyses) > 1:
+        report_file = st.selectbox("Result", list(analyses), key='report_file')
+    else:
+        report_file = next(iter(analyses), None)
 
     if st.button("Generate Report"):
         if patient_id == "" or patient_name == "" or age == "" or gender == "":
             st.error("Please enter the missing information")
+        elif report_file is None:
+            st.error("Please calculate a result before generating the report")
         else:
             st.write("Generating report...")
+            analysis = dict(analyses[report_file])
+            # The stored run gets the patient details entered for the report
+            update_patient(store, analysis.pop('run_id'), patient_id, collection_date)
+            report = render_report({'patient_id': patient_id, 'patient_name': patient_name, 'age': age,
+                                    'gender': gender, 'collection_date': collection_date, **analysis})
             st.write("Report generated successfully!")
             st.write("Download the report below.")
-            r = requests.get(doc_url, stream=True)
-            if r.status_code == 200:
-                st.download_button(
-                label="Download Report",
-                data=r.content,
-                file_name=doc_name,
-                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                )
-            else:
-                st.error("Failed to download the report.")
-    
+            st.download_button(
+            label="Download Report",
+            data=report,
+            file_name=f"Report_{patient_id}.docx",
+            mime=DOCX_MIME,
+            )
+
+    st.write("")
+    history_view(store)
+
     st.write("")
     st.write("")
     st.write("")
     st.image("./GeneDetek.png")
     st.write("GeneDetek is a product of GeneDetek Inc. All rights reserved.")
 
+    calibration_plot.image(calibration_plot_png(calibration.version, calibration))
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    # The button's own rerun only moves the flag on, so the rerun profiled is
+    # the one caused by the next interaction (e.g. Calculate Result)
+    profile_flag = st.session_state.get('profile_next_run')
+    if profile_flag == 'armed':
+        st.session_state['profile_next_run'] = 'next'
+    if profile_flag == 'next':
+        del st.session_state['profile_next_run']
+        with profiled() as profile:
+            main()
+        st.session_state['last_profile'] = (profile_text(profile), profile_bytes(profile))
+    else:
+        main()
+    if debug_enabled():
+        debug_sidebar()
\ No newline at end of file
@@ -1,23 +1,271 @@
+import multiprocessing
+import os
+import queue
 import sys
+import threading
 import numpy as np
 import pandas as pd
 from scipy.interpolate import interp1d
 from scipy.stats import linregress
-from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QPushButton, QLabel, QFileDialog, QMessageBox
+from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QFileDialog,
+                             QMessageBox, QListWidget, QListWidgetItem, QProgressBar)
+
+# Rows parsed between progress updates. Much smaller chunks make the python
+# engine slower overall.
+CHUNK_ROWS = 50000
+
+def read_csv_first_column(file_path, progress=None):
+    # Read the CSV file with UTF-16 encoding and flexible handling of inconsistencies.
+    # The file is parsed in chunks so a long read can report progress.
+    size = max(os.path.getsize(file_path), 1)
+    parts = []
+    with open(file_path, encoding='utf-16') as f:
+        for chunk in pd.read_csv(f, sep=',', on_bad_lines='skip', engine='python', chunksize=CHUNK_ROWS):
+            # Skip the rows that are not numeric
+            parts.append(pd.to_numeric(chunk.iloc[:, 1], errors='coerce'))
+            if progress is not None:
+                progress(f.buffer.tell() / size)
+
+    # Drop NaN values that result from coercion errors (i.e., non-numeric data)
+    numeric_data = pd.concat(parts) if parts else pd.Series(dtype=float)
+    numeric_data = numeric_data.dropna().reset_index(drop=True)
+
+    return numeric_data
+
+def read_calibration_curve(filename):
+    # Read calibration curve data from CSV
+    calibration_data = pd.read_csv(filename)
+    concentration = calibration_data['Concentration']
+    current_response = calibration_data['Current']
+
+    return concentration, current_response
+
+def create_calibration_function(concentration, current_response):
+    # Interpolate the calibration curve data to obtain a function
+    # Use the 'fill_value' parameter to allow extrapolation
+    calibration_function = interp1d(current_response, concentration, kind='linear', fill_value="extrapolate")
+
+    return calibration_function
+
+def determine_steady_state_current(amperometric_data, window_size=10):
+    # Calculate the moving average to smooth out the data
+    moving_avg = amperometric_data.rolling(window=window_size).mean()
+
+    # Determine the steady-state current as the average of the last few points
+    steady_state_current = moving_avg.iloc[-window_size:].mean()
+
+    # Calculate the standard deviation of the last few points as a measure of noise
+    noise = amperometric_data.iloc[-window_size:].std()
+
+    # Calculate the signal-to-noise ratio (SNR)
+    snr = steady_state_current / noise if noise > 0 else np.inf
+
+    return steady_state_current, snr
+
+def calculate_lod_from_calibration(concentration, current_response):
+    # Perform a linear regression to get the slope (S) and intercept
+    slope, intercept, r_value, p_value, std_err = linregress(concentration, current_response)
+
+    # Calculate the LOD using the 3.3σ/S formula
+    lod = 3.3 * std_err / slope
+    return lod
+
+def determine_result(calibration_function, steady_state_current, lod_concentration):
+    # Determine if the steady-state current corresponds to a concentration above the LOD
+    concentration = calibration_function(steady_state_current)
+    result = "Positive" if concentration >= lod_concentration else "Negative"
+    return result
+
+# Full analysis of one amperometric file, as a dict of the numbers shown in
+# the window. progress(fraction) is called as the file is read.
+def analyze_file(cv_file_path, calibration_file_path, progress=None):
+    amperometric_currents = read_csv_first_column(cv_file_path, progress)
+    current_values = amperometric_currents.iloc[3:]  # Only take numeric values
+    if current_values.empty:
+        raise ValueError("no numeric current values in the file")
+
+    calibration_concentration, calibration_current = read_calibration_curve(calibration_file_path)
+    calibration_func = create_calibration_function(calibration_concentration, calibration_current)
+
+    # Determine the steady-state current and SNR for the amperometric data
+    steady_state_current, snr = determine_steady_state_current(current_values)
+
+    # Determine the limit of detection (LOD) based on the calibration function
+    lod_concentration = calculate_lod_from_calibration(calibration_concentration, calibration_current)
+
+    # Determine if the response is positive or negative based on the LOD
+    overall_result = determine_result(calibration_func, steady_state_current, lod_concentration)
+
+    return {'steady_state_current': float(steady_state_current), 'snr': float(snr),
+            'concentration': float(calibration_func(steady_state_current)), 'lod': float(lod_concentration),
+            'result': overall_result}
+
+# Runs in the analysis process: analyzes the (cv, calibration) paths it
+# receives and sends back progress, then the result or the error
+def analysis_process(connection):
+    while True:
+        job = connection.recv()
+        if job is None:
+            break
+        try:
+            result = analyze_file(*job, progress=lambda fraction: connection.send(('progress', fraction)))
+        except Exception as e:
+            connection.send(('failed', str(e)))
+        else:
+            connection.send(('result', result))
+
+class AnalysisWorker(QThread):
+    # Analyzes queued files one after another. The parsing runs in a separate
+    # process, so it never holds the interpreter lock the UI thread needs, and
+    # cancelling a file just terminates that process; the next file starts a
+    # new one. This thread only waits on the process and relays its messages as
+    # signals, which are delivered in the UI thread and carry the job id given
+    # by enqueue.
+    #
+    # A job is stamped with the cancel-all generation it was queued in. The
+    # worker publishes a job as current before checking its stamp, and cancelAll
+    # bumps the generation before it drains the queue and cancels the current
+    # job, so a job taken off the queue while cancelAll runs is caught by one
+    # of the two.
+    progress = pyqtSignal(int, int)
+    resultReady = pyqtSignal(int, dict)
+    failed = pyqtSignal(int, str)
+    cancelled = pyqtSignal(int)
+
+    # Seconds between checks for a cancellation while a file is analyzed
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.jobs = queue.Queue()
+        self.current = None
+        self.nextId = 0
+        self.generation = 0
+        self.process = None
+        self.connection = None
+
+    def enqueue(self, cvFilePath, calibrationFilePath):
+        self.nextId += 1
+        self.jobs.put((self.nextId, cvFilePath, calibrationFilePath, threading.Event(), self.generation))
+        return self.nextId
+
+    def cancelCurrent(self):
+        job = self.current
+        if job is not None:
+            job[3].set()
+
+    def cancelAll(self):
+        self.generation += 1
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                self.cancelled.emit(job[0])
+        self.cancelCurrent()
+
+    def stop(self):
+        self.cancelAll()
+        self.jobs.put(None)
+        self.wait()
+
+    def startProcess(self):
+        # spawn rather than fork: the parent has Qt threads running
+        context = multiprocessing.get_context('spawn')
+        self.connection, childConnection = context.Pipe()
+        self.process = context.Process(target=analysis_process, args=(childConnection,), daemon=True)
+        self.process.start()
+        childConnection.close()
+
+    def stopProcess(self, terminate=False):
+        if self.process is None:
+            return
+        if terminate:
+            self.process.terminate()
+        else:
+            try:
+                self.connection.send(None)
+            except OSError:
+                pass
+        self.process.join()
+        self.connection.close()
+        self.process = self.connection = None
+
+    def analyze(self, job):
+        jobId, cvFilePath, calibrationFilePath, cancelEvent, _ = job
+        if cancelEvent.is_set():
+            self.cancelled.emit(jobId)
+            return
+        if self.process is None:
+            self.startProcess()
+        self.connection.send((cvFilePath, calibrationFilePath))
+        lastPercent = -1
+        while True:
+            if cancelEvent.is_set():
+                self.stopProcess(terminate=True)
+                self.cancelled.emit(jobId)
+                return
+            if not self.connection.poll(self.POLL_INTERVAL):
+                continue
+            try:
+                kind, value = self.connection.recv()
+            except (EOFError, OSError):
+                self.stopProcess(terminate=True)
+                self.failed.emit(jobId, "the analysis process exited")
+                return
+            if kind == 'progress':
+                # Only whole-percent changes, so a long file does not flood the event loop
+                percent = min(int(value * 100), 100)
+                if percent != lastPercent:
+                    lastPercent = percent
+                    self.progress.emit(jobId, percent)
+            elif kind == 'failed':
+                self.failed.emit(jobId, value)
+                return
+            else:
+                self.resultReady.emit(jobId, value)
+                return
+
+    def run(self):
+        try:
+            while True:
+                job = self.jobs.get()
+                if job is None:
+                    break
+                self.current = job
+                if job[4] != self.generation:
+                    # Queued before a cancelAll that missed it
+                    job[3].set()
+                try:
+                    self.analyze(job)
+                finally:
+                    self.current = None
+        finally:
+            self.stopProcess()
 
 class LODApp(QWidget):
     def __init__(self):
         super().__init__()
-        self.cvFilePath = ""
+        self.cvFilePaths = []
         self.calibrationFilePath = ""
+        self.items = {}
         self.setWindowTitle('LOD Calculator')
         self.initUI()
 
+        self.worker = AnalysisWorker(self)
+        self.worker.progress.connect(self.showProgress)
+        self.worker.resultReady.connect(self.showResult)
+        self.worker.failed.connect(self.showError)
+        self.worker.cancelled.connect(self.showCancelled)
+        self.worker.start()
+
     def initUI(self):
         layout = QVBoxLayout(self)
 
         # Buttons
-        self.loadCVButton = QPushButton('Load CV File', self)
+        self.loadCVButton = QPushButton('Load CV Files', self)
         self.loadCVButton.clicked.connect(self.loadCVFile)
 
         self.loadCalibrationButton = QPushButton('Load Calibration File', self)
@@ -26,6 +274,21 @@ class LODApp(QWidget):
         self.calculateButton = QPushButton('Calculate Result', self)
         self.calculateButton.clicked.connect(self.calculateResult)
 
+        self.cancelButton = QPushButton('Cancel Current', self)
+        self.cancelButton.clicked.connect(lambda: self.worker.cancelCurrent())
+
+        self.cancelAllButton = QPushButton('Cancel All', self)
+        self.cancelAllButton.clicked.connect(lambda: self.worker.cancelAll())
+
+        cancelLayout = QHBoxLayout()
+        cancelLayout.addWidget(self.cancelButton)
+        cancelLayout.addWidget(self.cancelAllButton)
+
+        # Progress of the file being analyzed and one line per queued file
+        self.progressBar = QProgressBar(self)
+        self.progressBar.setRange(0, 100)
+        self.queueList = QListWidget(self)
+
         # Result label
         self.resultLabel = QLabel('Result: ', self)
 
@@ -33,13 +296,16 @@ class LODApp(QWidget):
         layout.addWidget(self.loadCVButton)
         layout.addWidget(self.loadCalibrationButton)
         layout.addWidget(self.calculateButton)
+        layout.addLayout(cancelLayout)
+        layout.addWidget(self.progressBar)
+        layout.addWidget(self.queueList)
         layout.addWidget(self.resultLabel)
 
     def loadCVFile(self):
-        fileName, _ = QFileDialog.getOpenFileName(self, "Load CV File", "", "CSV Files (*.csv);;All Files (*)")
-        if fileName:
-            self.cvFilePath = fileName
-            self.resultLabel.setText('CV File Loaded: ' + fileName.split('/')[-1])
+        fileNames, _ = QFileDialog.getOpenFileNames(self, "Load CV Files", "", "CSV Files (*.csv);;All Files (*)")
+        if fileNames:
+            self.cvFilePaths = fileNames
+            self.resultLabel.setText(f'CV Files Loaded: {len(fileNames)}')
 
     def loadCalibrationFile(self):
         fileName, _ = QFileDialog.getOpenFileName(self, "Load Calibration File", "", "CSV Files (*.csv);;All Files (*)")
@@ -48,93 +314,40 @@ class LODApp(QWidget):
             self.resultLabel.setText('Calibration File Loaded: ' + fileName.split('/')[-1])
 
     def calculateResult(self):
-        if self.cvFilePath and self.calibrationFilePath:
-            try:
-                # Process the CSV file and determine results
-                amperometric_currents = self.read_csv_first_column(self.cvFilePath)
-                current_values = amperometric_currents.iloc[3:]  # Only take numeric values
-                
-                calibration_concentration, calibration_current = self.read_calibration_curve(self.calibrationFilePath)
-                calibration_func = self.create_calibration_function(calibration_concentration, calibration_current)
+        if self.cvFilePaths and self.calibrationFilePath:
+            # Queue the files; the worker thread reads and classifies them
+            for cvFilePath in self.cvFilePaths:
+                jobId = self.worker.enqueue(cvFilePath, self.calibrationFilePath)
+                item = QListWidgetItem(f"{os.path.basename(cvFilePath)}: queued", self.queueList)
+                self.items[jobId] = (os.path.basename(cvFilePath), item)
+        else:
+            QMessageBox.warning(self, "File Missing", "Please load both CV and Calibration files before calculation.")
 
-                # Determine the steady-state current and SNR for the amperometric data
-                steady_state_current, snr = self.determine_steady_state_current(current_values)
+    def setStatus(self, jobId, status):
+        name, item = self.items[jobId]
+        item.setText(f"{name}: {status}")
+        return name
 
-                # Determine the limit of detection (LOD) based on the calibration function
-                lod_concentration = self.calculate_lod_from_calibration(calibration_concentration, calibration_current)
+    def showProgress(self, jobId, percent):
+        self.setStatus(jobId, f"{percent}%")
+        self.progressBar.setValue(percent)
 
-                # Determine if the response is positive or negative based on the LOD
-                overall_result = self.determine_result(calibration_func, steady_state_current, lod_concentration)
+    def showResult(self, jobId, result):
+        name = self.setStatus(jobId, f"{result['result']} ({result['concentration']:.2f} nM, "
+                                     f"LOD {result['lod']:.2f} nM, SNR {result['snr']:.1f})")
+        self.resultLabel.setText(f"Overall result ({name}): {result['result']}")
 
-                self.resultLabel.setText(f"Overall result: {overall_result}")
-            except Exception as e:
-                QMessageBox.warning(self, "Calculation Error", "An error occurred during calculation: " + str(e))
-        else:
-            QMessageBox.warning(self, "File Missing", "Please load both CV and Calibration files before calculation.")
+    def showError(self, jobId, message):
+        name = self.setStatus(jobId, "error")
+        QMessageBox.warning(self, "Calculation Error", f"An error occurred during calculation of {name}: {message}")
+
+    def showCancelled(self, jobId):
+        self.setStatus(jobId, "cancelled")
+        self.progressBar.setValue(0)
 
-    def read_csv_first_column(file_path):
-        # Read the CSV file with UTF-16 encoding and flexible handling of inconsistencies
-        df = pd.read_csv(file_path, encoding='utf-16', sep=',', on_bad_lines='skip', engine='python')
-        
-        # Skip the rows that are not numeric
-        numeric_data = pd.to_numeric(df.iloc[:, 1], errors='coerce')
-        
-        # Drop NaN values that result from coercion errors (i.e., non-numeric data)
-        numeric_data = numeric_data.dropna().reset_index(drop=True)
-    
-        return numeric_data
-
-    def read_calibration_curve(filename):
-        # Read calibration curve data from CSV
-        calibration_data = pd.read_csv(filename)
-        concentration = calibration_data['Concentration']
-        current_response = calibration_data['Current']
-        
-        return concentration, current_response
-
-    def create_calibration_function(concentration, current_response):
-        # Interpolate the calibration curve data to obtain a function
-        # Use the 'fill_value' parameter to allow extrapolation
-        calibration_function = interp1d(current_response, concentration, kind='linear', fill_value="extrapolate")
-        
-        return calibration_function
-
-    def determine_steady_state_current(amperometric_data, window_size=10):
-        # Calculate the moving average to smooth out the data
-        moving_avg = amperometric_data.rolling(window=window_size).mean()
-
-        # Determine the steady-state current as the average of the last few points
-        steady_state_current = moving_avg.iloc[-window_size:].mean()
-
-        # Calculate the standard deviation of the last few points as a measure of noise
-        noise = amperometric_data.iloc[-window_size:].std()
-
-        # Calculate the signal-to-noise ratio (SNR)
-        snr = steady_state_current / noise if noise > 0 else np.inf
-
-        return steady_state_current, snr
-
-    def calculate_lod_from_calibration(concentration, current_response):
-        # Perform a linear regression to get the slope (S) and intercept
-        slope, intercept, r_value, p_value, std_err = scipy.stats.linregress(concentration, current_response)
-        print(slope)
-        print(std_err)
-        print(intercept)
-        print(r_value)
-        # Calculate the standard deviation of the response (σ) at the lowest concentration
-        std_response =  np.std(current_response[concentration == 0])
-        print(std_response)
-        
-        # Calculate the LOD using the 3.3σ/S formula
-        lod = 3.3 * std_err / slope
-        return lod
-
-
-    def determine_result(calibration_function, steady_state_current, lod_concentration):
-        # Determine if the steady-state current corresponds to a concentration above the LOD
-        concentration = calibration_function(steady_state_current)
-        result = "Positive" if concentration >= lod_concentration else "Negative"
-        return result
+    def closeEvent(self, event):
+        self.worker.stop()
+        super().closeEvent(event)
 
 def main():
     app = QApplication(sys.argv)
@@ -0,0 +1,385 @@
+import hashlib
+import io
+from dataclasses import dataclass, replace
+
+import numpy as np
+import pandas as pd
+
+from instrument_reader import read_instrument_file, current_columns
+from instrumentation import timed
+
+# Analysis functions shared by the Streamlit app and the command-line tools.
+# Nothing in here touches Streamlit so it can be imported from worker processes.
+# The pipeline stages are timed by instrumentation.timed.
+#
+# scipy.stats takes about half a second to import, so it is only imported by
+# the functions that need it (the prediction interval's t quantile); the
+# calibration fit uses the numpy least squares below.
+
+def read_calibration_curve(filename):
+    # Read calibration curve data from CSV
+    calibration_data = pd.read_csv(filename)
+    concentration = calibration_data['Concentration']
+    current_response = calibration_data['Current']
+    return concentration, current_response
+
+# Ordinary least squares of y on x with the same formulas as
+# scipy.stats.linregress: (slope, intercept, r_value, std_err)
+def linear_fit(x, y):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    x_mean, y_mean = x.mean(), y.mean()
+    ssxm = np.mean((x - x_mean) ** 2)
+    ssym = np.mean((y - y_mean) ** 2)
+    ssxym = np.mean((x - x_mean) * (y - y_mean))
+    r_value = 0.0 if ssxm == 0 or ssym == 0 else min(max(ssxym / np.sqrt(ssxm * ssym), -1.0), 1.0)
+    slope = ssxym / ssxm
+    intercept = y_mean - slope * x_mean
+    dof = len(x) - 2
+    std_err = np.sqrt((1 - r_value ** 2) * ssym / ssxm / dof) if dof > 0 else 0.0
+    return slope, intercept, r_value, std_err
+
+@timed('create_calibration_function')
+def create_calibration_function(concentration, current_response):
+    current_response = current_response[1:]# To get only one zero value
+    concentration = concentration[1:]# To get only one zero value
+    # Fit a linear regression model
+    slope, intercept, r_value, std_err = linear_fit(concentration, current_response)
+    # Create a function using the slope and intercept
+    calibration_function = lambda y: (y - intercept)/slope
+
+    return calibration_function, slope, intercept, r_value, std_err
+
+@timed('calculate_lod_from_calibration')
+def calculate_lod_from_calibration(concentration, current_response):
+    # Perform a linear regression to get the slope (S) and intercept
+    calibration_function, slope, intercept, r_value, std_err = create_calibration_function(concentration, current_response)
+    # Calculate the standard deviation of the response (σ) at the lowest concentration
+    std_response =  np.std(current_response[concentration == 0])
+    # Calculate the LOD using the 3.3σ/S formula
+    lod = 3.3 * (std_response / slope)
+    return lod, slope, std_response
+
+# Fitted calibration curve together with the data it was fitted on. It is
+# identified by the SHA-256 of the calibration file so callers can cache it,
+# and version names it in stored results (see calibration_store.py).
+@dataclass(frozen=True)
+class CalibrationModel:
+    content_hash: str
+    concentration: tuple
+    current_response: tuple
+    slope: float
+    intercept: float
+    r_value: float
+    std_err: float
+    lod: float
+    std_response: float
+    # Sufficient statistics of the fitted points, used for prediction intervals
+    n_points: int
+    mean_concentration: float
+    mean_current: float
+    sxx: float
+    residual_std: float
+    version: str = ''
+
+    # Invert the calibration: current (µA) -> concentration (nM)
+    def concentration_at(self, current):
+        return (current - self.intercept)/self.slope
+
+def build_calibration_model(concentration, current_response, content_hash=''):
+    calibration_function, slope, intercept, r_value, std_err = create_calibration_function(concentration, current_response)
+    lod, slope, std_response = calculate_lod_from_calibration(concentration, current_response)
+    # Same points as the regression in create_calibration_function
+    x = np.asarray(concentration, dtype=np.float64)[1:]
+    y = np.asarray(current_response, dtype=np.float64)[1:]
+    sxx = np.sum((x - x.mean()) ** 2)
+    residuals = y - (intercept + slope * x)
+    residual_std = np.sqrt(np.sum(residuals ** 2) / (len(x) - 2)) if len(x) > 2 else 0.0
+    return CalibrationModel(content_hash, tuple(concentration), tuple(current_response),
+                            float(slope), float(intercept), float(r_value), float(std_err),
+                            float(lod), float(std_response),
+                            len(x), float(x.mean()), float(y.mean()), float(sxx), float(residual_std),
+                            content_hash[:12])
+
+# Running sufficient statistics of a calibration, so adding a point updates the
+# fit and the blank σ in O(1) without revisiting earlier points. The fit uses
+# Welford's updates of the means and of the centered sums of squares and
+# products. The points follow the rules of build_calibration_model: the first
+# point is left out of the regression (create_calibration_function's [1:]) and
+# every zero-concentration point, the first included, counts toward the blank
+# σ. Instances are immutable; add returns the updated statistics.
+@dataclass(frozen=True)
+class RunningCalibration:
+    points: int = 0
+    n: int = 0
+    mean_x: float = 0.0
+    mean_y: float = 0.0
+    sxx: float = 0.0
+    syy: float = 0.0
+    sxy: float = 0.0
+    blank_n: int = 0
+    blank_mean: float = 0.0
+    blank_m2: float = 0.0
+
+    def add(self, concentration, current):
+        x, y = float(concentration), float(current)
+        updates = {'points': self.points + 1}
+        if self.points > 0:
+            n = self.n + 1
+            dx = x - self.mean_x
+            dy = y - self.mean_y
+            mean_x = self.mean_x + dx / n
+            mean_y = self.mean_y + dy / n
+            updates.update(n=n, mean_x=mean_x, mean_y=mean_y, sxx=self.sxx + dx * (x - mean_x),
+                           syy=self.syy + dy * (y - mean_y), sxy=self.sxy + dx * (y - mean_y))
+        if x == 0:
+            blank_n = self.blank_n + 1
+            delta = y - self.blank_mean
+            blank_mean = self.blank_mean + delta / blank_n
+            updates.update(blank_n=blank_n, blank_mean=blank_mean, blank_m2=self.blank_m2 + delta * (y - blank_mean))
+        return replace(self, **updates)
+
+    def add_points(self, concentration, current_response):
+        stats = self
+        for x, y in zip(concentration, current_response):
+            stats = stats.add(x, y)
+        return stats
+
+    @property
+    def slope(self):
+        return self.sxy / self.sxx if self.sxx > 0 else np.nan
+
+    @property
+    def intercept(self):
+        return self.mean_y - self.slope * self.mean_x
+
+    @property
+    def r_value(self):
+        if self.sxx <= 0 or self.syy <= 0:
+            return 0.0
+        return min(max(self.sxy / np.sqrt(self.sxx * self.syy), -1.0), 1.0)
+
+    @property
+    def residual_std(self):
+        if self.n <= 2 or self.sxx <= 0:
+            return 0.0
+        return np.sqrt(max(self.syy - self.sxy ** 2 / self.sxx, 0.0) / (self.n - 2))
+
+    @property
+    def std_err(self):
+        return self.residual_std / np.sqrt(self.sxx) if self.sxx > 0 else 0.0
+
+    # Population σ of the blanks, like np.std in calculate_lod_from_calibration
+    @property
+    def std_response(self):
+        return np.sqrt(self.blank_m2 / self.blank_n) if self.blank_n else np.nan
+
+    @property
+    def lod(self):
+        return 3.3 * (self.std_response / self.slope)
+
+    # Freeze the statistics into a CalibrationModel. The points are only
+    # needed for plotting and can be left empty.
+    def model(self, version='', concentration=(), current_response=(), content_hash=''):
+        return CalibrationModel(content_hash, tuple(concentration), tuple(current_response),
+                                float(self.slope), float(self.intercept), float(self.r_value), float(self.std_err),
+                                float(self.lod), float(self.std_response),
+                                self.n, self.mean_x, self.mean_y, self.sxx, float(self.residual_std), version)
+
+def calibration_file_hash(raw):
+    return hashlib.sha256(raw).hexdigest()
+
+def load_calibration_model(file_path):
+    with open(file_path, 'rb') as f:
+        raw = f.read()
+    return calibration_model_from_bytes(raw, calibration_file_hash(raw))
+
+def calibration_model_from_bytes(raw, content_hash):
+    concentration, current_response = read_calibration_curve(io.BytesIO(raw))
+    return build_calibration_model(concentration, current_response, content_hash)
+
+# Read CSV for CV data
+@timed('read_csv_result')
+def read_csv_result(file_path, errors='print', cache=None):
+    # errors='raise' lets the caller report a failure instead of getting None;
+    # cache is an optional parse_cache.ParsedFileCache
+    try:
+        # Keep only the current columns; PSTrace writes one (potential, current) pair per scan
+        metadata, values = read_instrument_file(file_path) if cache is None else cache.read(file_path)
+        data = pd.DataFrame(values[:, current_columns(metadata)])
+        return data
+    except Exception as e:
+        if errors == 'raise':
+            raise
+        print(f"An error occurred: {e}")
+        return None
+
+# Read the current column of a chronoamperometry export
+def read_csv_first_column(file_path, cache=None):
+    metadata, values = read_instrument_file(file_path) if cache is None else cache.read(file_path)
+
+    # Drop NaN values left by empty cells
+    numeric_data = pd.Series(values[:, 1])
+    numeric_data = numeric_data.dropna().reset_index(drop=True)
+
+    return numeric_data
+
+# Used to determine peak in CV data
+@timed('determine_peak_current')
+def determine_peak_current(data):
+    # Find the peak current across all 'µA' columns
+    peak_current = data.max().max()  # The highest current value across all scans
+    return peak_current
+
+# Used to determine the plateau in chronoamperometry data
+@timed('determine_steady_state_current')
+def determine_steady_state_current(amperometric_data, window_size=10):
+    # Calculate the moving average to smooth out the data
+    moving_avg = amperometric_data.rolling(window=window_size).mean()
+
+    # Determine the steady-state current as the average of the last few points
+    steady_state_current = moving_avg.iloc[-window_size:].mean()
+
+    # Calculate the standard deviation of the last few points as a measure of noise
+    noise = amperometric_data.iloc[-window_size:].std()
+
+    # Calculate the signal-to-noise ratio (SNR)
+    snr = steady_state_current / noise if noise > 0 else np.inf
+
+    return steady_state_current, snr
+
+# Samples dropped at the start of a chronoamperometry trace, before the
+# steady state is taken
+CA_SKIP_SAMPLES = 3
+
+# The current a parsed export is classified by, dispatching on the technique in
+# its preamble: the steady state of a chronoamperometry trace after its first
+# CA_SKIP_SAMPLES samples, or the peak over all scans of a CV. Returns
+# (technique, current, snr), snr being None for CV. Raises ValueError when the
+# export has no current column or no finite current.
+def measure_current(metadata, values):
+    technique = metadata.get('technique', 'CV')
+    currents = values[:, current_columns(metadata)]
+    snr = None
+    if technique == 'CA':
+        current, snr = determine_steady_state_current(pd.Series(currents[CA_SKIP_SAMPLES:, 0]).dropna())
+    else:
+        current = determine_peak_current(pd.DataFrame(currents))
+    # A NaN current would compare below the LOD and pass for a Negative
+    if not np.isfinite(current):
+        raise ValueError("no finite current in export")
+    return technique, current, snr
+
+@timed('determine_result')
+def determine_result(calibration_function, peak_current, lod_concentration):
+    # Determine if the steady-state current corresponds to a concentration above the LOD
+    concentration = calibration_function(peak_current)
+    result = "Positive" if concentration >= lod_concentration else "Negative"
+    return result
+
+# Result codes returned by classify_currents; RESULT_LABELS[codes] gives the names
+NEGATIVE, POSITIVE, INDETERMINATE = 0, 1, 2
+RESULT_LABELS = np.array(['Negative', 'Positive', 'Indeterminate'])
+
+# Classify an array of peak or steady-state currents in one vectorized pass.
+# Returns the estimated concentrations, the half width of their inverse
+# prediction interval (classical calibration, Student's t with n - 2 degrees
+# of freedom) and int8 result codes. A sample is Indeterminate when its
+# interval contains the LOD. replicates is the number of measurements averaged
+# into each current. A scalar current is classified as a one-element array.
+# A missing (NaN) or infinite current has no interval and is Indeterminate.
+@timed('classify_currents')
+def classify_currents(model, currents, confidence=0.95, replicates=1):
+    currents = np.atleast_1d(np.asarray(currents, dtype=np.float64))
+    concentration = currents - model.intercept
+    concentration /= model.slope
+
+    # s_x0 = s/|b| * sqrt(1/m + 1/n + (y0 - ybar)^2 / (b^2 Sxx))
+    half_width = currents - model.mean_current
+    np.square(half_width, out=half_width)
+    if model.sxx > 0:
+        half_width /= model.slope ** 2 * model.sxx
+    half_width += 1 / replicates + 1 / model.n_points
+    np.sqrt(half_width, out=half_width)
+    from scipy.stats import t
+    t_critical = t.ppf(0.5 + confidence / 2, model.n_points - 2) if model.n_points > 2 else np.inf
+    half_width *= t_critical * model.residual_std / abs(model.slope)
+
+    # Positive when the whole interval is at or above the LOD, Negative when it
+    # is entirely below, Indeterminate otherwise
+    distance = concentration - model.lod
+    codes = (distance >= half_width).view(np.int8)
+    np.negative(half_width, out=half_width)
+    indeterminate = distance >= half_width
+    np.negative(half_width, out=half_width)
+    indeterminate &= distance < half_width
+    codes[indeterminate] = INDETERMINATE
+    codes[~np.isfinite(currents)] = INDETERMINATE
+    return concentration, half_width, codes
+
+# Confidence intervals for slope, intercept and LOD by resampling the
+# calibration, n_resamples at a time in chunks of chunk_size so memory stays
+# bounded. Each chunk is fitted at once with the closed-form least squares over
+# a (chunk_size x points) array.
+#   bootstrap: resample the fitted (concentration, current) pairs and the blank
+#     responses with replacement
+#   monte_carlo: redraw the currents from the fitted line with the residual
+#     std, and the blanks from a normal with their mean and sample std
+# Resamples that cannot be fitted (all concentrations equal) are dropped.
+# A bootstrap of n blanks draws the same blank every time, and so gets σ = 0,
+# with probability n^(1-n): half the resamples for the usual 2 blanks. When
+# that is not below the interval's lower tail, the LOD's lower bound would be
+# this artifact, so the blanks are drawn as in monte_carlo instead.
+# Returns {'slope'|'intercept'|'lod': (estimate, low, high)}, the number of
+# resamples used under 'resamples', the method the blanks were drawn with
+# under 'lod_method' and their number under 'blanks'.
+def calibration_intervals(concentration, current_response, method='bootstrap', n_resamples=100_000,
+                          confidence=0.95, chunk_size=25_000, seed=0):
+    concentration = np.asarray(concentration, dtype=np.float64)
+    current_response = np.asarray(current_response, dtype=np.float64)
+    # Same points as create_calibration_function and calculate_lod_from_calibration
+    x, y = concentration[1:], current_response[1:]
+    blanks = current_response[concentration == 0]
+    slope, intercept, _, _ = linear_fit(x, y)
+    std_response = np.std(blanks)
+    residual_std = np.sqrt(np.sum((y - intercept - slope * x) ** 2) / (len(x) - 2)) if len(x) > 2 else 0.0
+    blank_std = np.std(blanks, ddof=1) if len(blanks) > 1 else 0.0
+    tail = 50 * (1 - confidence)
+    lod_method = method
+    if method == 'bootstrap' and float(len(blanks)) ** (1 - len(blanks)) >= tail / 100:
+        lod_method = 'monte_carlo'
+
+    rng = np.random.default_rng(seed)
+    samples = np.empty((3, n_resamples))
+    for start in range(0, n_resamples, chunk_size):
+        size = min(chunk_size, n_resamples - start)
+        if method == 'bootstrap':
+            rows = rng.integers(0, len(x), (size, len(x)))
+            xs, ys = x[rows], y[rows]
+        elif method == 'monte_carlo':
+            xs = np.broadcast_to(x, (size, len(x)))
+            ys = intercept + slope * x + rng.normal(0.0, residual_std, (size, len(x)))
+        else:
+            raise ValueError(f"unknown method: {method}")
+        if lod_method == 'bootstrap':
+            blank_samples = blanks[rng.integers(0, len(blanks), (size, len(blanks)))]
+        else:
+            blank_samples = rng.normal(blanks.mean(), blank_std, (size, len(blanks)))
+        dx = xs - xs.mean(axis=1, keepdims=True)
+        sxx = np.einsum('ij,ij->i', dx, dx)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slopes = np.einsum('ij,ij->i', dx, ys) / sxx
+        slopes[sxx == 0] = np.nan
+        samples[0, start:start + size] = slopes
+        samples[1, start:start + size] = ys.mean(axis=1) - slopes * xs.mean(axis=1)
+        samples[2, start:start + size] = 3.3 * blank_samples.std(axis=1) / slopes
+
+    samples = samples[:, np.isfinite(samples).all(axis=0)]
+    low, high = np.percentile(samples, [tail, 100 - tail], axis=1)
+    estimates = [slope, intercept, 3.3 * std_response / slope]
+    intervals = {name: (float(estimate), float(lo), float(hi))
+                 for name, estimate, lo, hi in zip(('slope', 'intercept', 'lod'), estimates, low, high)}
+    intervals['resamples'] = samples.shape[1]
+    intervals['lod_method'] = lod_method
+    intervals['blanks'] = len(blanks)
+    return intervals
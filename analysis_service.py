@@ -0,0 +1,153 @@
+import argparse
+import asyncio
+import os
+import signal
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import tornado.web
+
+from batch_analyzer import init_worker, analyze_file, add_prediction_intervals, json_safe
+from calibration_store import store_calibration
+from instrumentation import stage
+from results_store import DEFAULT_PATH
+
+# Local HTTP service classifying PalmSens exports, for instruments and scripts
+# that cannot drive the Streamlit page.
+#
+#   python analysis_service.py --port 8765 --workers 4
+#
+#   curl --data-binary @Results/E1_Amp0.4_5nM.csv "http://127.0.0.1:8765/analyze?name=E1.csv"
+#   curl -F file=@Results/E1_Amp0.4_5nM.csv -F file=@Results/E5_Amp0.4_0nM.csv http://127.0.0.1:8765/analyze
+#   curl http://127.0.0.1:8765/health
+#
+# POST /analyze takes either one export as the request body or any number as
+# multipart/form-data files, and answers with the batch analyzer's row for each:
+#
+#   {"calibration": {"version": ..., "lod": ...}, "results": [{"file": ..., "result": "Positive", ...}]}
+#
+# The calibration is loaded once at startup and handed to every worker process
+# when the pool starts, so a request only ships the file bytes. Parsing and
+# classification run in the pool; the event loop only reads requests and
+# writes responses, so slow files never hold up other connections. A file that
+# cannot be analyzed gets an error in its row; the request still succeeds.
+
+DEFAULT_PORT = 8765
+# Name given to a file posted as the raw request body without ?name=
+DEFAULT_UPLOAD_NAME = 'upload.csv'
+
+class AnalysisService:
+    def __init__(self, calibration, workers=None, peak_method='max', confidence=0.95):
+        self.calibration = calibration
+        self.confidence = confidence
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                            initargs=(calibration, peak_method))
+
+    # Start every worker now, before the event loop runs, instead of on the
+    # first requests
+    def warm_up(self):
+        for future in [self.executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    # Rows for a list of (name, raw bytes) uploads, in upload order
+    async def analyze(self, uploads):
+        loop = asyncio.get_running_loop()
+        rows = await asyncio.gather(*(loop.run_in_executor(self.executor, analyze_file, raw, name)
+                                      for name, raw in uploads))
+        add_prediction_intervals(rows, self.calibration, self.confidence)
+        return [json_safe(row) for row in rows]
+
+    def describe(self):
+        return {'version': self.calibration.version, 'lod': self.calibration.lod,
+                'slope': self.calibration.slope, 'intercept': self.calibration.intercept}
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+
+class JSONHandler(tornado.web.RequestHandler):
+    def initialize(self, service):
+        self.service = service
+
+    def write_error(self, status_code, **kwargs):
+        error = kwargs.get('exc_info', (None, None))[1]
+        message = error.log_message if isinstance(error, tornado.web.HTTPError) and error.log_message else self._reason
+        self.finish({'error': message})
+
+class AnalyzeHandler(JSONHandler):
+    # (name, bytes) of every multipart file, or of the raw body
+    def uploads(self):
+        if self.request.files:
+            return [(upload.filename or DEFAULT_UPLOAD_NAME, upload.body)
+                    for uploads in self.request.files.values() for upload in uploads]
+        if self.request.body and not self.request.headers.get('Content-Type', '').startswith('multipart/'):
+            return [(self.get_query_argument('name', DEFAULT_UPLOAD_NAME), self.request.body)]
+        return []
+
+    async def post(self):
+        uploads = self.uploads()
+        if not uploads:
+            raise tornado.web.HTTPError(400, "no file in the request: post an export as the body or as multipart files")
+        with stage('service_request'):
+            rows = await self.service.analyze(uploads)
+        self.write({'calibration': self.service.describe(), 'results': rows})
+
+class NotFoundHandler(JSONHandler):
+    def prepare(self):
+        raise tornado.web.HTTPError(404)
+
+class HealthHandler(JSONHandler):
+    def get(self):
+        self.write({'status': 'ok', 'workers': self.service.workers, 'calibration': self.service.describe()})
+
+def make_app(service):
+    return tornado.web.Application([(r'/analyze', AnalyzeHandler, {'service': service}),
+                                    (r'/health', HealthHandler, {'service': service})],
+                                   default_handler_class=NotFoundHandler, default_handler_args={'service': service})
+
+async def serve(service, host, port, max_body_size):
+    app = make_app(service)
+    server = app.listen(port, address=host, max_body_size=max_body_size, xheaders=True)
+    print(f"Serving on http://{host}:{port} with {service.workers} workers, "
+          f"calibration {service.calibration.version} (LOD {service.calibration.lod:.3f} nM)", file=sys.stderr)
+    # Stop cleanly on SIGTERM too, so the worker processes are shut down
+    stopped = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signum, stopped.set)
+        except NotImplementedError:
+            # Windows: Ctrl+C still raises KeyboardInterrupt
+            pass
+    try:
+        await stopped.wait()
+    finally:
+        server.stop()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve Positive/Negative classification of PalmSens exports over HTTP.")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--calibration', default='data/Calibration_curve.csv',
+                        help="Calibration curve CSV, added to the store as a new version when it changes")
+    parser.add_argument('--db', default=DEFAULT_PATH, help="SQLite store holding the calibration versions")
+    parser.add_argument('--calibration-version', help="Classify with this stored version (default: the latest)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--peak-method', choices=['max', 'baseline'], default='max',
+                        help="CV peak: raw maximum, or baseline-corrected median over scans")
+    parser.add_argument('--confidence', type=float, default=0.95, help="Confidence level of the prediction interval")
+    parser.add_argument('--max-body-mb', type=int, default=256, help="Largest accepted request in MiB")
+    args = parser.parse_args(argv)
+
+    calibration = store_calibration(args.calibration, args.db, args.calibration_version)
+    service = AnalysisService(calibration, args.workers, args.peak_method, args.confidence)
+    service.warm_up()
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.max_body_mb << 20))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.shutdown()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
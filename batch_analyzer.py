@@ -0,0 +1,141 @@
+import argparse
+import glob
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from analysis import (measure_current, determine_result, classify_currents,
+                      RESULT_LABELS)
+from calibration_store import store_calibration
+from cv_peaks import determine_corrected_peak_current
+from instrument_reader import read_instrument_file
+from parse_cache import ParsedFileCache, DEFAULT_MAX_BYTES
+from results_store import DEFAULT_PATH
+
+# Headless batch analysis of PalmSens exports.
+#
+#   python batch_analyzer.py Results/ -o results.csv
+#   python batch_analyzer.py "runs/2024-03-*/*.csv" -o results.json --workers 8
+#   python batch_analyzer.py archive/ --cache cache/parsed    # parse each export only once
+
+RESULT_FIELDS = ['file', 'technique', 'current', 'concentration', 'ci_half_width', 'result', 'call', 'snr', 'error']
+
+# Calibration, CV peak method and parse cache used by the worker processes,
+# set once per worker by init_worker
+_calibration = None
+_peak_method = 'max'
+_cache = None
+
+def init_worker(calibration, peak_method='max', cache_dir=None, cache_bytes=None):
+    global _calibration, _peak_method, _cache
+    _calibration = calibration
+    _peak_method = peak_method
+    _cache = ParsedFileCache(cache_dir, cache_bytes or DEFAULT_MAX_BYTES) if cache_dir else None
+
+# Expand directories and glob patterns into a sorted list of CSV files
+def collect_files(inputs, pattern='*.csv'):
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            files.extend(glob.glob(os.path.join(item, '**', pattern), recursive=True))
+        else:
+            files.extend(glob.glob(item, recursive=True))
+    return sorted(set(files))
+
+# Classify a single export, dispatching on the technique in its preamble.
+# file_path can also be the raw bytes of an export, reported as name.
+def analyze_file(file_path, name=None):
+    calibration_func = _calibration.concentration_at
+    row = dict.fromkeys(RESULT_FIELDS)
+    row['file'] = file_path if name is None else name
+    try:
+        metadata, values = read_instrument_file(file_path) if _cache is None else _cache.read(file_path)
+        technique = metadata.get('technique', 'CV')
+        row['technique'] = technique
+        if technique != 'CA' and _peak_method == 'baseline':
+            current = determine_corrected_peak_current(metadata, values)
+        else:
+            _, current, snr = measure_current(metadata, values)
+            row['snr'] = None if snr is None else float(snr)
+        row['current'] = float(current)
+        row['concentration'] = float(calibration_func(current))
+        row['result'] = determine_result(calibration_func, current, _calibration.lod)
+    except Exception as e:
+        row['error'] = f"{type(e).__name__}: {e}"
+    return row
+
+def analyze_files(files, calibration, workers=None, chunksize=4, peak_method='max', cache_dir=None,
+                  cache_bytes=None):
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(calibration, peak_method, cache_dir, cache_bytes)) as pool:
+        return list(pool.map(analyze_file, files, chunksize=chunksize))
+
+# Add the prediction interval and the Positive/Negative/Indeterminate call for
+# every analyzed file in one vectorized pass
+def add_prediction_intervals(rows, calibration, confidence=0.95):
+    analyzed = [row for row in rows if row['current'] is not None]
+    if not analyzed:
+        return
+    currents = np.fromiter((row['current'] for row in analyzed), dtype=np.float64, count=len(analyzed))
+    _, half_width, codes = classify_currents(calibration, currents, confidence)
+    for row, width, code in zip(analyzed, half_width.tolist(), codes.tolist()):
+        row['ci_half_width'] = width
+        row['call'] = RESULT_LABELS[code]
+
+# NaN and infinity are not valid JSON
+def json_safe(row):
+    return {key: None if isinstance(value, float) and not math.isfinite(value) else value
+            for key, value in row.items()}
+
+def write_results(rows, output_path):
+    if output_path.endswith('.json'):
+        with open(output_path, 'w') as f:
+            json.dump([json_safe(row) for row in rows], f, indent=2)
+    else:
+        pd.DataFrame(rows, columns=RESULT_FIELDS).to_csv(output_path, index=False)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Classify a folder of PalmSens exports as Positive/Negative.")
+    parser.add_argument('inputs', nargs='+', help="Directories or glob patterns of CSV exports")
+    parser.add_argument('-o', '--output', default='results.csv', help="Output file (.csv or .json)")
+    parser.add_argument('--calibration', default='data/Calibration_curve.csv',
+                        help="Calibration curve CSV, added to the store as a new version when it changes")
+    parser.add_argument('--db', default=DEFAULT_PATH, help="SQLite store holding the calibration versions")
+    parser.add_argument('--calibration-version', help="Classify with this stored version (default: the latest)")
+    parser.add_argument('--pattern', default='*.csv', help="File pattern used when an input is a directory")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--peak-method', choices=['max', 'baseline'], default='max',
+                        help="CV peak: raw maximum, or baseline-corrected median over scans")
+    parser.add_argument('--confidence', type=float, default=0.95, help="Confidence level of the prediction interval")
+    parser.add_argument('--chunksize', type=int, default=4, help="Files handed to a worker at a time")
+    parser.add_argument('--cache', help="Directory of the parsed-file cache (off by default)")
+    parser.add_argument('--cache-size', type=int, default=2048, help="Parsed-file cache limit in MiB")
+    args = parser.parse_args(argv)
+
+    files = collect_files(args.inputs, args.pattern)
+    if not files:
+        print("No files found.", file=sys.stderr)
+        return 1
+
+    calibration = store_calibration(args.calibration, args.db, args.calibration_version)
+
+    start = time.perf_counter()
+    rows = analyze_files(files, calibration, args.workers, args.chunksize, args.peak_method, args.cache,
+                         args.cache_size << 20)
+    add_prediction_intervals(rows, calibration, args.confidence)
+    elapsed = time.perf_counter() - start
+    write_results(rows, args.output)
+
+    failed = sum(1 for row in rows if row['error'])
+    print(f"Analyzed {len(rows)} files ({failed} failed) in {elapsed:.2f} s: "
+          f"{len(rows) / elapsed:.1f} files/sec -> {args.output}", file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from analysis import (load_calibration_model, determine_steady_state_current, determine_peak_current,
+                      determine_result, classify_currents)
+from multichannel import read_channels, analyze_channels
+from synthetic import write_multichannel_ca_file
+
+# Multichannel analysis against the single-channel functions run once per
+# channel, on synthetic electrode-array exports.
+#
+#   python benchmarks/bench_multichannel.py
+#   python benchmarks/bench_multichannel.py --channels 1 96 --samples 1000000 -o multichannel.json
+#
+# read: parsing the export into the channels x samples matrix
+# steady_state / peak: analyze_channels (CA) and peak_currents (CV) on the
+#   whole matrix, against a loop of determine_steady_state_current or
+#   determine_peak_current with determine_result and classify_currents per channel
+
+CALIBRATION_FILE = os.path.join(ROOT, 'data', 'Calibration_curve.csv')
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return result, min(timings)
+
+def steady_state_loop(currents, calibration):
+    for row in currents:
+        current, _ = determine_steady_state_current(pd.Series(row[3:]).dropna().reset_index(drop=True))
+        determine_result(calibration.concentration_at, current, calibration.lod)
+        classify_currents(calibration, [current])
+
+def peak_loop(currents, calibration):
+    for row in currents:
+        current = determine_peak_current(pd.DataFrame(row))
+        determine_result(calibration.concentration_at, current, calibration.lod)
+        classify_currents(calibration, [current])
+
+def bench(path, n_channels, n_samples, calibration, repeat):
+    (metadata, _, currents), read_seconds = best_of(lambda: read_channels(path), repeat)
+    records = [{'stage': 'read', 'seconds': read_seconds}]
+    _, seconds = best_of(lambda: analyze_channels(metadata, currents, calibration), repeat)
+    _, loop_seconds = best_of(lambda: steady_state_loop(currents, calibration), repeat)
+    records.append({'stage': 'steady_state', 'seconds': seconds, 'loop_seconds': loop_seconds})
+    _, seconds = best_of(lambda: analyze_channels({'technique': 'CV'}, currents, calibration), repeat)
+    _, loop_seconds = best_of(lambda: peak_loop(currents, calibration), repeat)
+    records.append({'stage': 'peak', 'seconds': seconds, 'loop_seconds': loop_seconds})
+    for record in records:
+        record.update(channels=n_channels, samples=n_samples,
+                      ns_per_sample=record['seconds'] / (n_channels * n_samples) * 1e9)
+    return records
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark multichannel analysis on synthetic exports")
+    parser.add_argument('--channels', type=int, nargs='+', default=[1, 8, 96], help="Channels per export")
+    parser.add_argument('--samples', type=int, default=100_000, help="Samples per channel")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per stage (best is kept)")
+    parser.add_argument('-o', '--output', help="Write the results as JSON")
+    args = parser.parse_args(argv)
+
+    calibration = load_calibration_model(CALIBRATION_FILE)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_channels in args.channels:
+            path = os.path.join(tmp, f'array_{n_channels}.csv')
+            write_multichannel_ca_file(path, args.samples, n_channels)
+            records = bench(path, n_channels, args.samples, calibration, args.repeat)
+            os.remove(path)
+            for record in records:
+                loop = f"   per-channel loop {record['loop_seconds'] * 1e3:9.2f} ms" if 'loop_seconds' in record else ''
+                print(f"{n_channels:3d} ch x {args.samples} {record['stage']:<13} {record['seconds'] * 1e3:9.2f} ms "
+                      f"({record['ns_per_sample']:6.2f} ns/sample){loop}")
+            results += records
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
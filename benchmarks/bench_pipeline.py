@@ -0,0 +1,135 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from analysis import (read_calibration_curve, read_csv_result, determine_peak_current, create_calibration_function,
+                      calculate_lod_from_calibration, determine_result)
+from report import render_report
+from synthetic import write_ca_file, write_cv_file
+
+# Stage-by-stage benchmark of the analysis pipeline on synthetic exports.
+#
+#   python benchmarks/bench_pipeline.py -o bench_results.json
+#   python benchmarks/bench_pipeline.py --sizes 2000 100000 --scans 1 10 -o new.json --compare bench_results.json
+#
+# Every stage is timed on its own (best of --repeat runs) and run once more
+# under tracemalloc for its peak memory. With --compare the run exits with
+# status 1 when a stage is slower than the baseline by more than --tolerance.
+
+CALIBRATION_FILE = os.path.join(ROOT, 'data', 'Calibration_curve.csv')
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, min(timings), peak
+
+# Run every stage on one file and return a record per stage
+def bench_file(path, technique, samples, scans, repeat):
+    concentration, current_response = read_calibration_curve(CALIBRATION_FILE)
+    records = []
+
+    def stage(name, func):
+        result, seconds, peak = measure(func, repeat)
+        records.append({'stage': name, 'technique': technique, 'samples': samples, 'scans': scans,
+                        'seconds': seconds, 'peak_memory_bytes': peak})
+        return result
+
+    data = stage('read_csv_result', lambda: read_csv_result(path))
+    peak_current = stage('determine_peak_current', lambda: determine_peak_current(data))
+    calibration_function, *_ = stage('create_calibration_function',
+                                     lambda: create_calibration_function(concentration, current_response))
+    lod, _, _ = stage('calculate_lod_from_calibration',
+                      lambda: calculate_lod_from_calibration(concentration, current_response))
+    result = stage('determine_result', lambda: determine_result(calibration_function, peak_current, lod))
+    stage('report_generation', lambda: render_report({
+        'patient_id': 'BENCH', 'patient_name': 'Benchmark', 'age': '0', 'gender': '-',
+        'collection_date': datetime.date(2024, 3, 13), 'current': peak_current,
+        'concentration': calibration_function(peak_current), 'result': result}))
+    return records
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+            'cpus': os.cpu_count(), 'commit': commit, 'date': datetime.datetime.now().isoformat(timespec='seconds')}
+
+# Stages slower than the baseline by more than tolerance (a ratio)
+def regressions(records, baseline, tolerance):
+    key = lambda record: (record['stage'], record['technique'], record['samples'], record['scans'])
+    previous = {key(record): record for record in baseline['results']}
+    slower = []
+    for record in records:
+        old = previous.get(key(record))
+        # Sub-millisecond stages are dominated by timer noise
+        if old and record['seconds'] > 1e-3 and record['seconds'] > old['seconds'] * tolerance:
+            slower.append((record, old))
+    return slower
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark each analysis stage on synthetic PalmSens exports")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2_000, 100_000, 1_000_000, 10_000_000],
+                        help="Samples per file (CV: total over all scans)")
+    parser.add_argument('--scans', type=int, nargs='+', default=[1, 10, 50], help="Scan counts for CV files")
+    parser.add_argument('--techniques', nargs='+', choices=['CA', 'CV'], default=['CA', 'CV'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('-o', '--output', default='bench_results.json', help="JSON file for the results")
+    parser.add_argument('--compare', help="Baseline JSON from a previous run")
+    parser.add_argument('--tolerance', type=float, default=1.25, help="Allowed slowdown ratio against the baseline")
+    args = parser.parse_args(argv)
+
+    records = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for samples in args.sizes:
+            cases = [('CA', 1)] if 'CA' in args.techniques else []
+            if 'CV' in args.techniques:
+                cases += [('CV', scans) for scans in args.scans if samples // scans >= 2]
+            for technique, scans in cases:
+                path = os.path.join(tmp, f'{technique}_{samples}_{scans}.csv')
+                if technique == 'CA':
+                    write_ca_file(path, samples)
+                else:
+                    write_cv_file(path, samples // scans, scans)
+                for record in bench_file(path, technique, samples, scans, args.repeat):
+                    records.append(record)
+                    print(f"{technique} {samples:>10} x{scans:<3} {record['stage']:<32} "
+                          f"{record['seconds'] * 1e3:>10.2f} ms {record['peak_memory_bytes'] / 2**20:>9.1f} MiB")
+                os.remove(path)
+
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(), 'results': records}, f, indent=2)
+    print(f"Wrote {len(records)} measurements to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        slower = regressions(records, baseline, args.tolerance)
+        for record, old in slower:
+            print(f"REGRESSION {record['technique']} {record['samples']} x{record['scans']} {record['stage']}: "
+                  f"{old['seconds'] * 1e3:.2f} ms -> {record['seconds'] * 1e3:.2f} ms")
+        return 1 if slower else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
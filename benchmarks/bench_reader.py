@@ -0,0 +1,75 @@
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrument_reader import read_instrument_file
+from synthetic import write_ca_file, write_cv_file
+
+# Compare instrument_reader against the pandas readers it replaced.
+#
+#   python benchmarks/bench_reader.py
+#   python benchmarks/bench_reader.py --rows 2000 1000000 10000000 --legacy-max-rows 10000000
+
+# Previous read_csv_result: fixed preamble length and column positions
+def legacy_read_csv_result(file_path):
+    return pd.read_csv(file_path, delimiter=',', skiprows=6, usecols=[1, 3, 5, 7], on_bad_lines='skip',
+                       encoding='utf-16')
+
+# Previous read_csv_first_column: python engine plus numeric coercion
+def legacy_read_csv_first_column(file_path):
+    df = pd.read_csv(file_path, encoding='utf-16', sep=',', on_bad_lines='skip', engine='python')
+    return pd.to_numeric(df.iloc[:, 1], errors='coerce').dropna().reset_index(drop=True)
+
+# Write a PSTrace-style export with n_rows rows: one (s, µA) pair for CA or
+# four (V, µA) scan pairs for CV
+def write_synthetic(path, n_rows, technique='CA'):
+    if technique == 'CA':
+        write_ca_file(path, n_rows)
+    else:
+        write_cv_file(path, n_rows, n_scans=4)
+
+def best_of(func, path, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(path)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def report(label, path, rows, legacy, legacy_max_rows, repeat):
+    new = best_of(read_instrument_file, path, repeat)
+    if rows <= legacy_max_rows:
+        old = best_of(legacy, path, repeat)
+        print(f"{label:<28} {rows:>10} {old * 1e3:>12.1f} {new * 1e3:>12.1f} {old / new:>8.1f}x")
+    else:
+        print(f"{label:<28} {rows:>10} {'skipped':>12} {new * 1e3:>12.1f} {'':>9}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the UTF-16 export reader")
+    parser.add_argument('--rows', type=int, nargs='+', default=[2_000, 100_000, 1_000_000, 10_000_000])
+    parser.add_argument('--legacy-max-rows', type=int, default=1_000_000,
+                        help="Largest file the legacy python-engine reader is timed on")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"{'file':<28} {'rows':>10} {'pandas ms':>12} {'reader ms':>12} {'speedup':>9}")
+    for path in sorted(glob.glob('Results/*.csv')):
+        report(os.path.basename(path), path, 2001, legacy_read_csv_first_column, np.inf, args.repeat)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            for technique, legacy in (('CA', legacy_read_csv_first_column), ('CV', legacy_read_csv_result)):
+                path = os.path.join(tmp, f'synthetic_{technique}_{rows}.csv')
+                write_synthetic(path, rows, technique)
+                report(f'synthetic {technique}', path, rows, legacy, args.legacy_max_rows, args.repeat)
+                os.remove(path)
+
+if __name__ == '__main__':
+    main()
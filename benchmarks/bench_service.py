@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+import uuid
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Load test of analysis_service.py: concurrent clients posting exports over
+# persistent HTTP/1.1 connections.
+#
+#   python benchmarks/bench_service.py --concurrency 16 --duration 10
+#   python benchmarks/bench_service.py --batch 8 --workers 4 -o service.json
+#   python benchmarks/bench_service.py --url http://127.0.0.1:8765 --no-keepalive
+#
+# Without --url the service is started on a free local port with --workers
+# worker processes and stopped afterwards. Each client sends its requests one
+# after another; --batch > 1 sends that many files per request as multipart.
+# Latency is measured from writing the request to reading the last byte of the
+# response.
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_until_up(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(f'{url}/health', timeout=1) as response:
+                return json.load(response)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+def start_service(port, workers):
+    command = [sys.executable, os.path.join(ROOT, 'analysis_service.py'), '--port', str(port)]
+    if workers:
+        command += ['--workers', str(workers)]
+    return subprocess.Popen(command, cwd=ROOT)
+
+# The bytes of every request a client sends, cycling through the files
+def build_requests(host, files, batch, keepalive):
+    contents = [(os.path.basename(path), open(path, 'rb').read()) for path in files]
+    connection = 'keep-alive' if keepalive else 'close'
+    requests = []
+    for start in range(0, len(contents), batch):
+        group = [contents[(start + i) % len(contents)] for i in range(batch)]
+        if batch == 1:
+            name, body = group[0]
+            target, content_type = f'/analyze?name={name}', 'application/octet-stream'
+        else:
+            boundary = uuid.uuid4().hex
+            parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\n'
+                     f'Content-Type: text/csv\r\n\r\n'.encode() + raw + b'\r\n' for name, raw in group]
+            body = b''.join(parts) + f'--{boundary}--\r\n'.encode()
+            target, content_type = '/analyze', f'multipart/form-data; boundary={boundary}'
+        head = (f'POST {target} HTTP/1.1\r\nHost: {host}\r\nConnection: {connection}\r\n'
+                f'Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n')
+        requests.append(head.encode() + body)
+    return requests
+
+async def read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = dict(line.split(':', 1) for line in lines[1:] if ':' in line)
+    length = int(next((value for name, value in headers.items() if name.lower() == 'content-length'), 0))
+    await reader.readexactly(length)
+    return status
+
+# One client: requests back to back until the shared deadline or count is hit
+async def client(host, port, requests, keepalive, deadline, remaining, latencies, failures):
+    reader = writer = None
+    index = 0
+    try:
+        while time.perf_counter() < deadline and remaining[0] > 0:
+            remaining[0] -= 1
+            start = time.perf_counter()
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.write(requests[index % len(requests)])
+            index += 1
+            try:
+                status = await read_response(reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                status = None
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                failures[0] += 1
+            if status is None or not keepalive:
+                writer.close()
+                reader = writer = None
+    finally:
+        if writer is not None:
+            writer.close()
+
+async def run_load(host, port, requests, concurrency, duration, total, keepalive):
+    latencies, failures, remaining = [], [0], [total or sys.maxsize]
+    start = time.perf_counter()
+    deadline = start + duration if duration else float('inf')
+    await asyncio.gather(*(client(host, port, requests[i % len(requests):] + requests[:i % len(requests)],
+                                  keepalive, deadline, remaining, latencies, failures)
+                           for i in range(concurrency)))
+    return latencies, failures[0], time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the HTTP analysis service")
+    parser.add_argument('--url', help="Running service to test (default: start one)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes of the started service")
+    parser.add_argument('--files', nargs='+', default=[os.path.join(ROOT, 'Results', '*.csv')],
+                        help="Exports to post (glob patterns)")
+    parser.add_argument('--batch', type=int, default=1, help="Files per request; more than 1 posts multipart")
+    parser.add_argument('--concurrency', type=int, default=16, help="Concurrent clients")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds to run (0: until --requests)")
+    parser.add_argument('--requests', type=int, default=None, help="Stop after this many requests")
+    parser.add_argument('--warmup', type=int, default=20, help="Requests sent before measuring")
+    parser.add_argument('--no-keepalive', dest='keepalive', action='store_false',
+                        help="Open a new connection for every request")
+    parser.add_argument('-o', '--output', help="Write the results as JSON")
+    args = parser.parse_args(argv)
+
+    files = sorted(path for pattern in args.files for path in glob.glob(pattern))
+    if not files:
+        print("No files found.", file=sys.stderr)
+        return 1
+    if not args.duration and not args.requests:
+        parser.error("give --duration or --requests")
+
+    process = None
+    url = args.url
+    if url is None:
+        port = free_port()
+        url = f'http://127.0.0.1:{port}'
+        process = start_service(port, args.workers)
+    try:
+        health = wait_until_up(url)
+        host, port = url.split('//', 1)[1].rstrip('/').rsplit(':', 1)
+        port = int(port)
+        requests = build_requests(host, files, args.batch, args.keepalive)
+        if args.warmup:
+            asyncio.run(run_load(host, port, requests, min(args.concurrency, args.warmup), 0, args.warmup,
+                                 args.keepalive))
+        latencies, failures, elapsed = asyncio.run(run_load(host, port, requests, args.concurrency, args.duration,
+                                                            args.requests, args.keepalive))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    latencies = np.array(latencies) * 1000
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    result = {'url': url, 'workers': health['workers'], 'concurrency': args.concurrency, 'batch': args.batch,
+              'keepalive': args.keepalive, 'requests': len(latencies), 'failures': failures,
+              'seconds': elapsed, 'requests_per_second': len(latencies) / elapsed,
+              'files_per_second': len(latencies) * args.batch / elapsed,
+              'latency_ms': {'p50': p50, 'p90': p90, 'p99': p99, 'max': float(latencies.max())}}
+    print(f"{result['requests']} requests ({failures} failed) in {elapsed:.2f} s: "
+          f"{result['requests_per_second']:.1f} req/s, {result['files_per_second']:.1f} files/s; "
+          f"latency p50 {p50:.1f} ms, p90 {p90:.1f} ms, p99 {p99:.1f} ms, max {latencies.max():.1f} ms "
+          f"({args.concurrency} clients, {'keep-alive' if args.keepalive else 'new connection per request'})")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0 if failures == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
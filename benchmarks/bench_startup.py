@@ -0,0 +1,97 @@
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold-start time of the Streamlit app, each sample in a fresh interpreter.
+#
+#   python benchmarks/bench_startup.py
+#   python benchmarks/bench_startup.py --rev HEAD~1 --budget 2.5
+#
+# import: importing GeneDetek_app without running it
+# first_render: interpreter start to the end of the first full script run
+#   (streamlit.testing's AppTest, so no browser or server is involved)
+# --rev also measures the app as of another commit, for a before/after
+# comparison. With --budget the run exits with status 1 when the median first
+# render of the working tree takes longer.
+
+# Modules that should not be loaded just by importing the app
+HEAVY_MODULES = ['matplotlib', 'scipy.stats', 'scipy.interpolate', 'docx', 'requests']
+
+CHILD = r'''
+import time
+start = time.perf_counter()
+import json, os, sys
+app_dir, mode = sys.argv[1], sys.argv[2]
+os.chdir(app_dir)
+sys.path.insert(0, app_dir)
+result = {}
+if mode == 'import':
+    import GeneDetek_app
+    result['seconds'] = time.perf_counter() - start
+    result['heavy_modules'] = [name for name in json.loads(sys.argv[3]) if name in sys.modules]
+else:
+    from streamlit.testing.v1 import AppTest
+    app = AppTest.from_file('GeneDetek_app.py', default_timeout=120).run()
+    result['seconds'] = time.perf_counter() - start
+    result['exception'] = app.exception[0].message if app.exception else None
+print(json.dumps(result))
+'''
+
+def measure(app_dir, mode, repeat):
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', CHILD, app_dir, mode, json.dumps(HEAVY_MODULES)],
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    result = samples[-1]
+    result['seconds'] = statistics.median(sample['seconds'] for sample in samples)
+    return result
+
+# Check out rev into directory without touching the working tree
+def export_revision(rev, directory):
+    archive = subprocess.run(['git', 'archive', rev], cwd=ROOT, capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(directory)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure import and first-render time of the Streamlit app")
+    parser.add_argument('--rev', help="Also measure the app at this git revision")
+    parser.add_argument('--repeat', type=int, default=5, help="Fresh interpreters per measurement (median)")
+    parser.add_argument('--budget', type=float, help="Maximum median first render in seconds")
+    parser.add_argument('-o', '--output', help="Write the results as JSON")
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        trees = [('working tree', ROOT)]
+        if args.rev:
+            export_revision(args.rev, tmp)
+            trees.insert(0, (args.rev, tmp))
+        for label, app_dir in trees:
+            imported = measure(app_dir, 'import', args.repeat)
+            rendered = measure(app_dir, 'render', args.repeat)
+            results[label] = {'import_seconds': imported['seconds'], 'heavy_modules': imported['heavy_modules'],
+                              'first_render_seconds': rendered['seconds'], 'exception': rendered['exception']}
+            print(f"{label:<14} import {imported['seconds']:6.2f} s   first render {rendered['seconds']:6.2f} s   "
+                  f"heavy modules at import: {', '.join(imported['heavy_modules']) or 'none'}")
+            if rendered['exception']:
+                print(f"{'':<14} the first run raised: {rendered['exception']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.budget is not None and results['working tree']['first_render_seconds'] > args.budget:
+        print(f"First render over the {args.budget:.2f} s budget", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+import numpy as np
+
+# Synthetic PalmSens (PSTrace) exports for benchmarks. The files match the
+# layout of Results/E1_Amp0.4_5nM.csv: UTF-16 with BOM, CRLF line ends, the
+# same six-line preamble, numbers in PSTrace's "d.dddddE+ddd" format and the
+# stray BOM PSTrace leaves after the last line.
+
+PREAMBLE = ("Date and time:,2024-03-06 14:22:18\r\nNotes:\r\n\r\n{method}\r\n"
+            "Date and time measurement:,2024-03-06 14:18:14,\r\n{units}\r\n")
+
+# Rows written per savetxt call, so 10M-sample files need little memory
+BLOCK_ROWS = 1_000_000
+
+# Split values into PSTrace's 5-decimal mantissa and integer exponent
+def _scientific(values):
+    values = np.asarray(values, dtype=np.float64)
+    magnitude = np.abs(values)
+    exponent = np.floor(np.log10(np.where(magnitude > 0, magnitude, 1.0))).astype(np.int64)
+    mantissa = np.round(values / 10.0 ** exponent, 5)
+    carry = np.abs(mantissa) >= 10
+    mantissa[carry] /= 10
+    exponent[carry] += 1
+    return mantissa, exponent
+
+def _write_rows(f, columns):
+    n_columns = len(columns)
+    fmt = ','.join(['%.5fE%+04d'] * n_columns)
+    for start in range(0, len(columns[0]), BLOCK_ROWS):
+        block = []
+        for column in columns:
+            mantissa, exponent = _scientific(column[start:start + BLOCK_ROWS])
+            block += [mantissa, exponent]
+        rows = np.empty((len(block[0]), 2 * n_columns), dtype=object)
+        for i, part in enumerate(block):
+            rows[:, i] = part
+        np.savetxt(f, rows, fmt=fmt, newline='\r\n')
+    f.write('\ufeff')
+
+# Chronoamperometry: a decaying current that settles at steady_state µA,
+# sampled every interval seconds
+def ca_trace(n_samples, steady_state=0.33, interval=0.1, noise=0.002, seed=0):
+    rng = np.random.default_rng(seed)
+    time = np.arange(n_samples) * interval
+    current = steady_state + 1.7 * np.exp(-time / 8.0) + rng.normal(0, noise, n_samples)
+    return time, current
+
+# Cyclic voltammetry: n_scans triangular sweeps of n_points each with a
+# resistive slope and a faradaic peak of peak_current µA on the forward sweep.
+# capacitive µA of charging current is added on the forward sweep and taken
+# off on the reverse one, which opens the loop between the two branches.
+def cv_traces(n_points, n_scans=1, peak_current=2.0, low=-0.2, high=0.6, noise=0.01, capacitive=0.0, seed=0):
+    rng = np.random.default_rng(seed)
+    half = n_points // 2
+    potential = np.concatenate((np.linspace(low, high, half), np.linspace(high, low, n_points - half)))
+    forward = np.arange(n_points) < half
+    current = 0.5 + 0.8 * potential + peak_current * np.exp(-((potential - 0.2) / 0.05) ** 2) * forward
+    current += np.where(forward, capacitive, -capacitive)
+    currents = current + rng.normal(0, noise, (n_scans, n_points))
+    return np.broadcast_to(potential, (n_scans, n_points)), currents
+
+def write_ca_file(path, n_samples, **options):
+    time, current = ca_trace(n_samples, **options)
+    with open(path, 'w', encoding='utf-16', newline='') as f:
+        f.write(PREAMBLE.format(method='Chronoamperometry: CA i vs t', units='s,µA'))
+        _write_rows(f, [time, current])
+
+def write_cv_file(path, n_points, n_scans=1, **options):
+    potentials, currents = cv_traces(n_points, n_scans, **options)
+    columns = []
+    for potential, current in zip(potentials, currents):
+        columns += [potential, current]
+    with open(path, 'w', encoding='utf-16', newline='') as f:
+        f.write(PREAMBLE.format(method='Cyclic Voltammetry: i vs E', units=','.join(['V', 'µA'] * n_scans)))
+        _write_rows(f, columns)
+
+# Multichannel chronoamperometry: a (time, current) pair of columns per
+# channel, as PSTrace writes electrode arrays, or one shared time column with
+# shared_time. Channel i settles at steady_state + i * step µA.
+def write_multichannel_ca_file(path, n_samples, n_channels, steady_state=0.2, step=0.02, shared_time=False,
+                               **options):
+    columns, units = [], []
+    for channel in range(n_channels):
+        time, current = ca_trace(n_samples, steady_state=steady_state + channel * step, seed=channel, **options)
+        if not shared_time or channel == 0:
+            columns.append(time)
+            units.append('s')
+        columns.append(current)
+        units.append('µA')
+    with open(path, 'w', encoding='utf-16', newline='') as f:
+        f.write(PREAMBLE.format(method='Chronoamperometry: CA i vs t', units=','.join(units)))
+        _write_rows(f, columns)
@@ -0,0 +1,246 @@
+import argparse
+import datetime
+import io
+import sys
+
+import pandas as pd
+
+from analysis import RunningCalibration, read_calibration_curve, calibration_file_hash
+from results_store import connect, DEFAULT_PATH
+
+# Versioned calibration kept next to the results in the local SQLite store.
+#
+#   python calibration_store.py add 20 4.1 0 1.72 --note "lot 2024-07"
+#   python calibration_store.py list
+#
+# Every addition of points creates a new immutable version (v1, v2, ...) from
+# the running sufficient statistics of its parent, so an update costs O(1) per
+# point however long the history is. A version row holds those statistics and
+# the fit and LOD they give; triggers reject any UPDATE or DELETE. Stored
+# results name the version that classified them in runs.calibration_version.
+#
+# The calibration CSV stays the reference: whenever its content differs from
+# the last CSV imported, sync_from_csv adds it as a new version that starts
+# over from the CSV's points (base is the first version whose points count).
+# The app and the command-line tools all classify with the store's latest
+# version (store_calibration), so they agree with each other.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calibration_versions (
+    id INTEGER PRIMARY KEY,
+    parent INTEGER REFERENCES calibration_versions (id),
+    base INTEGER,
+    source_hash TEXT,
+    created_at TEXT NOT NULL,
+    note TEXT,
+    points INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    mean_x REAL NOT NULL,
+    mean_y REAL NOT NULL,
+    sxx REAL NOT NULL,
+    syy REAL NOT NULL,
+    sxy REAL NOT NULL,
+    blank_n INTEGER NOT NULL,
+    blank_mean REAL NOT NULL,
+    blank_m2 REAL NOT NULL,
+    slope REAL,
+    intercept REAL,
+    r_squared REAL,
+    residual_std REAL,
+    std_response REAL,
+    lod REAL
+);
+CREATE TABLE IF NOT EXISTS calibration_points (
+    id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL REFERENCES calibration_versions (id),
+    concentration REAL NOT NULL,
+    current REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS calibration_points_version ON calibration_points (version);
+CREATE TRIGGER IF NOT EXISTS calibration_versions_no_update BEFORE UPDATE ON calibration_versions
+BEGIN SELECT RAISE(ABORT, 'calibration versions are immutable'); END;
+CREATE TRIGGER IF NOT EXISTS calibration_versions_no_delete BEFORE DELETE ON calibration_versions
+BEGIN SELECT RAISE(ABORT, 'calibration versions are immutable'); END;
+CREATE TRIGGER IF NOT EXISTS calibration_points_no_update BEFORE UPDATE ON calibration_points
+BEGIN SELECT RAISE(ABORT, 'calibration points are immutable'); END;
+CREATE TRIGGER IF NOT EXISTS calibration_points_no_delete BEFORE DELETE ON calibration_points
+BEGIN SELECT RAISE(ABORT, 'calibration points are immutable'); END;
+"""
+
+STATS_COLUMNS = ['points', 'n', 'mean_x', 'mean_y', 'sxx', 'syy', 'sxy', 'blank_n', 'blank_mean', 'blank_m2']
+FIT_COLUMNS = ['slope', 'intercept', 'r_squared', 'residual_std', 'std_response', 'lod']
+
+def init_schema(connection):
+    connection.executescript(SCHEMA)
+    # Stores created before base and source_hash existed
+    columns = {row[1] for row in connection.execute('PRAGMA table_info(calibration_versions)')}
+    for column, kind in (('base', 'INTEGER'), ('source_hash', 'TEXT')):
+        if column not in columns:
+            connection.execute(f'ALTER TABLE calibration_versions ADD COLUMN {column} {kind}')
+    return connection
+
+def version_name(version_id):
+    return f'v{version_id}'
+
+# Accepts 3, '3' or 'v3'
+def version_id(version):
+    return int(str(version).lstrip('v'))
+
+def latest_version(connection):
+    return connection.execute('SELECT MAX(id) FROM calibration_versions').fetchone()[0]
+
+def running_stats(connection, version=None):
+    version = latest_version(connection) if version is None else version_id(version)
+    if version is None:
+        return RunningCalibration()
+    row = connection.execute(f"SELECT {', '.join(STATS_COLUMNS)} FROM calibration_versions WHERE id = ?",
+                             (version,)).fetchone()
+    if row is None:
+        raise KeyError(f"no calibration version {version_name(version)}")
+    return RunningCalibration(*row)
+
+def _finite(value):
+    return float(value) if pd.notna(value) else None
+
+# Add (concentration, current) points on top of the latest version and return
+# the new version's id. Only the parent's statistics are read.
+def add_points(connection, points, note=None):
+    return _add_version(connection, points, note)
+
+# Add a version. With source_hash the points are a whole calibration CSV: the
+# version starts over from them instead of adding to its parent, and nothing
+# is added (None is returned) when that CSV is already the last one imported.
+def _add_version(connection, points, note=None, source_hash=None):
+    points = [(float(x), float(y)) for x, y in points]
+    if not points:
+        raise ValueError("no calibration points given")
+    # IMMEDIATE takes the write lock first, so two writers cannot branch from
+    # the same parent or import the same CSV twice
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        if source_hash is not None and source_hash == last_source_hash(connection):
+            connection.rollback()
+            return None
+        parent = latest_version(connection)
+        version = (parent or 0) + 1
+        if source_hash is None and parent is not None:
+            stats = running_stats(connection, parent)
+            base = connection.execute('SELECT base FROM calibration_versions WHERE id = ?', (parent,)).fetchone()[0]
+        else:
+            stats, base = RunningCalibration(), version
+        stats = stats.add_points(*zip(*points))
+        fit = [stats.slope, stats.intercept, stats.r_value ** 2, stats.residual_std, stats.std_response, stats.lod]
+        columns = ['id', 'parent', 'base', 'source_hash', 'created_at', 'note'] + STATS_COLUMNS + FIT_COLUMNS
+        values = ([version, parent, base, source_hash, datetime.datetime.now().isoformat(timespec='seconds'), note]
+                  + [getattr(stats, column) for column in STATS_COLUMNS] + [_finite(value) for value in fit])
+        connection.execute(f"INSERT INTO calibration_versions ({', '.join(columns)}) "
+                           f"VALUES ({', '.join('?' * len(columns))})", values)
+        connection.executemany('INSERT INTO calibration_points (version, concentration, current) VALUES (?, ?, ?)',
+                               [(version, x, y) for x, y in points])
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    return version
+
+# SHA-256 of the calibration CSV imported last, None before any import
+def last_source_hash(connection):
+    row = connection.execute('SELECT source_hash FROM calibration_versions WHERE source_hash IS NOT NULL '
+                             'ORDER BY id DESC LIMIT 1').fetchone()
+    return None if row is None else row[0]
+
+# Import the calibration CSV as a new version when its content is not the last
+# CSV imported, e.g. on first use or after the file was edited. Returns the new
+# version's id, or None when the store is up to date.
+def sync_from_csv(connection, file_path):
+    with open(file_path, 'rb') as f:
+        raw = f.read()
+    source_hash = calibration_file_hash(raw)
+    if source_hash == last_source_hash(connection):
+        return None
+    concentration, current_response = read_calibration_curve(io.BytesIO(raw))
+    return _add_version(connection, zip(concentration, current_response), f'imported from {file_path}', source_hash)
+
+# The calibration the command-line tools classify with: the given version of
+# the store at path, or its latest after syncing it with the calibration CSV
+def store_calibration(file_path, path=DEFAULT_PATH, version=None, with_points=True):
+    connection = init_schema(connect(path))
+    try:
+        if version is None:
+            sync_from_csv(connection, file_path)
+        return calibration_model(connection, version, with_points)
+    finally:
+        connection.close()
+
+# The points of a version: those added since the version it is based on.
+# Versions from before base was recorded are based on the first one.
+def version_points(connection, version):
+    rows = connection.execute('SELECT concentration, current FROM calibration_points WHERE version BETWEEN '
+                              '(SELECT COALESCE(base, 0) FROM calibration_versions WHERE id = ?1) AND ?1 ORDER BY id',
+                              (version_id(version),)).fetchall()
+    return [row[0] for row in rows], [row[1] for row in rows]
+
+# CalibrationModel of a version (the latest by default). with_points loads the
+# points up to that version, which only the calibration plot needs.
+def calibration_model(connection, version=None, with_points=True):
+    version = latest_version(connection) if version is None else version_id(version)
+    if version is None:
+        return None
+    stats = running_stats(connection, version)
+    concentration, current_response = version_points(connection, version) if with_points else ((), ())
+    return stats.model(version_name(version), concentration, current_response)
+
+def list_versions(connection):
+    table = pd.read_sql_query(f"SELECT id, parent, created_at, note, points, {', '.join(FIT_COLUMNS)} "
+                              'FROM calibration_versions ORDER BY id DESC', connection)
+    table.insert(0, 'version', table.pop('id').map(version_name))
+    table['parent'] = table['parent'].map(lambda parent: version_name(int(parent)) if pd.notna(parent) else None)
+    return table
+
+# A stored result together with the calibration version that classified it
+def trace_run(connection, run_id):
+    run = connection.execute('SELECT * FROM runs WHERE id = ?', (run_id,))
+    row = run.fetchone()
+    if row is None:
+        raise KeyError(f"no run {run_id}")
+    record = dict(zip([column[0] for column in run.description], row))
+    try:
+        version = version_id(record['calibration_version'])
+    except ValueError:
+        # Results classified with a calibration file carry its hash instead
+        return record, None
+    calibration = connection.execute(f"SELECT id, created_at, note, points, {', '.join(FIT_COLUMNS)} "
+                                     'FROM calibration_versions WHERE id = ?', (version,))
+    row = calibration.fetchone()
+    return record, None if row is None else dict(zip([column[0] for column in calibration.description], row))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Add to and inspect the versioned calibration")
+    parser.add_argument('--db', default=DEFAULT_PATH, help="SQLite store")
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help="Add concentration/current pairs as a new version")
+    add.add_argument('values', type=float, nargs='+', help="concentration current [concentration current ...]")
+    add.add_argument('--note')
+    imported = commands.add_parser('import', help="Add every point of a calibration CSV as a new version")
+    imported.add_argument('file')
+    commands.add_parser('list', help="List the versions, newest first")
+    args = parser.parse_args(argv)
+
+    connection = init_schema(connect(args.db))
+    if args.command == 'add':
+        if len(args.values) % 2:
+            parser.error("values must be concentration/current pairs")
+        version = add_points(connection, zip(args.values[::2], args.values[1::2]), args.note)
+    elif args.command == 'import':
+        concentration, current_response = read_calibration_curve(args.file)
+        version = add_points(connection, zip(concentration, current_response), note=f'imported from {args.file}')
+    else:
+        print(list_versions(connection).to_string(index=False))
+        return 0
+    model = calibration_model(connection, version, with_points=False)
+    print(f"{model.version}: slope {model.slope:.4f}, intercept {model.intercept:.4f}, "
+          f"R² {model.r_value ** 2:.4f}, LOD {model.lod:.3f} nM")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
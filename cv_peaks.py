@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+from scipy.ndimage import median_filter
+from scipy.signal import savgol_filter
+
+from instrument_reader import current_columns
+
+# Baseline-corrected peak detection for multi-scan cyclic voltammetry.
+#
+# A CV export is handled as two (scans x points) arrays, potential and
+# current, and every step (baseline fit, smoothing, peak search, integration)
+# runs on all scans at once, so the cost does not grow with a Python loop over
+# scans.
+
+# Split an export into (scans x points) potential and current arrays. PSTrace
+# writes one (V, µA) column pair per scan; shorter scans are padded with NaN.
+def cv_scans(metadata, values):
+    columns = current_columns(metadata)
+    potentials = values[:, [column - 1 for column in columns]].T
+    currents = values[:, columns].T
+    return np.ascontiguousarray(potentials), np.ascontiguousarray(currents)
+
+# True where the potential is rising. A point takes the direction of the step
+# after it (the last point that of the step before), and points on a flat step
+# the direction before it, so a scan splits at its vertices.
+def sweep_direction(potentials):
+    step = np.diff(potentials, axis=1)
+    step = np.concatenate((step, step[:, -1:]), axis=1)
+    step = np.where(np.isfinite(step), step, 0.0)
+    index = np.where(step != 0, np.arange(step.shape[1]), 0)
+    np.maximum.accumulate(index, axis=1, out=index)
+    return np.take_along_axis(step, index, axis=1) > 0
+
+# Points used for the baseline: the given potential windows, or by default the
+# outer edge_fraction of each scan's potential range at both ends, where there
+# is only capacitive (non-faradaic) current
+def baseline_mask(potentials, baseline_windows=None, edge_fraction=0.15):
+    valid = np.isfinite(potentials)
+    if baseline_windows:
+        mask = np.zeros(potentials.shape, dtype=bool)
+        for low, high in baseline_windows:
+            mask |= (potentials >= low) & (potentials <= high)
+    else:
+        low = np.nanmin(potentials, axis=1, keepdims=True)
+        high = np.nanmax(potentials, axis=1, keepdims=True)
+        margin = edge_fraction * (high - low)
+        mask = (potentials <= low + margin) | (potentials >= high - margin)
+    return mask & valid
+
+# Least-squares polynomial baseline for every scan at once: the normal
+# equations of all scans are built with einsum and solved as one batch
+def fit_baselines(potentials, currents, mask, degree=1):
+    # Center and scale the potentials so the normal equations stay well conditioned
+    center = np.nanmean(potentials, axis=1, keepdims=True)
+    scale = np.nanstd(potentials, axis=1, keepdims=True)
+    scale[scale == 0] = 1.0
+    x = np.where(np.isfinite(potentials), (potentials - center) / scale, 0.0)
+    design = x[..., None] ** np.arange(degree + 1)
+    weights = mask.astype(np.float64)
+    weighted = design * weights[..., None]
+    normal = np.einsum('spi,spj->sij', weighted, design)
+    rhs = np.einsum('spi,sp->si', weighted, np.where(mask, currents, 0.0))
+    # A scan without enough baseline points gets a zero baseline
+    solvable = np.count_nonzero(mask, axis=1) > degree
+    normal[~solvable] = np.eye(degree + 1)
+    rhs[~solvable] = 0.0
+    coefficients = np.linalg.solve(normal, rhs[..., None])[..., 0]
+    return np.einsum('spi,si->sp', design, coefficients)
+
+# Baseline fitted separately on the rising and the falling sweeps. The
+# capacitive current has the sign of the sweep direction, so the two branches
+# of a scan are offset by twice its size at every potential, and one
+# polynomial through both would leave half that offset in each peak.
+def fit_sweep_baselines(potentials, currents, mask, degree=1):
+    rising = sweep_direction(potentials)
+    return np.where(rising, fit_baselines(potentials, currents, mask & rising, degree),
+                    fit_baselines(potentials, currents, mask & ~rising, degree))
+
+# Analyze every scan of a CV file. Returns a per-scan table (peak current,
+# peak potential, peak area, baseline under the peak) and a robust summary over
+# scans: the median peak after discarding scans more than outlier_threshold
+# scaled MADs from it.
+def analyze_cv(potentials, currents, baseline_windows=None, degree=1, edge_fraction=0.15,
+               spike_window=5, smooth_window=11, smooth_order=2, outlier_threshold=3.5):
+    potentials = np.atleast_2d(np.asarray(potentials, dtype=np.float64))
+    currents = np.atleast_2d(np.asarray(currents, dtype=np.float64))
+    valid = np.isfinite(potentials) & np.isfinite(currents)
+
+    mask = baseline_mask(potentials, baseline_windows, edge_fraction) & valid
+    baseline = fit_sweep_baselines(potentials, currents, mask, degree)
+    corrected = np.where(valid, currents - baseline, 0.0)
+
+    # A running median along each scan removes single-point spikes that a
+    # polynomial smoother would only spread out
+    if spike_window > 1:
+        corrected = median_filter(corrected, size=(1, spike_window), mode='nearest')
+    n_points = corrected.shape[1]
+    window = min(smooth_window, n_points if n_points % 2 else n_points - 1)
+    if window > smooth_order:
+        corrected = savgol_filter(corrected, window, smooth_order, axis=1)
+    corrected[~valid] = np.nan
+
+    scans = np.arange(corrected.shape[0])
+    peak_index = np.argmax(np.where(valid, corrected, -np.inf), axis=1)
+    peak_current = corrected[scans, peak_index]
+    peak_potential = potentials[scans, peak_index]
+
+    # Integrate the contiguous stretch of positive corrected current around the
+    # peak. The nearest non-positive point on each side is found with running
+    # max/min accumulations instead of a search per scan.
+    index = np.broadcast_to(np.arange(n_points), corrected.shape)
+    positive = corrected > 0
+    left = np.maximum.accumulate(np.where(positive, -1, index), axis=1)[scans, peak_index]
+    right = np.minimum.accumulate(np.where(positive, n_points, index)[:, ::-1], axis=1)[:, ::-1][scans, peak_index]
+    in_peak = (index > left[:, None]) & (index < right[:, None])
+    segment = np.where(in_peak, corrected, 0.0)
+    step = np.abs(np.diff(potentials, axis=1))
+    peak_area = np.nansum(0.5 * (segment[:, 1:] + segment[:, :-1]) * step, axis=1)
+
+    per_scan = pd.DataFrame({
+        'scan': scans + 1,
+        'peak_current': peak_current,
+        'peak_potential': peak_potential,
+        'peak_area': peak_area,
+        'baseline_current': baseline[scans, peak_index],
+    })
+
+    median = np.nanmedian(peak_current)
+    mad = 1.4826 * np.nanmedian(np.abs(peak_current - median))
+    inliers = np.abs(peak_current - median) <= outlier_threshold * mad if mad > 0 else np.isfinite(peak_current)
+    summary = {
+        'scans': len(scans),
+        'inlier_scans': int(np.count_nonzero(inliers)),
+        'peak_current': float(np.median(peak_current[inliers])),
+        'peak_current_mad': float(mad),
+        'peak_potential': float(np.median(peak_potential[inliers])),
+        'peak_area': float(np.median(peak_area[inliers])),
+    }
+    return per_scan, summary
+
+# Baseline-corrected counterpart of determine_peak_current for a CV export
+def determine_corrected_peak_current(metadata, values, **options):
+    potentials, currents = cv_scans(metadata, values)
+    per_scan, summary = analyze_cv(potentials, currents, **options)
+    return summary['peak_current']
@@ -0,0 +1,87 @@
+import numpy as np
+
+# Shape-preserving downsampling of long traces for display.
+#
+# minmax keeps the smallest and largest sample of each bucket, so spikes and
+# the envelope of the noise survive at any zoom level. MinMaxPyramid
+# precomputes those extrema for buckets of 64, 128, 256, ... samples, so
+# re-aggregating a zoomed range reads a few thousand precomputed buckets
+# instead of every sample in it: the cost depends on the number of output
+# points, not on the length of the recording.
+
+# Group consecutive extrema into buckets of size entries and reduce them.
+# Arrays are padded with +inf/-inf so a short last bucket needs no special
+# case; NaN samples are never chosen.
+def _reduce(min_values, min_index, max_values, max_index, size):
+    n_buckets = -(-len(min_values) // size)
+    pad = n_buckets * size - len(min_values)
+
+    def grouped(values, index, fill):
+        values = np.where(np.isnan(values), fill, values)
+        if pad:
+            values = np.concatenate((values, np.full(pad, fill)))
+            index = np.concatenate((index, np.full(pad, index[-1])))
+        return values.reshape(n_buckets, size), index.reshape(n_buckets, size)
+
+    values, index = grouped(min_values, min_index, np.inf)
+    rows = np.arange(n_buckets)
+    low = np.argmin(values, axis=1)
+    new_min_values, new_min_index = values[rows, low], index[rows, low]
+    values, index = grouped(max_values, max_index, -np.inf)
+    high = np.argmax(values, axis=1)
+    return new_min_values, new_min_index, values[rows, high], index[rows, high]
+
+# Indices of the min and max sample of each of n_buckets equal buckets of
+# y[start:stop], in sample order
+def minmax_indices(y, n_buckets, start=0, stop=None):
+    y = np.asarray(y, dtype=np.float64)
+    stop = len(y) if stop is None else stop
+    if stop - start <= 2 * n_buckets:
+        return np.arange(start, stop)
+    size = -(-(stop - start) // n_buckets)
+    index = np.arange(start, stop)
+    segment = y[start:stop]
+    _, low, _, high = _reduce(segment, index, segment, index, size)
+    return np.unique(np.concatenate((low, high)))
+
+class MinMaxPyramid:
+    # Buckets of the first level; shorter ranges are read from the samples
+    BASE = 64
+
+    def __init__(self, y):
+        self.y = np.asarray(y, dtype=np.float64)
+        self.levels = []
+        index = np.arange(len(self.y))
+        level = _reduce(self.y, index, self.y, index, self.BASE) if len(self.y) > self.BASE else None
+        size = self.BASE
+        while level is not None:
+            self.levels.append((size, level))
+            if len(level[0]) < 4:
+                break
+            level = _reduce(*level, 2)
+            size *= 2
+
+    def __len__(self):
+        return len(self.y)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for _, level in self.levels for array in level)
+
+    # Indices of about 2 * n_buckets min/max samples of y[start:stop]
+    def indices(self, n_buckets, start=0, stop=None):
+        stop = len(self.y) if stop is None else min(stop, len(self.y))
+        start = max(start, 0)
+        span = stop - start
+        # Coarsest level that still gives n_buckets buckets over the range
+        usable = [(size, level) for size, level in self.levels if span // size >= n_buckets]
+        if not usable:
+            return minmax_indices(self.y, n_buckets, start, stop)
+        size, (min_values, min_index, max_values, max_index) = usable[-1]
+        first, last = -(-start // size), stop // size
+        parts = [minmax_indices(self.y, 2, start, min(first * size, stop)),
+                 minmax_indices(self.y, 2, max(last * size, start), stop)]
+        group = max(-(-(last - first) // n_buckets), 1)
+        _, low, _, high = _reduce(min_values[first:last], min_index[first:last],
+                                  max_values[first:last], max_index[first:last], group)
+        return np.unique(np.concatenate(parts + [low, high]))
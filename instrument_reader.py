@@ -0,0 +1,287 @@
+import warnings
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from instrumentation import timed
+
+# Reader for PalmSens (PSTrace) UTF-16 CSV exports.
+#
+# An export is a free-form preamble followed by a units line and a block of
+# comma separated numbers:
+#
+#   Date and time:,2024-03-06 14:22:18
+#   Notes:
+#
+#   Chronoamperometry: CA i vs t
+#   Date and time measurement:,2024-03-06 14:18:14,
+#   s,µA
+#   0.00000E+000,2.04544E+000
+#   ...
+#
+# The numeric block is located by content rather than by a fixed row count, so
+# a longer or shorter preamble does not shift the data.
+
+# Technique names as written by PSTrace and the short codes used by the analysis
+TECHNIQUES = {
+    'Chronoamperometry': 'CA',
+    'Cyclic Voltammetry': 'CV',
+    'Linear Sweep Voltammetry': 'LSV',
+    'Differential Pulse Voltammetry': 'DPV',
+    'Square Wave Voltammetry': 'SWV',
+}
+
+# Number of characters decoded to look for the start of the numeric block
+PREAMBLE_CHARS = 1 << 16
+
+_BLANK = (ord(' '), ord('\t'), ord('\r'), ord('\n'), 0xFEFF, 0)
+
+def read_bytes(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    if hasattr(source, 'read'):
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return source.read()
+    with open(source, 'rb') as f:
+        return f.read()
+
+# View the raw file as an array of UTF-16 code units without decoding it
+def _code_units(raw):
+    if raw[:2] == b'\xff\xfe':
+        return np.frombuffer(raw, dtype='<u2', offset=2, count=(len(raw) - 2) // 2)
+    if raw[:2] == b'\xfe\xff':
+        return np.frombuffer(raw, dtype='>u2', offset=2, count=(len(raw) - 2) // 2)
+    # No BOM: ASCII text has its zero byte first in big-endian order
+    dtype = '>u2' if raw[:1] == b'\x00' else '<u2'
+    return np.frombuffer(raw, dtype=dtype, count=len(raw) // 2)
+
+def _decode(units, errors='strict'):
+    return units.tobytes().decode('utf-16-be' if units.dtype.str == '>u2' else 'utf-16-le', errors)
+
+def _is_numeric_line(line):
+    fields = [field.strip() for field in line.split(',')]
+    if not any(fields):
+        return False
+    try:
+        for field in fields:
+            if field:
+                float(field)
+    except ValueError:
+        return False
+    return True
+
+def _field_count(line):
+    return len(line.rstrip().rstrip(',').split(','))
+
+# Parse "key:,value" lines of the preamble into a dict
+def parse_preamble(lines):
+    metadata = {}
+    for line in lines:
+        line = line.strip().strip('\ufeff')
+        if ':' not in line:
+            continue
+        key, value = line.split(':', 1)
+        key = key.strip()
+        value = value.strip().strip(',').strip()
+        if key in TECHNIQUES:
+            metadata['technique'] = TECHNIQUES[key]
+            metadata['method'] = key
+            metadata['curve'] = value
+        else:
+            metadata[key] = value
+    return metadata
+
+# Slow path for blocks with empty cells (scans of unequal length) or stray
+# lines: unparseable lines are skipped and missing cells become NaN
+def _parse_lines(text, n_columns):
+    rows = []
+    for line in text.splitlines():
+        fields = line.split(',')[:n_columns]
+        try:
+            row = [float(field) if field.strip() else np.nan for field in fields]
+        except ValueError:
+            continue
+        if row:
+            rows.append(row + [np.nan] * (n_columns - len(row)))
+    return np.array(rows, dtype=np.float64).reshape(-1, n_columns)
+
+# Exact powers of ten; every power up to 1e22 is representable, so scaling an
+# integer mantissa by one of them is a single correctly rounded operation
+_POW10 = 10.0 ** np.arange(23)
+
+# The numeric block is parsed in pieces of about this many characters so the
+# temporaries stay bounded for multi-gigabyte exports
+CHUNK_CHARS = 1 << 24
+
+# Fast path for PSTrace's fixed scientific format ("-1.23456E-001"): apart
+# from the sign every field has the same width, so each field can be copied out
+# as a fixed-width row of bytes and its digits combined column by column.
+# Only the columns listed in columns are converted (all when None). Returns
+# None when the block is not in that format.
+def _parse_scientific(buf, n_columns, columns=None):
+    seps = np.flatnonzero((buf == 44) | (buf == 10))
+    n_fields = len(seps) + 1
+    if n_fields % n_columns:
+        return None
+    # Line ends must fall exactly after every n_columns fields
+    newlines = buf[seps] == 10
+    if np.count_nonzero(newlines) != n_fields // n_columns - 1 or not np.all(newlines[n_columns - 1::n_columns]):
+        return None
+
+    starts = np.empty(n_fields, dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = seps + 1
+    ends = np.empty(n_fields, dtype=np.int64)
+    ends[:-1] = seps
+    ends[-1] = len(buf)
+    ends -= buf[np.maximum(ends - 1, 0)] == 13
+    if np.any(ends <= starts):
+        return None
+    if columns is not None:
+        fields = np.arange(0, n_fields, n_columns)[:, None] + np.asarray(columns)
+        starts, ends = starts[fields.ravel()], ends[fields.ravel()]
+        n_columns = len(columns)
+    negative = buf[starts] == 45
+    starts += negative
+
+    field = buf[starts[0]:ends[0]].tobytes()
+    width = len(field)
+    e_pos = max(field.find(b'E'), field.find(b'e'))
+    n_decimals = e_pos - 2
+    n_exponent = width - e_pos - 2
+    if e_pos < 2 or field[1:2] != b'.' or not 0 < n_exponent <= 3 or n_decimals > 15:
+        return None
+    if np.any(ends - starts != width):
+        return None
+
+    rows = sliding_window_view(buf, width)[starts]
+    if np.any(rows[:, 1] != 46) or np.any((rows[:, e_pos] | 32) != 101):
+        return None
+    exponent_sign = rows[:, e_pos + 1]
+    if np.any((exponent_sign != 43) & (exponent_sign != 45)):
+        return None
+    # Accumulate the digits column by column; the character codes are summed
+    # as they are and the '0' offset is removed once at the end
+    digit_columns = [rows[:, i] for i in [0] + list(range(2, e_pos))]
+    exponent_columns = [rows[:, i] for i in range(e_pos + 2, width)]
+    if any(np.any((column < 48) | (column > 57)) for column in digit_columns + exponent_columns):
+        return None
+    accumulator = np.uint64 if n_decimals > 8 else np.uint32
+    mantissa = digit_columns[0].astype(accumulator)
+    for column in digit_columns[1:]:
+        mantissa *= 10
+        mantissa += column
+    # The offset is taken modulo the accumulator too, so both wrap alike
+    offset = 48 * int('1' * (n_decimals + 1)) % (int(np.iinfo(accumulator).max) + 1)
+    mantissa = (mantissa - accumulator(offset)).astype(np.float64)
+    exponent = exponent_columns[0].astype(np.int64)
+    for column in exponent_columns[1:]:
+        exponent *= 10
+        exponent += column
+    exponent -= 48 * int('1' * n_exponent)
+    power = np.where(exponent_sign == 45, -exponent, exponent) - n_decimals
+    if np.any(np.abs(power) >= len(_POW10)):
+        return None
+    scale = _POW10[np.abs(power)]
+    values = np.where(power >= 0, mantissa * scale, mantissa / scale)
+    values[negative] *= -1
+    return values.reshape(-1, n_columns)
+
+def _parse_chunk(units, n_columns, columns=None):
+    if units.max() < 128:
+        buf = units.astype(np.uint8)
+        values = _parse_scientific(buf, n_columns, columns)
+        if values is not None:
+            return values
+
+        # Other ASCII layouts: let NumPy's C parser read the whole chunk in one call
+        text = buf.tobytes().replace(b'\r', b'').replace(b'\n', b',')
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            try:
+                values = np.fromstring(text, dtype=np.float64, sep=',')
+            except (ValueError, DeprecationWarning):
+                values = None
+        # A short read means the parser stopped at an empty or malformed cell
+        if values is not None and values.size == text.count(b',') + 1 and values.size % n_columns == 0:
+            values = values.reshape(-1, n_columns)
+            return values if columns is None else values[:, columns]
+    values = _parse_lines(_decode(units), n_columns)
+    return values if columns is None else values[:, columns]
+
+def _parse_block(units, n_columns, columns=None):
+    # Drop trailing newlines, NUL padding and the stray BOM PSTrace appends
+    end = len(units)
+    while end and units[end - 1] in _BLANK:
+        end -= 1
+    units = units[:end]
+
+    # Split at line ends close to every CHUNK_CHARS characters
+    chunks = []
+    start = 0
+    while start < len(units):
+        stop = start + CHUNK_CHARS
+        if stop < len(units):
+            newline = np.flatnonzero(units[stop:stop + 4096] == 10)
+            stop = stop + newline[0] + 1 if len(newline) else len(units)
+        chunk = units[start:stop]
+        while len(chunk) and chunk[-1] in _BLANK:
+            chunk = chunk[:-1]
+        if len(chunk):
+            chunks.append(_parse_chunk(chunk, n_columns, columns))
+        start = stop
+    if not chunks:
+        return np.empty((0, n_columns if columns is None else len(columns)))
+    return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+# Find the numeric block of an export. Returns the metadata of the preamble,
+# the offset of the block in code units and its column count.
+def _split_preamble(units):
+    head = _decode(units[:PREAMBLE_CHARS], errors='replace')
+    lines = head.splitlines(keepends=True)
+
+    offset = 0
+    for i, line in enumerate(lines):
+        if _is_numeric_line(line):
+            break
+        offset += len(line)
+    else:
+        raise ValueError("no numeric data block found")
+
+    preamble = lines[:i]
+    metadata = parse_preamble(preamble)
+    header = next((line for line in reversed(preamble) if line.strip()), '')
+    n_columns = max(_field_count(header), _field_count(lines[i]))
+    metadata['units'] = [unit.strip() for unit in header.strip().split(',')][:n_columns]
+    metadata['header_rows'] = i
+    return metadata, offset, n_columns
+
+# Read an export into (metadata, values) where values is a float64 array of
+# shape (rows, columns) in the column order of the file. The units of each
+# column are in metadata['units'].
+# source can be a path, the raw bytes or a file-like object (e.g. a Streamlit upload).
+# columns optionally picks the columns to convert: a function of the metadata
+# returning column indices, such as current_columns. values then holds only
+# those columns, and metadata['columns'] their indices in the file.
+@timed('read_instrument_file')
+def read_instrument_file(source, columns=None):
+    units = _code_units(read_bytes(source))
+    metadata, offset, n_columns = _split_preamble(units)
+    if columns is not None:
+        columns = metadata['columns'] = list(columns(metadata))
+    values = _parse_block(units[offset:], n_columns, columns)
+    return metadata, values
+
+# Only the metadata of an export, without parsing the numeric block
+def read_metadata(source):
+    metadata, _, _ = _split_preamble(_code_units(read_bytes(source)))
+    return metadata
+
+# Indices of the current columns (µA, mA, nA, A) of an export. An export
+# without them, e.g. one that lost its units line, cannot be analyzed.
+def current_columns(metadata):
+    columns = [i for i, unit in enumerate(metadata['units']) if unit.endswith('A')]
+    if not columns:
+        raise ValueError("no current column in export")
+    return columns
@@ -0,0 +1,193 @@
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+from analysis import (load_calibration_model, determine_steady_state_current, classify_currents, RESULT_LABELS)
+from instrument_reader import read_instrument_file, current_columns
+from calibration_store import store_calibration
+from instrumentation import timed
+from results_store import DEFAULT_PATH
+
+# Analysis of multiplexed electrode arrays, where one export holds a current
+# trace per channel: either a (time, current) pair of columns per channel as
+# PSTrace's multichannel export writes them, or one time column followed by the
+# currents.
+#
+#   python multichannel.py array_run.csv -o channels.csv
+#   python multichannel.py array_run.csv --channel-calibration 1-8=data/lot_a.csv
+#
+# The currents are read into a channels x samples matrix and every step is done
+# for all channels at once: the steady state from the last samples of each row,
+# CV peaks as a row maximum, and the calibration inversion and classification
+# with classify_currents, once per distinct calibration. Channels are numbered
+# from 1 in column order.
+
+CHANNEL_COLUMNS = ['channel', 'unit', 'technique', 'current', 'snr', 'concentration', 'ci_half_width', 'result',
+                   'call', 'calibration']
+
+# Samples dropped at the start of every chronoamperometry trace, as in the
+# single-channel analysis
+SKIP_SAMPLES = 3
+
+# Columns as a view when they are evenly spaced, so a 96-channel matrix read
+# from the cache is not copied
+def _columns(values, columns):
+    if len(columns) > 1 and len(set(np.diff(columns))) == 1:
+        return values[:, columns[0]:columns[-1] + 1:columns[1] - columns[0]]
+    return values[:, columns]
+
+# The first column when it is not a current, then the current columns
+def _time_and_current_columns(metadata):
+    columns = current_columns(metadata)
+    return columns if columns[0] == 0 else [0] + columns
+
+# Read a multichannel export into (metadata, time, currents) where currents
+# is a channels x samples float64 array, and time the first column of the file
+# (None when the first column is a current). Without a cache only those
+# columns are converted, which skips the repeated time columns of the
+# pair-per-channel layout. cache is an optional parse_cache.ParsedFileCache.
+@timed('read_channels')
+def read_channels(source, cache=None):
+    if cache is None:
+        metadata, values = read_instrument_file(source, columns=_time_and_current_columns)
+        columns = metadata['columns']
+    else:
+        metadata, values = cache.read(source)
+        columns = _time_and_current_columns(metadata)
+        values = _columns(values, columns)
+    metadata['channel_units'] = [metadata['units'][column] for column in current_columns(metadata)]
+    time = None if columns[0] in current_columns(metadata) else values[:, 0]
+    currents = values if time is None else values[:, 1:]
+    return metadata, time, currents.T
+
+# Steady-state current and SNR of every row, as determine_steady_state_current
+# computes them for one trace: the mean of the last window_size moving
+# averages of window_size samples, and the standard deviation of the last
+# window_size samples as the noise. Rows too short for that or with missing
+# samples near the end go through determine_steady_state_current itself.
+@timed('steady_state_currents')
+def steady_state_currents(currents, window_size=10, skip=SKIP_SAMPLES):
+    currents = np.asarray(currents, dtype=np.float64)[:, skip:]
+    n_channels, n_samples = currents.shape
+    steady_state = np.full(n_channels, np.nan)
+    snr = np.full(n_channels, np.nan)
+    span = 2 * window_size - 1
+    fallback = np.arange(n_channels)
+    if n_samples >= span:
+        tail = currents[:, -span:]
+        fast = ~np.isnan(tail).any(axis=1)
+        tail = tail[fast]
+        cumsum = np.zeros((len(tail), span + 1))
+        np.cumsum(tail, axis=1, out=cumsum[:, 1:])
+        moving_avg = (cumsum[:, window_size:] - cumsum[:, :window_size]) / window_size
+        steady_state[fast] = moving_avg.mean(axis=1)
+        noise = tail[:, -window_size:].std(axis=1, ddof=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            snr[fast] = np.where(noise > 0, steady_state[fast] / noise, np.inf)
+        fallback = np.flatnonzero(~fast)
+    for channel in fallback:
+        values = pd.Series(currents[channel]).dropna().reset_index(drop=True)
+        if len(values):
+            steady_state[channel], snr[channel] = determine_steady_state_current(values, window_size)
+    return steady_state, snr
+
+# Peak current of every row, ignoring missing samples
+@timed('peak_currents')
+def peak_currents(currents):
+    currents = np.asarray(currents, dtype=np.float64)
+    peaks = np.max(currents, axis=1)
+    missing = np.isnan(peaks)
+    if missing.any():
+        # Only rows with gaps pay for the NaN-aware maximum
+        with np.errstate(invalid='ignore'):
+            peaks[missing] = np.nanmax(np.where(np.isnan(currents[missing]), -np.inf, currents[missing]), axis=1)
+        peaks[np.isinf(peaks)] = np.nan
+    return peaks
+
+# Classify every channel and return the per-channel table. calibrations maps
+# channel numbers to the CalibrationModel of that electrode; the others use
+# calibration.
+@timed('analyze_channels')
+def analyze_channels(metadata, currents, calibration, calibrations=None, confidence=0.95, window_size=10):
+    technique = metadata.get('technique', 'CV')
+    n_channels = len(currents)
+    snr = np.full(n_channels, np.nan)
+    if technique == 'CA':
+        current, snr = steady_state_currents(currents, window_size)
+    else:
+        current = peak_currents(currents)
+
+    models = [calibration] * n_channels
+    for channel, model in (calibrations or {}).items():
+        if not 1 <= channel <= n_channels:
+            raise ValueError(f"calibration given for channel {channel}, the file has {n_channels}")
+        models[channel - 1] = model
+
+    concentration = np.full(n_channels, np.nan)
+    half_width = np.full(n_channels, np.nan)
+    result = np.full(n_channels, None, dtype=object)
+    call = np.full(n_channels, None, dtype=object)
+    measured = ~np.isnan(current)
+    # One vectorized pass per distinct calibration
+    for model in {id(model): model for model in models}.values():
+        rows = np.flatnonzero(measured & np.array([other is model for other in models]))
+        if not len(rows):
+            continue
+        concentration[rows], half_width[rows], codes = classify_currents(model, current[rows], confidence)
+        # determine_result's rule: Positive at or above the LOD
+        result[rows] = np.where(concentration[rows] >= model.lod, 'Positive', 'Negative')
+        call[rows] = RESULT_LABELS[codes]
+
+    units = metadata.get('channel_units') or [None] * n_channels
+    return pd.DataFrame({'channel': np.arange(1, n_channels + 1), 'unit': units, 'technique': technique,
+                         'current': current, 'snr': snr, 'concentration': concentration,
+                         'ci_half_width': half_width, 'result': result, 'call': call,
+                         'calibration': [model.version for model in models]}, columns=CHANNEL_COLUMNS)
+
+def analyze_multichannel_file(source, calibration, calibrations=None, cache=None, confidence=0.95):
+    metadata, _, currents = read_channels(source, cache)
+    return analyze_channels(metadata, currents, calibration, calibrations, confidence)
+
+# "3", "1-8" or "1,4,9-12" -> channel numbers
+def parse_channels(text):
+    channels = []
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        channels.extend(range(int(first), int(last or first) + 1))
+    return channels
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Classify every channel of a multichannel PalmSens export.")
+    parser.add_argument('file', help="Multichannel CSV export")
+    parser.add_argument('-o', '--output', help="Write the channel table (.csv or .json) instead of printing it")
+    parser.add_argument('--calibration', default='data/Calibration_curve.csv',
+                        help="Calibration curve CSV, added to the store as a new version when it changes")
+    parser.add_argument('--db', default=DEFAULT_PATH, help="SQLite store holding the calibration versions")
+    parser.add_argument('--calibration-version', help="Classify with this stored version (default: the latest)")
+    parser.add_argument('--channel-calibration', action='append', default=[], metavar='CHANNELS=FILE',
+                        help="Calibration CSV for some channels, e.g. 1-8=lot_a.csv (repeatable)")
+    parser.add_argument('--confidence', type=float, default=0.95, help="Confidence level of the prediction interval")
+    args = parser.parse_args(argv)
+
+    calibrations = {}
+    for option in args.channel_calibration:
+        channels, separator, file_path = option.partition('=')
+        if not separator:
+            parser.error(f"--channel-calibration expects CHANNELS=FILE, got {option!r}")
+        model = load_calibration_model(file_path)
+        calibrations.update(dict.fromkeys(parse_channels(channels), model))
+
+    calibration = store_calibration(args.calibration, args.db, args.calibration_version)
+    table = analyze_multichannel_file(args.file, calibration, calibrations, confidence=args.confidence)
+    if args.output is None:
+        print(table.to_string(index=False))
+    elif args.output.endswith('.json'):
+        table.to_json(args.output, orient='records', indent=2)
+    else:
+        table.to_csv(args.output, index=False)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
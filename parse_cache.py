@@ -0,0 +1,153 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from instrument_reader import read_bytes, read_instrument_file
+from instrumentation import timed
+
+# Content-addressed cache of parsed exports.
+#
+#   cache = ParsedFileCache('cache/parsed', max_bytes=2 << 30)
+#   metadata, values = cache.read('Results/E1_Amp0.4_5nM.csv')
+#
+# An export is parsed once and its values saved as <sha256>.npy with the
+# preamble metadata in <sha256>.json, under a two-character fan-out directory.
+# Later reads of the same bytes, under any name, memory-map the .npy instead of
+# decoding the UTF-16 text again, so re-analyzing an archive costs the reads
+# and the SHA-256 of the raw files. Entries are evicted least recently used
+# first once the cache is over max_bytes; a hit touches the entry's mtime so
+# the order survives restarts. Several processes can share a directory: writes
+# are atomic and an entry evicted by another process is just a miss.
+# max_bytes is the limit of the whole directory, not of one process: before
+# evicting, a process re-measures the directory once it has written
+# max_bytes / RESCAN_FRACTION since it last did, or its view is more than
+# RESCAN_SECONDS old, so it sees what the others wrote. With P processes the
+# directory stays within max_bytes * (1 + P / RESCAN_FRACTION) plus what they
+# wrote in the last RESCAN_SECONDS.
+
+DEFAULT_MAX_BYTES = 2 << 30
+RESCAN_FRACTION = 16
+RESCAN_SECONDS = 1.0
+
+class ParsedFileCache:
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # digest -> entry size, least recently used first; filled on first use
+        # and again at a write when stale (see RESCAN_FRACTION)
+        self._entries = None
+        self._size = 0
+        self._scanned = 0.0
+        self._written = 0
+
+    def _paths(self, digest):
+        base = os.path.join(self.directory, digest[:2], digest)
+        return f'{base}.npy', f'{base}.json'
+
+    def _index(self):
+        if self._entries is None:
+            found = []
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    if name.endswith('.npy'):
+                        digest = name[:-4]
+                        try:
+                            sizes = [os.stat(path) for path in self._paths(digest)]
+                        except FileNotFoundError:
+                            continue
+                        found.append((sizes[0].st_mtime, digest, sum(stat.st_size for stat in sizes)))
+            self._entries = collections.OrderedDict((digest, size) for _, digest, size in sorted(found))
+            self._size = sum(self._entries.values())
+            self._scanned = time.monotonic()
+            self._written = 0
+        return self._entries
+
+    # (metadata, read-only memory-mapped values) of a digest, or None
+    def get(self, digest):
+        npy_path, json_path = self._paths(digest)
+        try:
+            with open(json_path) as f:
+                metadata = json.load(f)
+                json_size = os.fstat(f.fileno()).st_size
+            values = np.load(npy_path, mmap_mode='r')
+            os.utime(npy_path)
+        except (FileNotFoundError, ValueError):
+            return None
+        with self._lock:
+            entries = self._index()
+            if digest in entries:
+                entries.move_to_end(digest)
+            else:
+                # Written by another process since the index was built; the
+                # files may be gone again already, so they are not stat'ed
+                size = values.offset + values.nbytes + json_size
+                entries[digest] = size
+                self._size += size
+        return metadata, values
+
+    def put(self, digest, metadata, values):
+        npy_path, json_path = self._paths(digest)
+        os.makedirs(os.path.dirname(npy_path), exist_ok=True)
+        suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(npy_path + suffix, 'wb') as f:
+            np.save(f, np.ascontiguousarray(values, dtype=np.float64))
+            size = f.tell()
+        with open(json_path + suffix, 'w') as f:
+            json.dump(metadata, f)
+            f.flush()
+            size += os.fstat(f.fileno()).st_size
+        # The metadata goes in first, so a visible .npy always has its .json.
+        # Another process may evict the entry as soon as it is visible.
+        os.replace(json_path + suffix, json_path)
+        os.replace(npy_path + suffix, npy_path)
+        with self._lock:
+            self._written += size
+            if (self._written > self.max_bytes / RESCAN_FRACTION
+                    or time.monotonic() - self._scanned > RESCAN_SECONDS):
+                self._entries = None
+            entries = self._index()
+            self._size += size - entries.pop(digest, 0)
+            entries[digest] = size
+            self._evict()
+
+    def _evict(self):
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            digest, size = self._entries.popitem(last=False)
+            self._size -= size
+            for path in self._paths(digest):
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Already evicted by another process, or on Windows still
+                    # memory-mapped by a reader; the next rescan counts it again
+                    pass
+
+    # read_instrument_file through the cache. source can be a path, the raw
+    # bytes or a file-like object. Timed as a whole, hits included; misses also
+    # show up as read_instrument_file.
+    @timed('parse_cache_read')
+    def read(self, source):
+        raw = read_bytes(source)
+        digest = hashlib.sha256(raw).hexdigest()
+        cached = self.get(digest)
+        if cached is not None:
+            return cached
+        metadata, values = read_instrument_file(raw)
+        self.put(digest, metadata, values)
+        return metadata, values
+
+    @property
+    def size(self):
+        with self._lock:
+            self._index()
+            return self._size
+
+    def __len__(self):
+        with self._lock:
+            return len(self._index())
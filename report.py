@@ -0,0 +1,191 @@
+import argparse
+import copy
+import datetime
+import functools
+import io
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from instrumentation import timed
+
+# Patient reports rendered locally from the Word template in Report/.
+#
+#   python report.py results.csv -o reports.zip
+#
+# results.csv is a results table such as the one written by batch_analyzer.py,
+# optionally with patient_id, patient_name, age, gender and collection_date
+# columns.
+#
+# Each result is rendered from its own template, Report/Report_<result>.docx,
+# whose clinical wording is supplied by the clinicians. A missing result uses
+# the Indeterminate template. Until a result has its template, its reports are
+# rendered from the Positive one with the Interpretation section removed and
+# the Detection Method no longer stating that the allele was identified.
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Report')
+TEMPLATE_PATH = os.path.join(TEMPLATE_DIR, 'Report_Positive.docx')
+DOCX_MIME = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+# Labels of the patient table in the template and the report fields they show
+PATIENT_ROWS = {
+    'Collection Date': 'collection_date',
+    'Patient Name': 'patient_name',
+    'Patient ID': 'patient_id',
+    'Gender': 'gender',
+    'Age': 'age',
+}
+
+# The template is read once per process and kept in memory
+@functools.lru_cache(maxsize=4)
+def load_template(path=TEMPLATE_PATH):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def format_date(value):
+    if isinstance(value, str) and value:
+        value = pd.Timestamp(value)
+    if isinstance(value, (datetime.date, pd.Timestamp)):
+        return value.strftime('%B %d, %Y')
+    return '' if value is None else str(value)
+
+def format_number(value, digits=2):
+    if value is None or value == '' or pd.isna(value):
+        return ''
+    return f"{float(value):.{digits}f}"
+
+# Results with a template of their own; anything else is Indeterminate
+RESULTS = ('Positive', 'Negative', 'Indeterminate')
+# The sentence of the Positive template's Detection Method that only holds for
+# a Positive result
+POSITIVE_DETECTION = "The CYP2C192 allele was identified using the GeneDetek device."
+
+# Path of the clinicians' template for a result
+def template_path(result):
+    return os.path.join(TEMPLATE_DIR, f"Report_{result if result in RESULTS else 'Indeterminate'}.docx")
+
+# Replace the text of a paragraph, keeping the format of its first run
+def _set_paragraph_text(paragraph, text):
+    for run in paragraph.runs[1:]:
+        run._r.getparent().remove(run._r)
+    paragraph.runs[0].text = text
+
+# Take what only holds for a Positive result out of the Positive template: the
+# Interpretation section, its heading included, and the sentence of the
+# Detection Method saying the allele was identified
+def _remove_positive_wording(document):
+    paragraphs = document.paragraphs
+    titles = [paragraph.text.strip() for paragraph in paragraphs]
+    start, stop = titles.index('Interpretation'), titles.index('Detection Method')
+    for paragraph in paragraphs[start:stop]:
+        paragraph._p.getparent().remove(paragraph._p)
+    for paragraph in document.paragraphs:
+        if POSITIVE_DETECTION in paragraph.text:
+            _set_paragraph_text(paragraph, paragraph.text.replace(POSITIVE_DETECTION, '').lstrip())
+
+# Replace the text of a cell, keeping the font of the template's label cell
+def _set_cell_text(cell, text, like=None):
+    paragraph = cell.paragraphs[0]
+    for run in paragraph.runs[1:]:
+        run._r.getparent().remove(run._r)
+    run = paragraph.runs[0] if paragraph.runs else paragraph.add_run()
+    run.text = text
+    if like is not None and not paragraph.runs[0].font.name:
+        run.font.name = like.font.name
+        run.font.size = like.font.size
+
+def _append_row(table, label, value):
+    template_row = table.rows[-1]
+    new_row = copy.deepcopy(template_row._tr)
+    template_row._tr.addnext(new_row)
+    row = table.rows[-1]
+    _set_cell_text(row.cells[0], label)
+    _set_cell_text(row.cells[1], value)
+
+# Fill the template with one result and return the .docx bytes.
+# fields: patient_id, patient_name, age, gender, collection_date, current,
+# concentration and result; missing fields are left blank. template, the
+# .docx bytes, defaults to the result's template (see template_path).
+@timed('report_generation')
+def render_report(fields, template=None):
+    # python-docx is only needed here, so importing this module stays cheap
+    from docx import Document
+    result = str(fields.get('result') or '')
+    generic = False
+    if template is None:
+        path = template_path(result)
+        generic = not os.path.exists(path)
+        template = load_template(TEMPLATE_PATH if generic else path)
+    document = Document(io.BytesIO(template))
+    patient_table, result_table = document.tables[:2]
+
+    for row in patient_table.rows:
+        label_cell, value_cell = row.cells[0], row.cells[1]
+        key = PATIENT_ROWS.get(label_cell.text.strip())
+        if key is None:
+            continue
+        value = fields.get(key)
+        text = format_date(value) if key == 'collection_date' else ('' if value is None else str(value))
+        _set_cell_text(value_cell, text, like=label_cell.paragraphs[0].runs[0])
+
+    _set_cell_text(result_table.rows[1].cells[1], result)
+    if generic and result != 'Positive':
+        _remove_positive_wording(document)
+    _append_row(result_table, 'Peak Current (µA)', format_number(fields.get('current')))
+    _append_row(result_table, 'Concentration (nM)', format_number(fields.get('concentration')))
+
+    output = io.BytesIO()
+    document.save(output)
+    return output.getvalue()
+
+def report_file_name(fields, index=0):
+    name = fields.get('patient_id') or os.path.splitext(os.path.basename(str(fields.get('file') or '')))[0]
+    return f"Report_{name or index + 1}.docx"
+
+def _render_entry(entry):
+    index, fields = entry
+    return report_file_name(fields, index), render_report(fields)
+
+# Render a report for every row and write them into a ZIP as they complete.
+# output can be a path or any writable binary stream, including unseekable
+# ones such as an HTTP response, so the archive is streamed out rather than
+# built in memory.
+def write_reports_zip(rows, output, workers=None, chunksize=8):
+    rows = [dict(row) for row in rows]
+    names = set()
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as archive, \
+            ProcessPoolExecutor(max_workers=workers, initializer=load_template) as pool:
+        for name, content in pool.map(_render_entry, enumerate(rows), chunksize=chunksize):
+            # Keep every report when two rows share a patient ID
+            base, extension = os.path.splitext(name)
+            suffix = 1
+            while name in names:
+                suffix += 1
+                name = f"{base}_{suffix}{extension}"
+            names.add(name)
+            archive.writestr(name, content)
+    return len(rows)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render patient reports for a results table into a ZIP.")
+    parser.add_argument('results', help="Results table (.csv or .json)")
+    parser.add_argument('-o', '--output', default='reports.zip', help="Output ZIP ('-' for stdout)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    table = pd.read_json(args.results) if args.results.endswith('.json') else pd.read_csv(args.results, dtype=str)
+    rows = table.where(table.notna(), None).to_dict('records')
+    output = sys.stdout.buffer if args.output == '-' else args.output
+
+    start = time.perf_counter()
+    count = write_reports_zip(rows, output, args.workers)
+    elapsed = time.perf_counter() - start
+    print(f"Rendered {count} reports in {elapsed:.2f} s ({count / elapsed * 60:.0f} per minute)", file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,221 @@
+import datetime
+import hashlib
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+# Local SQLite store of every analysis run, so results can be looked up by
+# patient, collection date, instrument timestamp or calibration version
+# without re-uploading the raw files.
+#
+# Runs are listed newest first, or by descending date when a date range is
+# filtered on, and paged by keyset (rows after the last row of the previous
+# page) rather than OFFSET, so the cost of a page does not grow with how far
+# back it is. Every filter has an index ending in id, and the combinations the
+# history view offers have one ending in (collection_date, id) or id, which
+# lets SQLite walk the index in page order and stop after one page. Planner
+# statistics are kept current (see _refresh_statistics) so a selective filter
+# such as the patient ID wins over a broad one such as the result.
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'results.sqlite')
+
+COLUMNS = ['id', 'created_at', 'patient_id', 'collection_date', 'instrument_timestamp', 'calibration_version',
+           'file_name', 'file_hash', 'technique', 'current', 'concentration', 'result']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    patient_id TEXT NOT NULL DEFAULT '',
+    collection_date TEXT,
+    instrument_timestamp TEXT,
+    calibration_version TEXT NOT NULL,
+    file_name TEXT,
+    file_hash TEXT NOT NULL,
+    technique TEXT,
+    current REAL,
+    concentration REAL,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_patient ON runs (patient_id, id);
+CREATE INDEX IF NOT EXISTS runs_collection_date ON runs (collection_date, id);
+CREATE INDEX IF NOT EXISTS runs_instrument_timestamp ON runs (instrument_timestamp, id);
+CREATE INDEX IF NOT EXISTS runs_calibration ON runs (calibration_version, id);
+CREATE INDEX IF NOT EXISTS runs_result ON runs (result, id);
+CREATE INDEX IF NOT EXISTS runs_file_hash ON runs (file_hash);
+CREATE INDEX IF NOT EXISTS runs_calibration_result ON runs (calibration_version, result, id);
+CREATE INDEX IF NOT EXISTS runs_result_collection_date ON runs (result, collection_date, id);
+CREATE INDEX IF NOT EXISTS runs_calibration_collection_date ON runs (calibration_version, collection_date, id);
+CREATE INDEX IF NOT EXISTS runs_calibration_result_collection_date
+    ON runs (calibration_version, result, collection_date, id);
+"""
+
+# Below this many runs the planner's choice of index makes no difference
+STATISTICS_MIN_ROWS = 1000
+# Statistics are gathered again once the table has grown this many times over
+STATISTICS_GROWTH = 10
+# Rows ANALYZE samples per index, which keeps it to milliseconds on a large store
+ANALYSIS_LIMIT = 1000
+
+# Filters accepted by query_runs and count_runs: exact matches, and ranges
+# given as (first, last) with either end None
+EXACT_FILTERS = ('patient_id', 'calibration_version', 'result', 'file_hash')
+RANGE_FILTERS = ('collection_date', 'instrument_timestamp')
+
+# A transaction belongs to its connection, so a connection must only be used
+# by one thread: another thread's commit or rollback would end its half-done
+# transaction. Threads that share a store each open their own (see
+# thread_connection); WAL lets them read while one of them writes.
+def connect(path=DEFAULT_PATH):
+    if path != ':memory:':
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(SCHEMA)
+    _refresh_statistics(connection)
+    return connection
+
+# Gather the planner statistics (sqlite_stat1) when there are none yet or the
+# runs table has grown STATISTICS_GROWTH times since they were gathered.
+# Without them SQLite cannot tell a patient ID, matching a handful of runs,
+# from a result matching half the table.
+def _refresh_statistics(connection):
+    rows = connection.execute('SELECT MAX(id) FROM runs').fetchone()[0] or 0
+    if rows < STATISTICS_MIN_ROWS:
+        return
+    analyzed = 0
+    if connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+        stat = connection.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = 'runs' LIMIT 1").fetchone()
+        analyzed = int(stat[0].split()[0]) if stat else 0
+    if rows > STATISTICS_GROWTH * analyzed:
+        connection.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+        connection.execute('ANALYZE runs')
+        connection.commit()
+
+_thread_connections = threading.local()
+
+# The calling thread's connection to the store at path, opened on first use
+# and closed with the thread. setup, e.g. calibration_store.init_schema, is run
+# once on a new connection.
+def thread_connection(path=DEFAULT_PATH, setup=None):
+    connections = _thread_connections.__dict__
+    connection = connections.get((path, setup))
+    if connection is None:
+        connection = connections[(path, setup)] = connect(path)
+        if setup is not None:
+            setup(connection)
+    return connection
+
+def file_hash(raw):
+    return hashlib.sha256(raw).hexdigest()
+
+def _text(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, (datetime.date, pd.Timestamp)):
+        return value.isoformat()
+    return str(value)
+
+def _row(record):
+    return (_text(record.get('created_at')) or datetime.datetime.now().isoformat(timespec='seconds'),
+            record.get('patient_id') or '',
+            _text(record.get('collection_date')),
+            _text(record.get('instrument_timestamp')),
+            record['calibration_version'],
+            record.get('file_name'),
+            record['file_hash'],
+            record.get('technique'),
+            record.get('current'),
+            record.get('concentration'),
+            record.get('result'))
+
+_INSERT = f"INSERT INTO runs ({', '.join(COLUMNS[1:])}) VALUES ({', '.join('?' * (len(COLUMNS) - 1))})"
+
+# Store one run and return its id. record holds the COLUMNS except id;
+# calibration_version and file_hash are required.
+def save_run(connection, record):
+    with connection:
+        return insert_run(connection, record)
+
+# save_run without the commit, for callers that store the run in the same
+# transaction as other rows
+def insert_run(connection, record):
+    return connection.execute(_INSERT, _row(record)).lastrowid
+
+def save_runs(connection, records):
+    with connection:
+        connection.executemany(_INSERT, (_row(record) for record in records))
+
+# Attach patient details to a run stored before they were entered
+def update_patient(connection, run_id, patient_id, collection_date=None):
+    with connection:
+        connection.execute('UPDATE runs SET patient_id = ?, collection_date = ? WHERE id = ?',
+                           (patient_id or '', _text(collection_date), run_id))
+
+def _where(filters):
+    clauses, parameters = [], []
+    for key, value in filters.items():
+        if value is None or value == '':
+            continue
+        if key in EXACT_FILTERS:
+            clauses.append(f'{key} = ?')
+            parameters.append(value)
+        elif key in RANGE_FILTERS:
+            first, last = value
+            if first is not None:
+                clauses.append(f'{key} >= ?')
+                parameters.append(_text(first))
+            if last is not None:
+                # Timestamps of the last day compare greater than the bare date
+                if key == 'instrument_timestamp' and isinstance(last, datetime.date):
+                    last = datetime.datetime.combine(last, datetime.time.max).isoformat(sep=' ')
+                clauses.append(f'{key} <= ?')
+                parameters.append(_text(last))
+        else:
+            raise ValueError(f"unknown filter: {key}")
+    return clauses, parameters
+
+# A date range filter sorts the page by that date so its index gives the order
+def _sort_column(filters):
+    return next((key for key in RANGE_FILTERS if filters.get(key) is not None), None)
+
+# One page of runs as a DataFrame and the cursor of the next (older) page,
+# None after the last page. Pass the cursor back as after to get that page.
+def query_runs(connection, limit=50, after=None, **filters):
+    clauses, parameters = _where(filters)
+    column = _sort_column(filters)
+    if column is None:
+        order = 'id DESC'
+        if after is not None:
+            clauses.append('id < ?')
+            parameters += after
+    else:
+        order = f'{column} DESC, id DESC'
+        if after is not None:
+            clauses.append(f'({column}, id) < (?, ?)')
+            parameters += after
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    sql = f"SELECT {', '.join(COLUMNS)} FROM runs {where} ORDER BY {order} LIMIT ?"
+    rows = connection.execute(sql, parameters + [limit]).fetchall()
+
+    cursor = None
+    if len(rows) == limit:
+        last = dict(zip(COLUMNS, rows[-1]))
+        cursor = [last['id']] if column is None else [last[column], last['id']]
+    return pd.DataFrame(rows, columns=COLUMNS), cursor
+
+# Number of matching runs. Counting a large match means reading its whole
+# index range, so callers that only show it can stop at limit.
+def count_runs(connection, limit=None, **filters):
+    clauses, parameters = _where(filters)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    if limit is None:
+        return connection.execute(f'SELECT COUNT(*) FROM runs {where}', parameters).fetchone()[0]
+    sql = f'SELECT COUNT(*) FROM (SELECT 1 FROM runs {where} LIMIT ?)'
+    return connection.execute(sql, parameters + [limit]).fetchone()[0]
+
+def calibration_versions(connection):
+    return [row[0] for row in connection.execute('SELECT DISTINCT calibration_version FROM runs ORDER BY 1')]
@@ -0,0 +1,182 @@
+import argparse
+import sys
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from analysis import determine_result
+from calibration_store import store_calibration
+from instrument_reader import read_instrument_file, current_columns
+from results_store import DEFAULT_PATH
+
+# Streaming chronoamperometry analysis: samples are fed in chunks while the
+# potentiostat is still recording and a steady-state event with a provisional
+# result is emitted as soon as the current has settled, so the assay can be
+# stopped early.
+#
+#   python streaming_analyzer.py Results/E*_Amp0.4_*.csv --speed 20
+
+@dataclass(frozen=True)
+class SteadyStateEvent:
+    time: float
+    sample: int
+    current: float
+    noise: float
+    snr: float
+    drift: float
+    concentration: float
+    result: str
+
+# Incremental steady-state detection over a sliding window of window_size
+# samples. The state is the last 2 * window_size samples plus a few counters,
+# so memory is bounded and each sample costs O(1) however long the run is.
+#
+# The current is considered steady once, for hold_samples consecutive samples,
+#   drift = |mean(window) - mean(previous window)| / |mean(window)| <= max_drift
+#   noise = std(window) / |mean(window)| <= max_noise
+# and at least min_time seconds have been recorded.
+class SteadyStateDetector:
+    def __init__(self, calibration, window_size=50, max_drift=0.005, max_noise=0.005, min_time=30.0,
+                 hold_samples=None, skip_samples=3, on_steady_state=None):
+        self.calibration = calibration
+        self.window_size = window_size
+        self.max_drift = max_drift
+        self.max_noise = max_noise
+        self.min_time = min_time
+        self.hold_samples = window_size if hold_samples is None else hold_samples
+        self.skip_samples = skip_samples
+        self.on_steady_state = on_steady_state
+        self.event = None
+        self.samples_seen = 0
+        self._tail = np.empty(0)
+        self._run = 0
+
+    # Window statistics at every sample of the chunk, using cumulative sums over
+    # the retained tail plus the new samples
+    def _window_stats(self, values):
+        w = self.window_size
+        # Offset by a reference value to keep the sums of squares well conditioned
+        shifted = values - values[0]
+        cumsum = np.concatenate(([0.0], np.cumsum(shifted)))
+        cumsq = np.concatenate(([0.0], np.cumsum(shifted * shifted)))
+        window_sum = cumsum[w:] - cumsum[:-w]
+        window_sq = cumsq[w:] - cumsq[:-w]
+        mean = window_sum / w
+        variance = np.maximum(window_sq - window_sum * mean, 0.0) / (w - 1)
+        return mean + values[0], np.sqrt(variance)
+
+    # Feed a chunk of (time, current) samples. Returns the SteadyStateEvent the
+    # first time the criteria are met, None otherwise.
+    def feed(self, times, currents):
+        times = np.asarray(times, dtype=np.float64)
+        currents = np.asarray(currents, dtype=np.float64)
+        start = self.samples_seen
+        self.samples_seen += len(currents)
+        skip = max(self.skip_samples - start, 0)
+        times, currents = times[skip:], currents[skip:]
+        if self.event is not None or not len(currents):
+            return None
+
+        w = self.window_size
+        values = np.concatenate((self._tail, currents))
+        offset = len(self._tail)
+        self._tail = values[-2 * w:]
+        if len(values) < 2 * w:
+            return None
+
+        mean, std = self._window_stats(values)
+        # mean[k] is the window ending at values[k + w - 1]; compare it with the
+        # window ending w samples earlier
+        current_mean = mean[w:]
+        drift = np.abs(current_mean - mean[:-w]) / np.abs(current_mean)
+        noise = std[w:] / np.abs(current_mean)
+        # Index of each criterion row within the new samples
+        positions = np.arange(2 * w - 1, len(values)) - offset
+        keep = positions >= 0
+        positions, drift, noise, current_mean, window_std = (
+            positions[keep], drift[keep], noise[keep], current_mean[keep], std[w:][keep])
+
+        settled = (drift <= self.max_drift) & (noise <= self.max_noise) & (times[positions] >= self.min_time)
+        # Length of the run of settled samples ending at each position,
+        # continuing the run carried over from the previous chunk
+        index = np.arange(len(settled))
+        last_unsettled = np.maximum.accumulate(np.where(settled, -1, index))
+        run = index - last_unsettled
+        run[last_unsettled < 0] += self._run
+        self._run = int(run[-1]) if len(run) else self._run
+        reached = np.flatnonzero(run >= self.hold_samples)
+        if not len(reached):
+            return None
+
+        k = reached[0]
+        current = float(current_mean[k])
+        concentration = float(self.calibration.concentration_at(current))
+        self.event = SteadyStateEvent(
+            time=float(times[positions[k]]),
+            sample=start + skip + int(positions[k]),
+            current=current,
+            noise=float(window_std[k]),
+            snr=float(current / window_std[k]) if window_std[k] > 0 else np.inf,
+            drift=float(drift[k]),
+            concentration=concentration,
+            result=determine_result(self.calibration.concentration_at, current, self.calibration.lod),
+        )
+        if self.on_steady_state is not None:
+            self.on_steady_state(self.event)
+        return self.event
+
+# Replay an export at simulated real-time speed (speed=0 replays as fast as
+# possible). Samples are delivered in chunks of chunk_seconds of instrument
+# time. Returns the detector, whose event is None if steady state was never
+# reached.
+def replay(file_path, calibration, speed=1.0, chunk_seconds=1.0, stop_early=True, sleep=time.sleep, **options):
+    metadata, values = read_instrument_file(file_path)
+    times = values[:, 0]
+    currents = values[:, current_columns(metadata)[0]]
+    detector = SteadyStateDetector(calibration, **options)
+
+    boundaries = np.searchsorted(times, np.arange(times[0] + chunk_seconds, times[-1] + chunk_seconds, chunk_seconds),
+                                 side='right')
+    start = 0
+    for stop in boundaries:
+        if stop <= start:
+            continue
+        if speed > 0:
+            sleep((times[stop - 1] - times[start - 1 if start else 0]) / speed)
+        event = detector.feed(times[start:stop], currents[start:stop])
+        start = stop
+        if event is not None and stop_early:
+            break
+    return detector
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay chronoamperometry exports through the streaming analyzer.")
+    parser.add_argument('files', nargs='+', help="CA exports to replay")
+    parser.add_argument('--calibration', default='data/Calibration_curve.csv',
+                        help="Calibration curve CSV, added to the store as a new version when it changes")
+    parser.add_argument('--db', default=DEFAULT_PATH, help="SQLite store holding the calibration versions")
+    parser.add_argument('--calibration-version', help="Classify with this stored version (default: the latest)")
+    parser.add_argument('--speed', type=float, default=1.0, help="Replay speed factor (0 = as fast as possible)")
+    parser.add_argument('--chunk-seconds', type=float, default=1.0, help="Instrument time per chunk")
+    parser.add_argument('--window', type=int, default=50, help="Window size in samples")
+    parser.add_argument('--max-drift', type=float, default=0.005, help="Largest relative drift between windows")
+    parser.add_argument('--max-noise', type=float, default=0.005, help="Largest relative noise (1/SNR)")
+    parser.add_argument('--min-time', type=float, default=30.0, help="Earliest time steady state can be declared (s)")
+    args = parser.parse_args(argv)
+
+    calibration = store_calibration(args.calibration, args.db, args.calibration_version)
+    for file_path in args.files:
+        detector = replay(file_path, calibration, speed=args.speed, chunk_seconds=args.chunk_seconds,
+                          window_size=args.window, max_drift=args.max_drift, max_noise=args.max_noise,
+                          min_time=args.min_time)
+        event = detector.event
+        if event is None:
+            print(f"{file_path}: no steady state within the recording")
+        else:
+            print(f"{file_path}: steady state at {event.time:.1f} s, {event.current:.4f} µA "
+                  f"(SNR {event.snr:.0f}, drift {event.drift:.2e}) -> {event.concentration:.2f} nM, {event.result}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
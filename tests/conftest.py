@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules live at the top of the repository and the synthetic export
+# generators in benchmarks/, neither of which is an installed package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
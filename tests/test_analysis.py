@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from analysis import build_calibration_model, classify_currents, NEGATIVE, POSITIVE, INDETERMINATE
+
+# Blanks at 1.0 µA and 0.1 µA/nM above them, with a little noise so the fit
+# has a residual σ and the LOD a blank σ
+CONCENTRATION = pd.Series([0.0, 0.0, 0.0, 0.0, 5.0, 10.0, 20.0, 40.0, 80.0])
+NOISE = np.array([0.0, 0.02, -0.01, 0.015, -0.02, 0.01, 0.02, -0.015, 0.005])
+MODEL = build_calibration_model(CONCENTRATION, 1.0 + 0.1 * CONCENTRATION + NOISE)
+
+def current_at(concentration):
+    return MODEL.intercept + MODEL.slope * concentration
+
+def classify(currents):
+    return classify_currents(MODEL, currents)[2].tolist()
+
+def test_clear_results():
+    assert classify([current_at(10 * MODEL.lod), current_at(-5 * MODEL.lod)]) == [POSITIVE, NEGATIVE]
+
+def test_interval_straddling_the_lod_is_indeterminate():
+    _, half_width, codes = classify_currents(MODEL, [current_at(MODEL.lod)])
+    assert half_width[0] > 0
+    assert codes.tolist() == [INDETERMINATE]
+
+# Just outside the interval on either side
+def test_interval_edges():
+    _, half_width, _ = classify_currents(MODEL, [current_at(MODEL.lod)])
+    margin = 1.5 * half_width[0]
+    assert classify([current_at(MODEL.lod + margin), current_at(MODEL.lod - margin)]) == [POSITIVE, NEGATIVE]
+
+# A missing current must not pass for a Negative
+@pytest.mark.parametrize('current', [np.nan, np.inf, -np.inf])
+def test_non_finite_current_is_indeterminate(current):
+    assert classify([current, current_at(10 * MODEL.lod)]) == [INDETERMINATE, POSITIVE]
+
+def test_scalar_and_array_input_agree():
+    current = current_at(10 * MODEL.lod)
+    scalar = classify_currents(MODEL, current)
+    array = classify_currents(MODEL, np.array([current]))
+    for a, b in zip(scalar, array):
+        assert a.shape == (1,)
+        np.testing.assert_array_equal(a, b)
+    assert classify_currents(MODEL, [])[2].shape == (0,)
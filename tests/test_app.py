@@ -0,0 +1,53 @@
+import functools
+import os
+import threading
+
+import streamlit as st
+
+import GeneDetek_app as app
+import instrumentation
+from analysis import load_calibration_model
+from calibration_store import add_points, latest_version, list_versions
+from parse_cache import ParsedFileCache
+from results_store import thread_connection
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Streamlit runs a form's on_click callback on the thread of the rerun the
+# submit causes, not necessarily the one that drew the form
+def test_calibration_point_callback_on_another_thread(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'thread_connection', functools.partial(thread_connection, str(tmp_path / 'store.sqlite')))
+    state = {'calibration_concentration': 20.0, 'calibration_current': 4.1, 'calibration_note': 'lot 7'}
+    monkeypatch.setattr(st, 'session_state', state)
+    store = app.results_store()
+    add_points(store, [(0.0, 1.7), (5.0, 2.4), (10.0, 3.2)])
+
+    errors = []
+    def submit():
+        try:
+            app._add_calibration_point()
+        except Exception as e:
+            errors.append(e)
+    thread = threading.Thread(target=submit)
+    thread.start()
+    thread.join()
+
+    assert errors == []
+    assert latest_version(store) == 2
+    assert state['calibration_message'] == "Added calibration version v2"
+    assert list_versions(store)['note'].iloc[0] == 'lot 7'
+
+# The debug sidebar lists every timed stage; parsing is the main cost of an
+# upload and must be among them, on a cache miss and on a hit
+def test_upload_parsing_is_timed(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'parse_cache', lambda cache=ParsedFileCache(str(tmp_path)): cache)
+    calibration = load_calibration_model(os.path.join(ROOT, 'data', 'Calibration_curve.csv'))
+    with open(os.path.join(ROOT, 'Results', 'E1_Amp0.4_5nM.csv'), 'rb') as f:
+        raw = f.read()
+    instrumentation.reset()
+    for _ in range(2):
+        assert app.analyze_upload('E1.csv', raw, calibration)['error'] is None
+    calls = {row['stage']: row['calls'] for row in instrumentation.snapshot()}
+    assert calls['parse_cache_read'] == 2
+    assert calls['read_instrument_file'] == 1
+    assert calls['classify_currents'] == 2
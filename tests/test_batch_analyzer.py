@@ -0,0 +1,55 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from analysis import load_calibration_model, measure_current
+from batch_analyzer import init_worker, analyze_file, write_results, RESULT_FIELDS
+from instrument_reader import read_instrument_file
+from synthetic import PREAMBLE, write_ca_file
+from watch_folder import ResultWriter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _reject(constant):
+    raise ValueError(f"{constant} is not valid JSON")
+
+def row(**values):
+    return {**dict.fromkeys(RESULT_FIELDS), 'file': 'a.csv', **values}
+
+ROWS = [row(current=float('nan'), snr=float('inf'), concentration=-float('inf')), row(current=1.5)]
+
+# NaN and infinity are written as null, which strict JSON parsers accept
+def test_json_results_are_strict_json(tmp_path):
+    path = str(tmp_path / 'results.json')
+    write_results(ROWS, path)
+    with open(path) as f:
+        rows = json.load(f, parse_constant=_reject)
+    assert rows[0]['current'] is None and rows[0]['snr'] is None and rows[0]['concentration'] is None
+    assert rows[1]['current'] == 1.5
+
+def test_json_lines_are_strict_json(tmp_path):
+    path = str(tmp_path / 'results.jsonl')
+    ResultWriter(path).write(ROWS)
+    with open(path) as f:
+        rows = [json.loads(line, parse_constant=_reject) for line in f]
+    assert rows[0]['current'] is None and rows[1]['current'] == 1.5
+
+# Without a current column the current used to be NaN, which compared below
+# the LOD and came out Negative without an error
+def test_export_without_units_line_is_an_error():
+    preamble = PREAMBLE.format(method='Chronoamperometry: i vs t', units='').removesuffix('\r\n')
+    raw = (preamble + ''.join(f'{i}.00000E-001,1.00000E+000\r\n' for i in range(10))).encode('utf-16')
+    init_worker(load_calibration_model(os.path.join(ROOT, 'data', 'Calibration_curve.csv')))
+    row = analyze_file(raw, 'no_units.csv')
+    assert row['result'] is None
+    assert row['error'] == 'ValueError: no current column in export'
+
+def test_trace_without_finite_current_is_an_error(tmp_path):
+    path = tmp_path / 'ca.csv'
+    write_ca_file(path, 20)
+    metadata, values = read_instrument_file(str(path))
+    values[:, 1] = np.nan
+    with pytest.raises(ValueError, match='no finite current'):
+        measure_current(metadata, values)
@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analysis import RunningCalibration, build_calibration_model, read_calibration_curve, linear_fit
+from calibration_store import init_schema, add_points, calibration_model
+from results_store import connect
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIELDS = ['slope', 'intercept', 'r_value', 'std_err', 'lod', 'std_response', 'n_points', 'mean_concentration',
+          'mean_current', 'sxx', 'residual_std']
+
+def assert_same_model(concentration, current_response, rtol=1e-13):
+    batch = build_calibration_model(concentration, current_response)
+    running = RunningCalibration().add_points(concentration, current_response).model()
+    for field in FIELDS:
+        assert getattr(running, field) == pytest.approx(getattr(batch, field), rel=rtol, abs=1e-14), field
+
+def test_running_fit_matches_batch_fit_on_the_calibration_curve():
+    assert_same_model(*read_calibration_curve(os.path.join(ROOT, 'data', 'Calibration_curve.csv')))
+
+# A large offset under small noise is where one-pass sums of squares would
+# lose digits; Welford's updates stay within about 1e-11 of the batch fit
+@pytest.mark.parametrize('seed', range(5))
+def test_running_fit_matches_batch_fit_on_random_points(seed):
+    rng = np.random.default_rng(seed)
+    n_blanks = rng.integers(2, 6)
+    concentration = np.concatenate([np.zeros(n_blanks), rng.uniform(1, 50, 40)])
+    current_response = 1e3 + 0.15 * concentration + rng.normal(0, 0.05, len(concentration))
+    # As read_calibration_curve returns them
+    assert_same_model(pd.Series(concentration), pd.Series(current_response), rtol=1e-10)
+
+# Points added as two versions of a store fit, once the statistics have gone
+# through SQLite and back, like all the points fitted at once
+def test_store_versions_match_a_fit_of_all_points():
+    rng = np.random.default_rng(7)
+    concentration = np.concatenate([[0.0, 0.0, 0.0], rng.uniform(1, 50, 20)])
+    current_response = 1.5 + 0.15 * concentration + rng.normal(0, 0.05, len(concentration))
+    connection = init_schema(connect(':memory:'))
+    add_points(connection, zip(concentration[:10], current_response[:10]))
+    add_points(connection, zip(concentration[10:], current_response[10:]))
+
+    model = calibration_model(connection)
+    assert model.version == 'v2'
+    assert model.concentration == tuple(concentration) and model.current_response == tuple(current_response)
+    # The first point is left out of the regression, as in create_calibration_function
+    slope, intercept, r_value, std_err = linear_fit(concentration[1:], current_response[1:])
+    assert model.slope == pytest.approx(slope, rel=1e-12)
+    assert model.intercept == pytest.approx(intercept, rel=1e-12)
+    assert model.r_value == pytest.approx(r_value, rel=1e-12)
+    assert model.std_err == pytest.approx(std_err, rel=1e-10)
+    assert model.std_response == pytest.approx(np.std(current_response[:3]), rel=1e-12)
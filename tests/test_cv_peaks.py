@@ -0,0 +1,25 @@
+import numpy as np
+
+from cv_peaks import analyze_cv, sweep_direction
+from synthetic import cv_traces
+
+# A flat step at the vertex keeps the direction before it
+def test_sweep_direction_splits_at_the_vertex():
+    potentials = np.array([[0.0, 0.1, 0.2, 0.2, 0.1, 0.0], [0.3, 0.2, 0.1, 0.2, 0.3, 0.4]])
+    assert sweep_direction(potentials).tolist() == [[True, True, True, False, False, False],
+                                                    [False, False, True, True, True, True]]
+
+def test_peak_without_capacitive_offset():
+    potentials, currents = cv_traces(4000, n_scans=5)
+    per_scan, summary = analyze_cv(potentials, currents)
+    assert len(per_scan) == 5
+    assert abs(summary['peak_current'] - 2.0) < 0.02
+    assert abs(summary['peak_potential'] - 0.2) < 0.01
+
+# The forward branch sits capacitive µA above the reverse one; a baseline
+# through both would leave that much charging current in the peak
+def test_capacitive_offset_between_branches_is_removed():
+    _, reference = analyze_cv(*cv_traces(4000, n_scans=5))
+    _, summary = analyze_cv(*cv_traces(4000, n_scans=5, capacitive=0.3))
+    assert abs(summary['peak_current'] - reference['peak_current']) < 1e-9
+    assert abs(summary['peak_current'] - 2.0) < 0.02
@@ -0,0 +1,113 @@
+import glob
+import os
+
+import numpy as np
+import pytest
+
+import instrument_reader
+from instrument_reader import read_instrument_file, read_metadata, current_columns
+from synthetic import PREAMBLE, write_ca_file, write_cv_file
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS = sorted(glob.glob(os.path.join(ROOT, 'Results', '*.csv')))
+
+# Straightforward parse to compare against: decode the text, skip the
+# preamble and convert every cell with float(), empty cells as NaN
+def reference_parse(raw):
+    lines = raw.decode('utf-16').splitlines()
+    n_columns = None
+    rows = []
+    for line in lines[read_metadata(raw)['header_rows']:]:
+        line = line.strip().strip('﻿')
+        if not line:
+            continue
+        fields = line.split(',')
+        n_columns = n_columns or len(fields)
+        rows.append([float(field) if field.strip() else np.nan for field in fields]
+                    + [np.nan] * (n_columns - len(fields)))
+    return np.array(rows, dtype=np.float64)
+
+def export(rows, units, method='Cyclic Voltammetry: i vs E'):
+    text = PREAMBLE.format(method=method, units=units) + ''.join(row + '\r\n' for row in rows) + '﻿'
+    return text.encode('utf-16')
+
+def assert_same_values(raw):
+    _, values = read_instrument_file(raw)
+    expected = reference_parse(raw)
+    assert values.dtype == np.float64
+    np.testing.assert_array_equal(values, expected)
+
+@pytest.mark.parametrize('path', RESULTS, ids=os.path.basename)
+def test_results_exports_match_reference(path):
+    with open(path, 'rb') as f:
+        raw = f.read()
+    assert_same_values(raw)
+    metadata, values = read_instrument_file(raw)
+    assert metadata['technique'] == 'CA'
+    assert metadata['units'] == ['s', 'µA']
+
+def test_column_selection_matches_full_parse():
+    with open(RESULTS[0], 'rb') as f:
+        raw = f.read()
+    metadata, values = read_instrument_file(raw, columns=current_columns)
+    _, full = read_instrument_file(raw)
+    assert metadata['columns'] == [1]
+    np.testing.assert_array_equal(values, full[:, [1]])
+
+def test_negative_values(tmp_path):
+    path = tmp_path / 'cv.csv'
+    write_cv_file(path, 5000, n_scans=3, low=-0.8, high=-0.1, peak_current=-2.0)
+    raw = path.read_bytes()
+    assert (reference_parse(raw) < 0).any()
+    assert_same_values(raw)
+
+# Eight decimals need more than 32 bits for the sum of the character codes;
+# the uint32 accumulator relies on wrapping around and back
+@pytest.mark.parametrize('decimals', [1, 5, 8, 9, 15])
+def test_mantissa_widths(decimals):
+    rng = np.random.default_rng(decimals)
+    values = rng.uniform(-10, 10, (200, 2)) * 10.0 ** rng.integers(-12, 12, (200, 2))
+    rows = [','.join(f'{value:.{decimals}E}' for value in row) for row in values]
+    # Python writes two exponent digits; PSTrace writes three
+    assert_same_values(export(rows, 's,µA'))
+    assert_same_values(export([row.replace('E+', 'E+0').replace('E-', 'E-0') for row in rows], 's,µA'))
+
+def test_largest_and_smallest_digits():
+    rows = ['9.99999E+022,-9.99999E-022', '0.00000E+000,1.00000E-022', '-0.00000E+000,9.99999E+000']
+    assert_same_values(export(rows, 's,µA'))
+
+# Scans of unequal length leave the cells of the shorter scan empty
+def test_blank_cells():
+    rows = ['1.00000E-001,2.00000E+000,1.00000E-001,3.00000E+000',
+            '2.00000E-001,2.50000E+000,,',
+            '3.00000E-001,2.75000E+000,,']
+    raw = export(rows, 'V,µA,V,µA')
+    _, values = read_instrument_file(raw)
+    assert values.shape == (3, 4)
+    assert np.isnan(values[1:, 2:]).all()
+    assert_same_values(raw)
+
+def test_other_ascii_layouts():
+    rows = ['0.1,2.5', '0.2,-2.25', '0.3,1e-3']
+    assert_same_values(export(rows, 's,µA'))
+
+@pytest.mark.parametrize('chunk_chars', [64, 1000, 4099])
+def test_multi_chunk_blocks(tmp_path, monkeypatch, chunk_chars):
+    monkeypatch.setattr(instrument_reader, 'CHUNK_CHARS', chunk_chars)
+    path = tmp_path / 'ca.csv'
+    write_ca_file(path, 3000)
+    assert_same_values(path.read_bytes())
+    rows = ['1.00000E-001,2.00000E+000,1.00000E-001,3.00000E+000'] * 500 + ['2.00000E-001,2.50000E+000,,'] * 500
+    assert_same_values(export(rows, 'V,µA,V,µA'))
+
+def test_file_without_numbers():
+    with pytest.raises(ValueError, match='no numeric data block'):
+        read_instrument_file(export([], 's,µA'))
+
+def test_export_without_units_line_has_no_current_column():
+    preamble = PREAMBLE.format(method='Chronoamperometry: i vs t', units='').removesuffix('\r\n')
+    raw = (preamble + '0.00000E+000,1.00000E+000\r\n').encode('utf-16')
+    metadata, values = read_instrument_file(raw)
+    assert values.shape == (1, 2)
+    with pytest.raises(ValueError, match='no current column'):
+        current_columns(metadata)
@@ -0,0 +1,96 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analysis import (load_calibration_model, build_calibration_model, determine_steady_state_current,
+                      determine_peak_current, determine_result, classify_currents, RESULT_LABELS, CA_SKIP_SAMPLES)
+from multichannel import read_channels, analyze_channels, steady_state_currents, peak_currents
+from parse_cache import ParsedFileCache
+from synthetic import write_multichannel_ca_file
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CALIBRATION = load_calibration_model(os.path.join(ROOT, 'data', 'Calibration_curve.csv'))
+N_CHANNELS = 8
+
+# Steady states from 0.2 to 3.7 µA, across the LOD of the repository curve
+@pytest.fixture(params=[False, True], ids=['pair_per_channel', 'shared_time'])
+def array_file(request, tmp_path):
+    path = str(tmp_path / 'array.csv')
+    write_multichannel_ca_file(path, 400, N_CHANNELS, step=0.5, shared_time=request.param)
+    return path
+
+def single_channel(currents, channel):
+    return determine_steady_state_current(pd.Series(currents[channel, CA_SKIP_SAMPLES:]).dropna().reset_index(drop=True))
+
+def test_read_channels(array_file):
+    metadata, time, currents = read_channels(array_file)
+    assert currents.shape == (N_CHANNELS, 400)
+    assert metadata['channel_units'] == ['µA'] * N_CHANNELS
+    # Parsed back from the text, so equal up to rounding
+    np.testing.assert_allclose(time, np.arange(400) * 0.1, rtol=1e-12)
+
+def test_read_channels_through_the_cache(array_file, tmp_path):
+    _, time, currents = read_channels(array_file)
+    cache = ParsedFileCache(str(tmp_path / 'cache'))
+    for _ in range(2):
+        _, cached_time, cached_currents = read_channels(array_file, cache)
+        np.testing.assert_array_equal(cached_currents, currents)
+        np.testing.assert_array_equal(cached_time, time)
+
+# Every channel gets what the single-channel functions give for its trace
+def test_channels_match_the_single_channel_analysis(array_file):
+    metadata, _, currents = read_channels(array_file)
+    table = analyze_channels(metadata, currents, CALIBRATION)
+    assert table['channel'].tolist() == list(range(1, N_CHANNELS + 1))
+    for channel, row in table.iterrows():
+        current, snr = single_channel(currents, channel)
+        assert row['current'] == pytest.approx(current, rel=1e-12)
+        assert row['snr'] == pytest.approx(snr, rel=1e-9)
+        concentration, half_width, codes = classify_currents(CALIBRATION, current)
+        assert row['concentration'] == pytest.approx(concentration[0], rel=1e-12)
+        assert row['ci_half_width'] == pytest.approx(half_width[0], rel=1e-12)
+        assert row['call'] == RESULT_LABELS[codes[0]]
+        assert row['result'] == determine_result(CALIBRATION.concentration_at, current, CALIBRATION.lod)
+    assert set(table['result']) == {'Positive', 'Negative'}
+
+# Rows with gaps near the end go through determine_steady_state_current on the
+# samples that are there
+def test_steady_state_with_missing_samples():
+    currents = 1.0 + np.random.default_rng(0).normal(0, 0.01, (4, 200))
+    currents[1, -4] = np.nan
+    currents[2, 50:] = np.nan
+    currents[3, :] = np.nan
+    steady_state, snr = steady_state_currents(currents)
+    for channel in range(3):
+        expected = single_channel(currents, channel)
+        assert steady_state[channel] == pytest.approx(expected[0], rel=1e-12)
+        assert snr[channel] == pytest.approx(expected[1], rel=1e-9)
+    assert np.isnan(steady_state[3]) and np.isnan(snr[3])
+
+def test_peaks_match_the_single_channel_analysis():
+    rng = np.random.default_rng(1)
+    currents = rng.normal(0, 1, (5, 300))
+    currents[1, 10:20] = np.nan
+    currents[2, :] = np.nan
+    peaks = peak_currents(currents)
+    for channel in (0, 1, 3, 4):
+        assert peaks[channel] == determine_peak_current(pd.DataFrame(currents[channel]))
+    assert np.isnan(peaks[2])
+
+    table = analyze_channels({'technique': 'CV'}, currents, CALIBRATION)
+    assert table['result'][2] is None and table['call'][2] is None
+    assert table['result'].drop(2).notna().all()
+
+def test_channel_calibrations(array_file):
+    metadata, _, currents = read_channels(array_file)
+    other = build_calibration_model(pd.Series([0.0, 0.0, 0.0, 10.0, 20.0]), pd.Series([0.1, 0.12, 0.11, 1.1, 2.1]))
+    table = analyze_channels(metadata, currents, CALIBRATION, {2: other, 5: other})
+    default, reference = (analyze_channels(metadata, currents, model) for model in (CALIBRATION, other))
+    for channel, row in table.iterrows():
+        expected = reference if channel + 1 in (2, 5) else default
+        assert row['concentration'] == expected['concentration'][channel]
+        assert row['calibration'] == expected['calibration'][channel]
+    with pytest.raises(ValueError, match='calibration given for channel 9'):
+        analyze_channels(metadata, currents, CALIBRATION, {N_CHANNELS + 1: other})
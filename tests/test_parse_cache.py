@@ -0,0 +1,126 @@
+import hashlib
+import multiprocessing
+import os
+
+import numpy as np
+import pytest
+
+import parse_cache
+from parse_cache import ParsedFileCache
+from synthetic import write_ca_file
+
+# Size on disk of an entry of ROWS x 2 values, .npy and .json together
+ROWS = 1000
+
+def digest(i):
+    return hashlib.sha256(str(i).encode()).hexdigest()
+
+def put(cache, i):
+    cache.put(digest(i), {'entry': i}, np.full((ROWS, 2), float(i)))
+
+def entry_size(directory):
+    cache = ParsedFileCache(str(directory / 'probe'))
+    put(cache, 0)
+    return cache.size
+
+def on_disk(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory)
+               for name in names if name.endswith(('.npy', '.json')))
+
+# Entries on disk, checked without reading them, which would change the order
+def cached(cache):
+    return [i for i in range(20) if os.path.exists(os.path.join(cache.directory, digest(i)[:2], digest(i) + '.npy'))]
+
+def test_hit_is_memory_mapped_and_not_parsed_again(tmp_path, monkeypatch):
+    write_ca_file(tmp_path / 'a.csv', 500)
+    raw = (tmp_path / 'a.csv').read_bytes()
+    cache = ParsedFileCache(str(tmp_path / 'cache'))
+    metadata, values = cache.read(str(tmp_path / 'a.csv'))
+
+    def fail(source):
+        raise AssertionError("parsed again")
+    monkeypatch.setattr(parse_cache, 'read_instrument_file', fail)
+    # The same bytes under any name, as bytes or as a file
+    for source in (str(tmp_path / 'a.csv'), raw):
+        cached_metadata, cached_values = cache.read(source)
+        assert isinstance(cached_values, np.memmap) and not cached_values.flags.writeable
+        assert cached_metadata == metadata
+        np.testing.assert_array_equal(cached_values, values)
+    assert len(cache) == 1
+
+def test_least_recently_used_is_evicted(tmp_path):
+    size = entry_size(tmp_path)
+    cache = ParsedFileCache(str(tmp_path / 'cache'), max_bytes=3 * size)
+    for i in range(3):
+        put(cache, i)
+    # Reading 0 makes 1 the least recently used
+    assert cache.get(digest(0)) is not None
+    put(cache, 3)
+    assert cached(cache) == [0, 2, 3]
+    put(cache, 4)
+    assert cached(cache) == [0, 3, 4]
+    assert cache.size == on_disk(tmp_path / 'cache') == 3 * size
+
+# The order is kept in the files' mtimes, so a new process evicts the same
+# entry the old one would have
+def test_order_survives_a_restart(tmp_path):
+    size = entry_size(tmp_path)
+    cache = ParsedFileCache(str(tmp_path / 'cache'), max_bytes=3 * size)
+    for i in range(3):
+        put(cache, i)
+    for i, mtime in ((0, 3000), (1, 1000), (2, 2000)):
+        os.utime(os.path.join(cache.directory, digest(i)[:2], digest(i) + '.npy'), (mtime, mtime))
+    restarted = ParsedFileCache(cache.directory, max_bytes=3 * size)
+    put(restarted, 3)
+    assert cached(restarted) == [0, 2, 3]
+
+def test_missing_entry_is_a_miss(tmp_path):
+    assert ParsedFileCache(str(tmp_path)).get(digest(0)) is None
+
+# Another process's entries count toward the limit once this one rescans,
+# and entries another process removed first do not stop the eviction
+def test_limit_covers_other_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(parse_cache, 'RESCAN_SECONDS', 0.0)
+    size = entry_size(tmp_path)
+    first = ParsedFileCache(str(tmp_path / 'cache'), max_bytes=4 * size)
+    second = ParsedFileCache(str(tmp_path / 'cache'), max_bytes=4 * size)
+    for i in range(4):
+        put(first, i)
+    assert len(second) == 4
+    put(second, 4)
+    assert on_disk(tmp_path / 'cache') == 4 * size
+    assert 0 not in cached(first)
+
+    # first's index still lists entries second has already removed
+    for i in range(5, 9):
+        put(second, i)
+    put(first, 9)
+    assert on_disk(tmp_path / 'cache') <= 4 * size
+
+def _writer(directory, max_bytes, start):
+    cache = ParsedFileCache(directory, max_bytes)
+    for i in range(start, start + 40):
+        put(cache, i)
+
+# Several processes writing at once keep the directory near the limit, within
+# the bound given in parse_cache
+@pytest.mark.parametrize('processes', [2, 4])
+def test_limit_with_concurrent_processes(tmp_path, processes):
+    size = entry_size(tmp_path)
+    max_bytes = 16 * size
+    directory = str(tmp_path / 'cache')
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_writer, args=(directory, max_bytes, 100 * p)) for p in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+    # Entries written between rescans, at most max_bytes / RESCAN_FRACTION per
+    # process, plus the one that crosses that
+    slack = processes * (max_bytes / parse_cache.RESCAN_FRACTION + size)
+    assert on_disk(directory) <= max_bytes + slack
+    # A later process brings the directory back under the limit
+    cache = ParsedFileCache(directory, max_bytes)
+    put(cache, 10_000)
+    assert on_disk(directory) <= max_bytes
@@ -0,0 +1,42 @@
+import io
+
+import docx
+
+import report
+from report import render_report, POSITIVE_DETECTION
+
+def text(content):
+    return '\n'.join(paragraph.text for paragraph in docx.Document(io.BytesIO(content)).paragraphs)
+
+def result_cell(content):
+    return docx.Document(io.BytesIO(content)).tables[1].rows[1].cells[1].text
+
+def test_positive_report_keeps_the_template_wording():
+    content = text(render_report({'result': 'Positive'}))
+    assert 'Interpretation' in content and POSITIVE_DETECTION in content
+
+# Without a clinician template for the result nothing written for a Positive
+# result is left, and no other wording is made up in its place
+def test_other_results_drop_the_positive_wording(tmp_path, monkeypatch):
+    monkeypatch.setattr(report, 'TEMPLATE_DIR', str(tmp_path))
+    positive = text(render_report({'result': 'Positive'}))
+    for result in ['Negative', 'Indeterminate', None]:
+        rendered = render_report({'result': result})
+        content = text(rendered)
+        assert 'Interpretation' not in content and 'CYP2C19*2 mutation' not in content
+        assert POSITIVE_DETECTION not in content
+        *kept, detection = content.splitlines()
+        assert set(kept) <= set(positive.splitlines())
+        assert detection == positive.splitlines()[-1].replace(POSITIVE_DETECTION, '').lstrip()
+        assert result_cell(rendered) == (result or '')
+
+# A clinician template for the result is used as it is
+def test_result_template_is_used(tmp_path, monkeypatch):
+    document = docx.Document(report.TEMPLATE_PATH)
+    document.paragraphs[7].runs[0].text = 'Negative wording from the clinicians.'
+    document.save(tmp_path / 'Report_Negative.docx')
+    monkeypatch.setattr(report, 'TEMPLATE_DIR', str(tmp_path))
+    content = text(render_report({'result': 'Negative'}))
+    assert 'Negative wording from the clinicians.' in content
+    assert 'Interpretation' in content
+    assert 'Interpretation' not in text(render_report({'result': 'Indeterminate'}))
@@ -0,0 +1,101 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import results_store
+from results_store import connect, save_runs, query_runs, count_runs, COLUMNS
+
+def make_runs(n, seed=0):
+    rng = np.random.default_rng(seed)
+    # Few distinct dates, so many runs tie on the sort column
+    dates = [datetime.date(2024, 3, 1) + datetime.timedelta(days=int(day)) for day in rng.integers(0, 6, n)]
+    return [{'patient_id': f'P{rng.integers(0, 8)}', 'collection_date': date,
+             'instrument_timestamp': f'{date} {rng.integers(0, 24):02d}:00:00',
+             'calibration_version': f'v{rng.integers(1, 3)}', 'file_hash': f'{i:064x}',
+             'result': str(rng.choice(['Positive', 'Negative', 'Indeterminate'])), 'current': float(i)}
+            for i, date in enumerate(dates)]
+
+@pytest.fixture
+def store():
+    connection = connect(':memory:')
+    save_runs(connection, make_runs(237))
+    return connection
+
+def all_runs(connection):
+    return pd.read_sql_query(f"SELECT {', '.join(COLUMNS)} FROM runs", connection)
+
+def pages(connection, limit, **filters):
+    ids, cursor, count = [], None, 0
+    while True:
+        page, cursor = query_runs(connection, limit=limit, after=cursor, **filters)
+        assert len(page) <= limit
+        ids += page['id'].tolist()
+        count += 1
+        if cursor is None:
+            return ids, count
+
+FILTERS = [{}, {'patient_id': 'P3'}, {'result': 'Positive'}, {'calibration_version': 'v2', 'result': 'Negative'},
+           {'collection_date': (datetime.date(2024, 3, 2), datetime.date(2024, 3, 4))},
+           {'collection_date': (None, datetime.date(2024, 3, 3)), 'result': 'Indeterminate'},
+           {'instrument_timestamp': (datetime.date(2024, 3, 3), datetime.date(2024, 3, 3)), 'patient_id': 'P1'}]
+
+def expected_ids(table, filters):
+    mask = pd.Series(True, index=table.index)
+    for key, value in filters.items():
+        if isinstance(value, tuple):
+            first, last = value
+            column = table[key].str[:10]
+            if first is not None:
+                mask &= column >= first.isoformat()
+            if last is not None:
+                mask &= column <= last.isoformat()
+        else:
+            mask &= table[key] == value
+    table = table[mask]
+    if 'collection_date' in filters:
+        table = table.sort_values(['collection_date', 'id'], ascending=False)
+    elif 'instrument_timestamp' in filters:
+        table = table.sort_values(['instrument_timestamp', 'id'], ascending=False)
+    else:
+        table = table.sort_values('id', ascending=False)
+    return table['id'].tolist()
+
+# Keyset paging must neither skip nor repeat runs that tie on the date
+@pytest.mark.parametrize('filters', FILTERS)
+@pytest.mark.parametrize('limit', [1, 7, 50, 1000])
+def test_paging_covers_every_run_once_in_order(store, filters, limit):
+    expected = expected_ids(all_runs(store), filters)
+    assert expected
+    ids, count = pages(store, limit, **filters)
+    assert ids == expected
+    assert count == len(expected) // limit + 1
+
+# A last page that is exactly full still has a cursor; the page after it is
+# empty and ends the paging
+def test_last_page_exactly_full(store):
+    total = count_runs(store)
+    page, cursor = query_runs(store, limit=total)
+    assert len(page) == total and cursor is not None
+    page, cursor = query_runs(store, limit=total, after=cursor)
+    assert page.empty and cursor is None
+
+@pytest.mark.parametrize('filters', FILTERS)
+def test_count_runs(store, filters):
+    expected = len(expected_ids(all_runs(store), filters))
+    assert count_runs(store, **filters) == expected
+    assert count_runs(store, limit=5, **filters) == min(expected, 5)
+
+def test_unknown_filter(store):
+    with pytest.raises(ValueError, match='unknown filter'):
+        query_runs(store, technique='CA')
+
+# Planner statistics are gathered once the store is large enough
+def test_statistics_are_gathered(tmp_path, monkeypatch):
+    monkeypatch.setattr(results_store, 'STATISTICS_MIN_ROWS', 100)
+    path = str(tmp_path / 'store.sqlite')
+    save_runs(connect(path), make_runs(150))
+    connection = connect(path)
+    stat = connection.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = 'runs' LIMIT 1").fetchone()
+    assert int(stat[0].split()[0]) == 150
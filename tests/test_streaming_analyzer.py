@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import pytest
+
+from analysis import load_calibration_model
+from streaming_analyzer import SteadyStateDetector
+from synthetic import ca_trace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CALIBRATION = load_calibration_model(os.path.join(ROOT, 'data', 'Calibration_curve.csv'))
+OPTIONS = dict(window_size=20, max_drift=0.002, max_noise=0.005, min_time=10.0, hold_samples=15)
+
+# The criteria evaluated sample by sample with np.mean and np.std over explicit
+# windows: the first sample at which they have held for hold_samples samples
+def reference_sample(times, currents, window_size, max_drift, max_noise, min_time, hold_samples, skip_samples=3):
+    w = window_size
+    run = 0
+    for i in range(skip_samples + 2 * w - 1, len(currents)):
+        window = currents[i - w + 1:i + 1]
+        previous = currents[i - 2 * w + 1:i - w + 1]
+        mean = window.mean()
+        settled = (abs(mean - previous.mean()) / abs(mean) <= max_drift
+                   and window.std(ddof=1) / abs(mean) <= max_noise and times[i] >= min_time)
+        run = run + 1 if settled else 0
+        if run >= hold_samples:
+            return i, mean, window.std(ddof=1)
+    return None
+
+def feed_in_chunks(times, currents, sizes, **options):
+    detector = SteadyStateDetector(CALIBRATION, **{**OPTIONS, **options})
+    events = []
+    start = 0
+    for size in sizes:
+        events.append(detector.feed(times[start:start + size], currents[start:start + size]))
+        start += size
+    assert start >= len(currents)
+    return detector, [event for event in events if event is not None]
+
+TIMES, CURRENTS = ca_trace(1500, noise=0.0005)
+
+def test_whole_trace_matches_the_reference():
+    sample, mean, std = reference_sample(TIMES, CURRENTS, **OPTIONS)
+    detector, events = feed_in_chunks(TIMES, CURRENTS, [len(CURRENTS)])
+    assert len(events) == 1
+    event = events[0]
+    assert event.sample == sample and event.time == TIMES[sample]
+    assert event.current == pytest.approx(mean, rel=1e-12)
+    assert event.noise == pytest.approx(std, rel=1e-6)
+    assert event.result in ('Positive', 'Negative')
+
+# Chunks shorter than the skipped samples, than a window, and cutting a run
+# of settled samples in two must all give the event of the whole trace
+@pytest.mark.parametrize('sizes', [[1] * 1500, [2, 1] + [7] * 300, [19, 20, 21] * 30, [39, 40, 41] * 20,
+                                   [200, 1, 1, 1, 1297], 'random'])
+def test_chunked_feed_matches_whole_trace(sizes):
+    if sizes == 'random':
+        sizes = np.random.default_rng(3).integers(1, 60, 200).tolist()
+    _, (whole,) = feed_in_chunks(TIMES, CURRENTS, [len(CURRENTS)])
+    _, events = feed_in_chunks(TIMES, CURRENTS, sizes)
+    assert len(events) == 1
+    assert events[0].sample == whole.sample
+    assert events[0].current == pytest.approx(whole.current, rel=1e-12)
+    # The window variance comes from differences of running sums of squares,
+    # which keep about seven digits over this trace's initial decay
+    assert events[0].noise == pytest.approx(whole.noise, rel=1e-6)
+
+# A run of settled samples cut short starts over; across chunks as within one
+def test_interrupted_run_starts_over():
+    currents = CURRENTS.copy()
+    sample = reference_sample(TIMES, currents, **OPTIONS)[0]
+    currents[sample - 5] *= 1.2
+    expected = reference_sample(TIMES, currents, **OPTIONS)[0]
+    assert expected > sample
+    for sizes in ([len(currents)], [sample - 7, 3, 3] + [1] * 1500):
+        _, events = feed_in_chunks(TIMES, currents, sizes)
+        assert events[0].sample == expected
+
+def test_no_event_while_the_current_drifts():
+    times = np.arange(1000) * 0.1
+    detector, events = feed_in_chunks(times, 1.0 + 0.01 * times, [100] * 10)
+    assert events == [] and detector.event is None
+    assert reference_sample(times, 1.0 + 0.01 * times, **OPTIONS) is None
+
+def test_event_is_emitted_once():
+    seen = []
+    detector, events = feed_in_chunks(TIMES, CURRENTS, [100] * 15, on_steady_state=seen.append)
+    assert len(events) == 1 and seen == events == [detector.event]
+    assert detector.feed(TIMES[:10], CURRENTS[:10]) is None
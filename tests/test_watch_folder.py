@@ -0,0 +1,132 @@
+import os
+
+import batch_analyzer
+import watch_folder
+from analysis import load_calibration_model
+from calibration_store import init_schema as init_calibration_schema, sync_from_csv, add_points
+from results_store import connect
+from synthetic import write_ca_file
+from watch_folder import FolderWatcher, ANALYZED, DUPLICATE, FAILED, RETRIES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _crash(raw, name):
+    os._exit(1)
+
+# Kills its worker the first time it sees a file, as if another file in the
+# pool had, and analyzes it the next time
+def _crash_once(raw, name):
+    marker = name + '.crashed'
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        os._exit(1)
+    return batch_analyzer.analyze_file(raw, name)
+
+def _raise(raw, name):
+    raise MemoryError("out of memory")
+
+# Latest ledger row of each path
+def ledger(connection):
+    rows = connection.execute('SELECT path, status, error FROM ingested_files ORDER BY id')
+    return {path: (status, error) for path, status, error in rows}
+
+def attempts(connection, path):
+    return connection.execute('SELECT COUNT(*) FROM ingested_files WHERE path = ?', (str(path),)).fetchone()[0]
+
+def start_watcher(directory, connection=None):
+    calibration = load_calibration_model(os.path.join(ROOT, 'data', 'Calibration_curve.csv'))
+    connection = connection or connect(':memory:')
+    watcher = FolderWatcher([directory], connection, calibration, settle=0.0, workers=1)
+    watcher.start()
+    return watcher, connection
+
+# Steps until nothing is pending, queued or in flight; a file failed by a dead
+# worker is queued again by the scan of the following step
+def step_until_idle(watcher, rounds=1):
+    for _ in range(rounds):
+        watcher.step()
+        while not watcher.idle:
+            watcher.step(timeout=1.0)
+
+def test_raising_analysis_is_recorded_as_failed(tmp_path, monkeypatch):
+    monkeypatch.setattr(watch_folder, 'analyze_file', _raise)
+    write_ca_file(tmp_path / 'a.csv', 100)
+    watcher, connection = start_watcher(tmp_path)
+    step_until_idle(watcher, rounds=3)
+    watcher.close()
+    assert ledger(connection) == {str(tmp_path / 'a.csv'): (FAILED, 'MemoryError: out of memory')}
+    assert attempts(connection, tmp_path / 'a.csv') == 1
+
+# A file that was in flight when a worker died is analyzed on the next scan
+def test_file_failed_by_a_dead_worker_is_retried(tmp_path, monkeypatch):
+    monkeypatch.setattr(watch_folder, 'analyze_file', _crash_once)
+    write_ca_file(tmp_path / 'a.csv', 100)
+    watcher, connection = start_watcher(tmp_path)
+    step_until_idle(watcher, rounds=2)
+    watcher.close()
+    rows = connection.execute('SELECT status, error FROM ingested_files ORDER BY id').fetchall()
+    assert [status for status, _ in rows] == [FAILED, ANALYZED]
+    assert rows[0][1].startswith('BrokenProcessPool')
+
+# The file that keeps killing its worker fails for good after RETRIES retries;
+# the pool is replaced each time and later files are analyzed
+def test_dead_worker_replaces_the_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(watch_folder, 'analyze_file', _crash)
+    write_ca_file(tmp_path / 'a.csv', 100)
+    watcher, connection = start_watcher(tmp_path)
+    step_until_idle(watcher, rounds=RETRIES + 3)
+    status, error = ledger(connection)[str(tmp_path / 'a.csv')]
+    assert status == FAILED and error.startswith('BrokenProcessPool')
+    assert attempts(connection, tmp_path / 'a.csv') == RETRIES + 1
+
+    monkeypatch.setattr(watch_folder, 'analyze_file', batch_analyzer.analyze_file)
+    write_ca_file(tmp_path / 'b.csv', 120)
+    step_until_idle(watcher)
+    watcher.close()
+    assert ledger(connection)[str(tmp_path / 'b.csv')] == (ANALYZED, None)
+
+# After a restart a failed file is tried again, and a copy of it is not a
+# duplicate of the failure
+def test_failed_file_is_retried_after_a_restart(tmp_path, monkeypatch):
+    monkeypatch.setattr(watch_folder, 'analyze_file', _raise)
+    write_ca_file(tmp_path / 'a.csv', 100)
+    watcher, connection = start_watcher(tmp_path)
+    step_until_idle(watcher)
+    watcher.close()
+    assert ledger(connection)[str(tmp_path / 'a.csv')][0] == FAILED
+
+    monkeypatch.setattr(watch_folder, 'analyze_file', batch_analyzer.analyze_file)
+    (tmp_path / 'copy.csv').write_bytes((tmp_path / 'a.csv').read_bytes())
+    watcher, _ = start_watcher(tmp_path, connection)
+    step_until_idle(watcher)
+    watcher.close()
+    statuses = {os.path.basename(path): status for path, (status, _) in ledger(connection).items()}
+    assert sorted(statuses.values()) == [ANALYZED, DUPLICATE]
+
+# Analyzed files are not read again after a restart
+def test_analyzed_file_is_skipped_after_a_restart(tmp_path):
+    write_ca_file(tmp_path / 'a.csv', 100)
+    watcher, connection = start_watcher(tmp_path)
+    step_until_idle(watcher)
+    watcher.close()
+    watcher, _ = start_watcher(tmp_path, connection)
+    assert watcher.idle
+    watcher.close()
+    assert attempts(connection, tmp_path / 'a.csv') == 1
+
+# The command line can pin the watcher to a stored calibration version, as
+# the batch analyzer's can
+def test_cli_calibration_version(tmp_path):
+    directory = tmp_path / 'in'
+    directory.mkdir()
+    write_ca_file(directory / 'a.csv', 100)
+    db = str(tmp_path / 'store.sqlite')
+    calibration_csv = os.path.join(ROOT, 'data', 'Calibration_curve.csv')
+    store = init_calibration_schema(connect(db))
+    sync_from_csv(store, calibration_csv)
+    add_points(store, [(20.0, 4.1)])
+
+    arguments = [str(directory), '--db', db, '--calibration', calibration_csv, '--workers', '1', '--settle', '0',
+                 '--once']
+    assert watch_folder.main(arguments + ['--calibration-version', 'v1']) == 0
+    assert store.execute('SELECT calibration_version FROM runs').fetchall() == [('v1',)]
@@ -0,0 +1,432 @@
+import argparse
+import collections
+import datetime
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+
+from batch_analyzer import init_worker, analyze_file, add_prediction_intervals, json_safe, RESULT_FIELDS
+from calibration_store import store_calibration
+from instrument_reader import read_metadata
+from results_store import connect, insert_run, DEFAULT_PATH
+
+# Watch-folder ingestion: exports dropped into the watched directories are
+# analyzed with the batch pipeline and stored in the results store, without
+# anyone uploading them.
+#
+#   python watch_folder.py Results/ --output results.csv --log watch.log
+#   python watch_folder.py //lab-share/palmsens --recursive --mode inotify
+#   python watch_folder.py Results/ --once       # handle what is there and exit
+#
+# A file is taken once it has stopped changing: in poll mode when its size and
+# mtime are the same for --settle seconds, in inotify mode (watchdog's native
+# observer) as soon as the writer closes it. Its SHA-256 is then looked up in
+# the ledger table, so a copy of a file already handled is only recorded as a
+# duplicate. The ledger also keeps each file's size and mtime, so after a
+# restart files that have not changed are skipped without being read again.
+#
+# Memory stays bounded during bursts: only paths wait in the queue, at most
+# 2 x --workers files are read and in flight at a time, and the in-memory state
+# covers the files currently in the watched directories.
+#
+# A file whose analysis raises is recorded as failed in the ledger like one the
+# analysis reported an error for. When a worker process dies (out of memory,
+# a crash in native code) every file in flight fails with it and the pool is
+# replaced, so the watcher keeps going; those files are queued again at the
+# next scan, up to RETRIES times, since most of them only shared the pool with
+# the file that killed it. Only analyzed and duplicate files count as handled
+# in the ledger, so failed files are tried again after a restart.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingested_files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    file_hash TEXT NOT NULL,
+    ingested_at TEXT NOT NULL,
+    status TEXT NOT NULL,
+    run_id INTEGER REFERENCES runs (id),
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS ingested_files_path ON ingested_files (path, size, mtime_ns);
+CREATE INDEX IF NOT EXISTS ingested_files_hash ON ingested_files (file_hash);
+"""
+
+# Ledger statuses
+ANALYZED, DUPLICATE, FAILED = 'analyzed', 'duplicate', 'failed'
+
+# Times a file is queued again after a worker died while it was in flight
+RETRIES = 2
+
+log = logging.getLogger('watch_folder')
+
+def init_schema(connection):
+    connection.executescript(SCHEMA)
+    return connection
+
+def _signature(stat):
+    return stat.st_size, stat.st_mtime_ns
+
+# Every file matching pattern under the directories, with its stat signature
+def scan_files(directories, pattern='*.csv', recursive=False):
+    stack = list(directories)
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError as e:
+            log.warning("cannot scan %s: %s", directory, e)
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    if recursive:
+                        stack.append(entry.path)
+                elif fnmatch.fnmatch(entry.name, pattern):
+                    yield os.path.abspath(entry.path), _signature(entry.stat())
+            except OSError:
+                # Removed between the listing and the stat
+                continue
+
+# Results appended as they come: CSV with a header for a new file, or JSON
+# lines for .jsonl
+class ResultWriter:
+    def __init__(self, path):
+        self.path = path
+        self.json_lines = path.endswith('.jsonl')
+        self.header = not os.path.exists(path) or os.path.getsize(path) == 0
+
+    def write(self, rows):
+        if self.json_lines:
+            with open(self.path, 'a') as f:
+                f.writelines(json.dumps(json_safe(row)) + '\n' for row in rows)
+        else:
+            pd.DataFrame(rows, columns=RESULT_FIELDS).to_csv(self.path, mode='a', header=self.header, index=False)
+            self.header = False
+
+# Bridges watchdog events to the watcher: only the paths are kept, in a set,
+# so a burst of events for the same files takes no more memory
+class _EventCollector:
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.lock = threading.Lock()
+        self.changed = set()
+        self.closed = set()
+
+    def dispatch(self, event):
+        if event.is_directory:
+            return
+        path = getattr(event, 'dest_path', '') or event.src_path
+        if not fnmatch.fnmatch(os.path.basename(path), self.pattern):
+            return
+        with self.lock:
+            self.changed.add(os.path.abspath(path))
+            # A closed or moved-in file is complete
+            if event.event_type in ('closed', 'moved'):
+                self.closed.add(os.path.abspath(path))
+
+    def take(self):
+        with self.lock:
+            changed, closed = self.changed, self.closed
+            self.changed, self.closed = set(), set()
+        return changed, closed
+
+class FolderWatcher:
+    def __init__(self, directories, connection, calibration, pattern='*.csv', recursive=False, mode='poll',
+                 interval=0.25, settle=0.5, rescan=30.0, workers=2, peak_method='max', output=None,
+                 executor=None):
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        self.connection = init_schema(connection)
+        self.calibration = calibration
+        self.pattern = pattern
+        self.recursive = recursive
+        self.mode = mode
+        self.interval = interval
+        self.settle = settle
+        self.rescan = rescan
+        self.max_in_flight = 2 * max(workers, 1)
+        self.workers = workers
+        self.peak_method = peak_method
+        self.executor = executor or self._new_executor()
+        self.writer = ResultWriter(output) if output else None
+        # path -> signature of files handled, queued or being analyzed
+        self.handled = {}
+        # path -> (signature, time it was first seen with it, closed by the writer)
+        self.pending = {}
+        self.ready = collections.deque()
+        # future -> (path, signature, hash, raw metadata)
+        self.in_flight = {}
+        self.hashes_in_flight = set()
+        # path -> times queued again after a dead worker
+        self.retries = {}
+        self.observer = None
+        self.events = None
+        self.last_scan = None
+
+    def start(self):
+        if self.mode == 'inotify':
+            try:
+                from watchdog.observers import Observer
+            except ImportError:
+                raise RuntimeError("inotify mode needs the watchdog package (pip install watchdog)") from None
+            self.events = _EventCollector(self.pattern)
+            self.observer = Observer()
+            for directory in self.directories:
+                self.observer.schedule(self.events, directory, recursive=self.recursive)
+            self.observer.start()
+        # Files already there, including any left over from before a restart
+        self.scan()
+
+    def close(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+        if self.in_flight:
+            wait(list(self.in_flight))
+        self._collect(list(self.in_flight))
+        self.executor.shutdown()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                   initargs=(self.calibration, self.peak_method))
+
+    # Replace a pool that lost a worker; it accepts no more work
+    def _replace_executor(self):
+        log.error("a worker process died; starting a new pool")
+        self.executor.shutdown(wait=False)
+        self.executor = self._new_executor()
+
+    # True when the ledger already has this path with this signature, analyzed
+    # or as a duplicate
+    def _in_ledger(self, path, signature):
+        row = self.connection.execute('SELECT 1 FROM ingested_files WHERE path = ? AND size = ? AND mtime_ns = ? '
+                                      'AND status != ? LIMIT 1', (path, *signature, FAILED)).fetchone()
+        return row is not None
+
+    # Note the current signature of a file; it becomes ready once stable
+    def _observe(self, path, signature, now, closed=False):
+        if self.handled.get(path) == signature:
+            return
+        if path not in self.handled and self._in_ledger(path, signature):
+            self.handled[path] = signature
+            return
+        seen = self.pending.get(path)
+        if seen is None or seen[0] != signature:
+            self.pending[path] = (signature, now, closed)
+        elif closed:
+            self.pending[path] = (signature, seen[1], True)
+
+    def scan(self):
+        now = time.monotonic()
+        present = set()
+        for path, signature in scan_files(self.directories, self.pattern, self.recursive):
+            present.add(path)
+            self._observe(path, signature, now)
+        # Forget files that are gone, so the state follows the directories
+        for path in [path for path in self.handled if path not in present]:
+            del self.handled[path]
+        for path in [path for path in self.pending if path not in present]:
+            del self.pending[path]
+        for path in [path for path in self.retries if path not in present]:
+            del self.retries[path]
+        self.last_scan = now
+
+    def _poll_events(self, now):
+        changed, closed = self.events.take()
+        for path in changed:
+            try:
+                signature = _signature(os.stat(path))
+            except OSError:
+                self.pending.pop(path, None)
+                continue
+            self._observe(path, signature, now, path in closed)
+
+    # Move pending files that have stopped changing to the ready queue
+    def _promote(self, now):
+        for path, (signature, since, closed) in list(self.pending.items()):
+            if closed or now - since >= self.settle:
+                try:
+                    current = _signature(os.stat(path))
+                except OSError:
+                    del self.pending[path]
+                    continue
+                if current != signature:
+                    self.pending[path] = (current, now, False)
+                    continue
+                del self.pending[path]
+                # Claimed from here on, so later scans do not queue it again
+                self.handled[path] = signature
+                self.ready.append((path, signature))
+
+    def _record(self, path, signature, digest, status, run_id=None, error=None):
+        self.connection.execute('INSERT INTO ingested_files (path, size, mtime_ns, file_hash, ingested_at, status, '
+                                'run_id, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                (path, *signature, digest, datetime.datetime.now().isoformat(timespec='seconds'),
+                                 status, run_id, error))
+
+    def _submit(self):
+        while self.ready and len(self.in_flight) < self.max_in_flight:
+            path, signature = self.ready.popleft()
+            try:
+                with open(path, 'rb') as f:
+                    raw = f.read()
+                current = _signature(os.stat(path))
+            except OSError as e:
+                log.warning("cannot read %s: %s", path, e)
+                continue
+            if current != signature:
+                # Written to again since it looked finished
+                self.handled.pop(path, None)
+                self.pending[path] = (current, time.monotonic(), False)
+                continue
+            digest = hashlib.sha256(raw).hexdigest()
+            known = self.connection.execute('SELECT path FROM ingested_files WHERE file_hash = ? AND status = ? '
+                                            'LIMIT 1', (digest, ANALYZED)).fetchone()
+            if known is not None or digest in self.hashes_in_flight:
+                with self.connection:
+                    self._record(path, signature, digest, DUPLICATE)
+                log.info("%s: duplicate of %s", path, known[0] if known else "a file being analyzed")
+                continue
+            try:
+                metadata = read_metadata(raw)
+            except ValueError:
+                metadata = {}
+            try:
+                future = self.executor.submit(analyze_file, raw, path)
+            except BrokenProcessPool:
+                self._replace_executor()
+                future = self.executor.submit(analyze_file, raw, path)
+            self.in_flight[future] = (path, signature, digest, metadata)
+            self.hashes_in_flight.add(digest)
+
+    # Store the results of finished analyses: the run and its ledger row in
+    # one transaction, so a restart never sees one without the other
+    def _collect(self, futures):
+        rows = [self._result(future) for future in futures]
+        broken = [future for future in futures if isinstance(future.exception(), BrokenProcessPool)]
+        if broken:
+            self._replace_executor()
+        for future in broken:
+            path = self.in_flight[future][0]
+            if self.retries.get(path, 0) < RETRIES:
+                self.retries[path] = self.retries.get(path, 0) + 1
+                # No longer claimed, so the next scan queues it again
+                self.handled.pop(path, None)
+        add_prediction_intervals(rows, self.calibration)
+        with self.connection:
+            for future, row in zip(futures, rows):
+                path, signature, digest, metadata = self.in_flight.pop(future)
+                self.hashes_in_flight.discard(digest)
+                if row['error']:
+                    self._record(path, signature, digest, FAILED, error=row['error'])
+                    continue
+                run_id = insert_run(self.connection, {
+                    'instrument_timestamp': metadata.get('Date and time measurement'),
+                    'calibration_version': self.calibration.version, 'file_name': os.path.basename(path),
+                    'file_hash': digest, 'technique': row['technique'], 'current': row['current'],
+                    'concentration': row['concentration'], 'result': row['result']})
+                self._record(path, signature, digest, ANALYZED, run_id=run_id)
+        for row in rows:
+            if row['error']:
+                log.warning("%s: %s", row['file'], row['error'])
+            else:
+                log.info("%s: %s (%s, %.4g µA, %.4g nM)", row['file'], row['result'], row['call'],
+                         row['current'], row['concentration'])
+        if self.writer is not None and rows:
+            self.writer.write(rows)
+        return rows
+
+    # The row of a finished analysis, or a row with the error it raised
+    def _result(self, future):
+        try:
+            return future.result()
+        except Exception as e:
+            row = dict.fromkeys(RESULT_FIELDS)
+            row['file'] = self.in_flight[future][0]
+            row['error'] = f"{type(e).__name__}: {e}"
+            return row
+
+    # One round: pick up changes, queue stable files, submit and collect.
+    # Waits up to timeout seconds for an analysis to finish.
+    def step(self, timeout=0.0):
+        now = time.monotonic()
+        if self.events is None or now - self.last_scan >= self.rescan:
+            self.scan()
+        else:
+            self._poll_events(now)
+        self._promote(now)
+        self._submit()
+        done = []
+        if self.in_flight:
+            done, _ = wait(list(self.in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+        return self._collect(list(done)) if done else []
+
+    @property
+    def idle(self):
+        return not (self.pending or self.ready or self.in_flight)
+
+    def run(self, stop=None, once=False):
+        stop = stop or threading.Event()
+        self.start()
+        try:
+            while not stop.is_set():
+                self.step(timeout=self.interval)
+                if once and self.idle:
+                    break
+                if not self.in_flight:
+                    stop.wait(self.interval)
+        finally:
+            self.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze PalmSens exports as they appear in watched folders.")
+    parser.add_argument('directories', nargs='+', help="Directories to watch")
+    parser.add_argument('--pattern', default='*.csv', help="File name pattern")
+    parser.add_argument('--recursive', action='store_true', help="Also watch subdirectories")
+    parser.add_argument('--mode', choices=['poll', 'inotify'], default='poll',
+                        help="Poll the directories, or use file system events (watchdog; inotify on Linux)")
+    parser.add_argument('--interval', type=float, default=0.25, help="Seconds between polls")
+    parser.add_argument('--settle', type=float, default=0.5,
+                        help="Seconds a file must stay unchanged before it is analyzed (unless closed)")
+    parser.add_argument('--rescan', type=float, default=30.0,
+                        help="Seconds between full scans in inotify mode, for missed events")
+    parser.add_argument('--workers', type=int, default=2, help="Worker processes")
+    parser.add_argument('--db', default=DEFAULT_PATH, help="SQLite results store and ledger")
+    parser.add_argument('--calibration', default='data/Calibration_curve.csv',
+                        help="Calibration curve CSV, added to the store as a new version when it changes")
+    parser.add_argument('--calibration-version', help="Classify with this stored version (default: the latest)")
+    parser.add_argument('--peak-method', choices=['max', 'baseline'], default='max',
+                        help="CV peak: raw maximum, or baseline-corrected median over scans")
+    parser.add_argument('--output', help="Also append results to this .csv or .jsonl file")
+    parser.add_argument('--log', help="Log file (default: stderr)")
+    parser.add_argument('--once', action='store_true', help="Handle the files present now and exit")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(filename=args.log, level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    calibration = store_calibration(args.calibration, args.db, args.calibration_version, with_points=False)
+    connection = connect(args.db)
+    watcher = FolderWatcher(args.directories, connection, calibration, args.pattern, args.recursive, args.mode,
+                            args.interval, args.settle, args.rescan, args.workers, args.peak_method, args.output)
+    log.info("watching %s (%s mode), calibration %s", ', '.join(watcher.directories), args.mode, calibration.version)
+    # Finish the files in flight on SIGTERM as on Ctrl+C
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    try:
+        watcher.run(stop, once=args.once)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())